@@ -4,12 +4,12 @@ Complete Reddit Analyzer Bot with all features
 """
 
 import os
+import re
 import sys
 import logging
 import asyncio
 import time
 from typing import Dict, Any
-from datetime import datetime, timedelta
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application,
@@ -48,6 +48,9 @@ REDDIT_API_URL = os.getenv('REDDIT_API_URL', 'https://redditanalyzer-kappa.verce
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY')
 
+# Valid subreddit names: 2-21 letters, digits or underscores (same rule as the API)
+SUBREDDIT_NAME_RE = re.compile(r'\b\w{2,21}\b', re.ASCII)
+
 # Global application instance
 application = None
 db = None
@@ -102,8 +105,9 @@ async def init_application():
     # Initialize database (Supabase doesn't need DATABASE_URL parameter)
     if db is None:
         logger.info("Initializing database...")
-        db = Database()
-        await db.init_pool()
+        database = Database()
+        await database.init_pool()  # raises if the schema is missing; retried next update
+        db = database
 
     # Initialize Reddit API and AI Analyzer
     if reddit_api is None:
@@ -138,6 +142,10 @@ async def process_update(update_data: Dict[str, Any]):
     except Exception as e:
         logger.error(f"Error processing update: {e}")
         raise
+    finally:
+        # This update's event loop ends with the request; close its connections first
+        if ai_analyzer is not None:
+            await ai_analyzer.close()
 
 # ========== HELPER FUNCTIONS ==========
 
@@ -148,6 +156,34 @@ def sanitize_error_message(error_msg: str) -> str:
     error_msg = re.sub(r'/[\w/]+\.[\w]+', '[file path]', error_msg)
     return error_msg
 
+# Streamed AI replies are previewed with at most one edit per interval,
+# and only once enough new text has arrived (Telegram rate-limits edits)
+STREAM_EDIT_CHARS = 200
+STREAM_EDIT_INTERVAL = 1.0
+_TAG_RE = re.compile(r'<[^>]*>?')
+
+async def stream_to_message(msg, header: str, chunks) -> str:
+    """Show an AI reply in msg as it streams in and return the full text.
+
+    Previews are sent as plain text, since a half-generated reply can end
+    inside an HTML tag; the caller does the final HTML edit.
+    """
+    parts = []
+    length = shown = 0
+    last_edit = time.monotonic()
+    async for piece in chunks:
+        parts.append(piece)
+        length += len(piece)
+        now = time.monotonic()
+        if (length - shown >= STREAM_EDIT_CHARS and now - last_edit >= STREAM_EDIT_INTERVAL
+                and len(header) + length < 4000):
+            try:
+                await msg.edit_text(_TAG_RE.sub('', header + "\n" + "".join(parts)) + " ▌")
+            except Exception as e:
+                logger.debug(f"Skipping stream preview edit: {e}")
+            shown, last_edit = length, now
+    return "".join(parts)
+
 # ========== BASIC COMMAND HANDLERS ==========
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -274,7 +310,7 @@ Use /buy to purchase more coins!
 """
         else:
             if expires_at:
-                expiry_date = datetime.fromisoformat(expires_at.replace('Z', '+00:00')).strftime('%B %d, %Y')
+                expiry_date = expires_at.strftime('%B %d, %Y')
                 message = f"""
 💰 <b>Your Coin Balance</b>
 
@@ -342,13 +378,16 @@ async def buy_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # ========== ANALYSIS COMMANDS ==========
 
+async def get_coins_and_cost(user_id: int, command: str):
+    """Fetch the user's coins and the command's cost concurrently"""
+    return await asyncio.gather(db.get_user_coins(user_id), db.get_command_cost(command))
+
 async def analyze_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /analyze command"""
     user = update.effective_user
 
     # Check coins
-    coins_data = await db.get_user_coins(user.id)
-    command_cost = await db.get_command_cost('analyze')
+    coins_data, command_cost = await get_coins_and_cost(user.id, 'analyze')
 
     if not coins_data['is_admin'] and coins_data['balance'] < command_cost:
         await update.message.reply_text(
@@ -432,7 +471,9 @@ Posts/day: {result['avg_posts_per_day']:.1f}
 
 Provide a verdict on whether this is good for content marketing."""
 
-            ai_response = await ai_analyzer.analyze_subreddit(ai_prompt)
+            ai_response = await stream_to_message(
+                msg, metrics_overview, ai_analyzer.stream_subreddit_analysis(ai_prompt)
+            )
             final_response = metrics_overview + "\n" + ai_response
 
             if len(final_response) > 4000:
@@ -455,8 +496,7 @@ async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
 
     # Check coins
-    coins_data = await db.get_user_coins(user.id)
-    command_cost = await db.get_command_cost('search')
+    coins_data, command_cost = await get_coins_and_cost(user.id, 'search')
 
     if not coins_data['is_admin'] and coins_data['balance'] < command_cost:
         await update.message.reply_text(
@@ -518,8 +558,7 @@ async def niche_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /niche command"""
     user = update.effective_user
 
-    coins_data = await db.get_user_coins(user.id)
-    command_cost = await db.get_command_cost('niche')
+    coins_data, command_cost = await get_coins_and_cost(user.id, 'niche')
 
     if not coins_data['is_admin'] and coins_data['balance'] < command_cost:
         await update.message.reply_text(
@@ -578,8 +617,7 @@ async def compare_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /compare command"""
     user = update.effective_user
 
-    coins_data = await db.get_user_coins(user.id)
-    command_cost = await db.get_command_cost('compare')
+    coins_data, command_cost = await get_coins_and_cost(user.id, 'compare')
 
     if not coins_data['is_admin'] and coins_data['balance'] < command_cost:
         await update.message.reply_text(
@@ -596,6 +634,14 @@ async def compare_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     subreddits_str = context.args[0]
 
+    # Drop blanks/duplicates while keeping order
+    subreddits = list(dict.fromkeys(SUBREDDIT_NAME_RE.findall(subreddits_str)))
+    if not subreddits:
+        await update.message.reply_text(
+            "Usage: /compare <sub1,sub2,sub3>\nExample: /compare python,javascript,golang"
+        )
+        return
+
     if not coins_data['is_admin']:
         await db.deduct_coins(user.id, command_cost, 'compare', f"Compared {subreddits_str}")
 
@@ -605,14 +651,16 @@ async def compare_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
     try:
-        result = await reddit_api.analyze_multiple(subreddits_str)
-
-        if "error" in result:
-            await msg.edit_text(f"❌ Error: {escape_html(result['error'])}", parse_mode=ParseMode.HTML)
+        # One request per subreddit, run side by side
+        results = await reddit_api.analyze_many(subreddits)
+        comparisons = [result for result in results if result.get('success')]
+
+        if not comparisons:
+            error = next((result['error'] for result in results if 'error' in result),
+                         "No subreddits could be analyzed")
+            await msg.edit_text(f"❌ Error: {escape_html(error)}", parse_mode=ParseMode.HTML)
             return
 
-        comparisons = result.get('results', [])
-
         response = "<b>📊 Subreddit Comparison</b>\n\n"
 
         for comp in comparisons:
@@ -628,7 +676,9 @@ async def compare_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         if ai_analyzer:
             ai_prompt = f"Compare these subreddits and recommend which is best:\n\n{response}"
-            ai_response = await ai_analyzer.compare_subreddits(ai_prompt)
+            ai_response = await stream_to_message(
+                msg, response, ai_analyzer.stream_comparison(ai_prompt)
+            )
             final_response = response + "\n" + ai_response
 
             if len(final_response) > 4000:
@@ -647,8 +697,7 @@ async def rules_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /rules command"""
     user = update.effective_user
 
-    coins_data = await db.get_user_coins(user.id)
-    command_cost = await db.get_command_cost('rules')
+    coins_data, command_cost = await get_coins_and_cost(user.id, 'rules')
 
     if not coins_data['is_admin'] and coins_data['balance'] < command_cost:
         await update.message.reply_text(
@@ -700,8 +749,7 @@ async def requirements_command(update: Update, context: ContextTypes.DEFAULT_TYP
     """Handle /requirements command"""
     user = update.effective_user
 
-    coins_data = await db.get_user_coins(user.id)
-    command_cost = await db.get_command_cost('requirements')
+    coins_data, command_cost = await get_coins_and_cost(user.id, 'requirements')
 
     if not coins_data['is_admin'] and coins_data['balance'] < command_cost:
         await update.message.reply_text(
@@ -749,8 +797,7 @@ async def flairs_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /flairs command"""
     user = update.effective_user
 
-    coins_data = await db.get_user_coins(user.id)
-    command_cost = await db.get_command_cost('flairs')
+    coins_data, command_cost = await get_coins_and_cost(user.id, 'flairs')
 
     if not coins_data['is_admin'] and coins_data['balance'] < command_cost:
         await update.message.reply_text(f"⚠️ Insufficient coins! Cost: {command_cost} coins.")
@@ -795,8 +842,7 @@ async def scrape_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /scrape command"""
     user = update.effective_user
 
-    coins_data = await db.get_user_coins(user.id)
-    command_cost = await db.get_command_cost('scrape')
+    coins_data, command_cost = await get_coins_and_cost(user.id, 'scrape')
 
     if not coins_data['is_admin'] and coins_data['balance'] < command_cost:
         await update.message.reply_text(f"⚠️ Insufficient coins! Cost: {command_cost} coins.")
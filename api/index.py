@@ -3,13 +3,19 @@ Unified Flask API for Vercel deployment
 Combines Reddit Analysis API + Telegram Webhooks + Stripe Payments
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, abort, request, jsonify, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 import os
+import re
 import sys
+import hmac
 import logging
 import asyncio
 import stripe
+from dataclasses import dataclass
 from datetime import datetime, timedelta
+from functools import wraps
+from typing import Optional
 from telegram import Update, Bot
 from telegram.ext import Application
 
@@ -31,10 +37,62 @@ except ImportError:
 # Import Reddit scraper
 from reddit_scraper import RedditScraper
 
+# Use orjson for request/response bodies when available
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 app = Flask(__name__)
+if orjson is not None:
+    app.json = OrjsonProvider(app)
+
+
+@dataclass(frozen=True)
+class ApiConfig:
+    """Environment configuration read once at import"""
+    telegram_bot_token: Optional[str]
+    stripe_secret_key: Optional[str]
+    stripe_webhook_secret: Optional[str]
+    is_dev: bool
+    debug_token: Optional[str]
+
+
+CONFIG = ApiConfig(
+    telegram_bot_token=os.environ.get('TELEGRAM_BOT_TOKEN'),
+    stripe_secret_key=os.environ.get('STRIPE_SECRET_KEY'),
+    stripe_webhook_secret=os.environ.get('STRIPE_WEBHOOK_SECRET'),
+    is_dev=os.environ.get('ENV') == 'dev',
+    debug_token=os.environ.get('DEBUG_TOKEN'),
+)
+
+# Environment variables reported by /debug-env
+DEBUG_ENV_VARS = (
+    'TELEGRAM_BOT_TOKEN',
+    'DATABASE_URL',
+    'OPENAI_API_KEY',
+    'STRIPE_SECRET_KEY',
+    'REDDIT_CLIENT_ID',
+    'REDDIT_CLIENT_SECRET',
+    'REDDIT_USER_AGENT',
+    'SUPABASE_URL',
+    'SUPABASE_ANON_KEY',
+)
+ENV_STATUS = {name: 'SET' if os.environ.get(name) else 'NOT SET' for name in DEBUG_ENV_VARS}
 
 # Initialize Stripe
-stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
+stripe.api_key = CONFIG.stripe_secret_key
 
 # Initialize database (will be initialized per request)
 db = None
@@ -43,10 +101,22 @@ async def get_db():
     """Get or create database instance"""
     global db
     if db is None:
-        db = Database()
-        await db.init_pool()
+        database = Database()
+        await database.init_pool()  # raises if the schema is missing; retried next request
+        db = database
     return db
 
+def debug_only(func):
+    """Hide debug endpoints unless running in dev or given the X-Debug-Token header"""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not CONFIG.is_dev:
+            token = request.headers.get('X-Debug-Token', '')
+            if not CONFIG.debug_token or not hmac.compare_digest(token, CONFIG.debug_token):
+                abort(404)
+        return func(*args, **kwargs)
+    return wrapper
+
 # ========== HEALTH & STATUS ENDPOINTS ==========
 
 @app.route('/')
@@ -70,42 +140,28 @@ def health():
     return jsonify({'status': 'healthy', 'timestamp': datetime.now().isoformat()})
 
 @app.route('/debug-env')
+@debug_only
 def debug_env():
     """Debug endpoint to check environment variables"""
-    env_status = {
-        'TELEGRAM_BOT_TOKEN': 'SET' if os.getenv('TELEGRAM_BOT_TOKEN') else 'NOT SET',
-        'DATABASE_URL': 'SET' if os.getenv('DATABASE_URL') else 'NOT SET',
-        'OPENAI_API_KEY': 'SET' if os.getenv('OPENAI_API_KEY') else 'NOT SET',
-        'STRIPE_SECRET_KEY': 'SET' if os.getenv('STRIPE_SECRET_KEY') else 'NOT SET',
-        'REDDIT_CLIENT_ID': 'SET' if os.getenv('REDDIT_CLIENT_ID') else 'NOT SET',
-        'REDDIT_CLIENT_SECRET': 'SET' if os.getenv('REDDIT_CLIENT_SECRET') else 'NOT SET',
-        'REDDIT_USER_AGENT': 'SET' if os.getenv('REDDIT_USER_AGENT') else 'NOT SET',
-        'SUPABASE_URL': 'SET' if os.getenv('SUPABASE_URL') else 'NOT SET',
-        'SUPABASE_ANON_KEY': 'SET' if os.getenv('SUPABASE_ANON_KEY') else 'NOT SET',
-    }
     return jsonify({
         'status': 'ok',
-        'environment_variables': env_status,
+        'environment_variables': ENV_STATUS,
         'python_version': sys.version
     })
 
 @app.route('/test-bot-import')
+@debug_only
 def test_bot_import():
     """Test if bot_handler can be imported"""
     try:
-        # Add api directory to path for Vercel
-        api_dir = os.path.dirname(__file__)
-        if api_dir not in sys.path:
-            sys.path.insert(0, api_dir)
-
-        # Try to import bot_handler
+        # api directory is already on sys.path from the module-level import
         from bot_handler import process_update
 
         return jsonify({
             'status': 'ok',
             'bot_handler': 'imported successfully',
             'process_update': str(type(process_update)),
-            'api_dir': api_dir
+            'api_dir': os.path.dirname(__file__)
         })
     except Exception as e:
         return jsonify({
@@ -175,6 +231,17 @@ def run_async(coro):
             except Exception as e:
                 logger.warning(f"Error closing event loop: {e}")
 
+# Valid subreddit names: 2-21 letters, digits or underscores
+SUBREDDIT_NAME_RE = re.compile(r'\b\w{2,21}\b', re.ASCII)
+
+def ndjson_response(results):
+    """Stream an iterable of result dicts as newline-delimited JSON"""
+    def generate():
+        for result in results:
+            yield app.json.dumps(result) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 @app.route('/reddit/analyze', methods=['POST'])
 def reddit_analyze():
     """Analyze a subreddit"""
@@ -230,20 +297,20 @@ def reddit_search_and_analyze():
         async def search_and_analyze_async():
             scraper = get_reddit_scraper()
 
-            # Search for subreddits
-            search_result = await scraper.search_subreddits(query, limit)
+            # Search for subreddits (only the 10 largest get analyzed)
+            search_result = await scraper.search_subreddits(query, limit, top=10)
 
             if not search_result.get('success'):
                 return search_result
 
-            # Analyze top subreddits
-            subreddits = search_result['results'][:10]  # Analyze top 10
-            analyzed = []
-
-            for sub in subreddits:
-                analysis = await scraper.analyze_subreddit(sub['display_name'], days)
-                if analysis.get('success'):
-                    analyzed.append(analysis)
+            # Analyze them from a single combined listing
+            subreddits = search_result['results']
+            batch = await scraper.analyze_subreddits_batch(
+                [sub['display_name'] for sub in subreddits],
+                days,
+                subscribers={sub['display_name']: sub['subscribers'] for sub in subreddits}
+            )
+            analyzed = [analysis for analysis in batch if analysis.get('success')]
 
             return {
                 'success': True,
@@ -266,13 +333,25 @@ def reddit_analyze_multiple():
         subreddits_str = data.get('subreddits', '')
         days = data.get('days', 7)
 
-        subreddits = [s.strip() for s in subreddits_str.split(',')]
+        # Extract valid names and drop blanks/duplicates while keeping order
+        subreddits = list(dict.fromkeys(SUBREDDIT_NAME_RE.findall(subreddits_str)))
 
         if not subreddits:
             return jsonify({'error': 'Subreddits required'}), 400
 
+        scraper = get_reddit_scraper()
+
+        # Stream each analysis as NDJSON as soon as it is ready
+        if data.get('stream'):
+            def stream_results():
+                for subreddit in subreddits:
+                    result = run_async(scraper.analyze_subreddit(subreddit, days))
+                    if result.get('success'):
+                        yield result
+
+            return ndjson_response(stream_results())
+
         async def analyze_multiple_async():
-            scraper = get_reddit_scraper()
             results = []
 
             for subreddit in subreddits:
@@ -374,20 +453,43 @@ def reddit_scrape():
 
 # ========== STRIPE WEBHOOK ENDPOINT ==========
 
+async def _notify_payment_success(database, user_id: int, total_coins: int):
+    """Send payment confirmation to user via Telegram"""
+    try:
+        bot = Bot(token=CONFIG.telegram_bot_token)
+
+        # Get user's new balance
+        user_coins = await database.get_user_coins(user_id)
+
+        message = (
+            f"✅ <b>Payment Successful!</b>\n\n"
+            f"🪙 {total_coins} coins have been added to your account!\n"
+            f"💰 New balance: {user_coins['balance']} coins\n\n"
+            f"Use /balance to check your balance."
+        )
+
+        await bot.send_message(
+            chat_id=user_id,
+            text=message,
+            parse_mode='HTML'
+        )
+        logger.info(f"Notification sent to user {user_id}")
+    except Exception as e:
+        logger.error(f"Failed to notify user: {e}")
+
 @app.route('/stripe-webhook', methods=['POST'])
 def stripe_webhook():
     """Handle Stripe payment webhooks"""
-    payload = request.get_data(as_text=True)
+    payload = request.get_data(cache=False)
     sig_header = request.headers.get('Stripe-Signature')
-    webhook_secret = os.getenv('STRIPE_WEBHOOK_SECRET')
 
     try:
         # Verify webhook signature
         event = stripe.Webhook.construct_event(
-            payload, sig_header, webhook_secret
+            payload, sig_header, CONFIG.stripe_webhook_secret
         )
 
-        logger.info(f"Received webhook event: {event['type']}")
+        logger.info("Received webhook event: %s", event['type'])
 
         # Handle successful payment
         if event['type'] == 'checkout.session.completed':
@@ -403,47 +505,26 @@ def stripe_webhook():
             async def process_payment():
                 database = await get_db()
 
-                success = await database.add_coins(
-                    user_id=user_id,
-                    amount=total_coins,
-                    transaction_type='purchase',
-                    description=f"Purchased {package_name}",
-                    extend_expiry=True
+                # Payment row, credit and ledger entry in one call; a session
+                # completed by an earlier (retried) delivery credits nothing
+                amount_total = session.get('amount_total')
+                success = await database.complete_purchase(
+                    session['id'],
+                    session.get('payment_intent'),
+                    user_id,
+                    total_coins,
+                    f"Purchased {package_name}",
+                    amount_usd=amount_total / 100 if amount_total is not None else None
                 )
 
-                if success:
+                if success is None:
+                    logger.info(f"Session {session['id']} already completed, ignoring redelivery")
+                    return True
+                elif success:
                     logger.info(f"Successfully added {total_coins} coins to user {user_id}")
 
-                    # Update payment history
-                    await database.update_payment_status(
-                        session_id=session['id'],
-                        status='completed',
-                        payment_intent=session.get('payment_intent')
-                    )
-
-                    # Send notification to user via Telegram
-                    try:
-                        telegram_token = os.getenv('TELEGRAM_BOT_TOKEN')
-                        bot = Bot(token=telegram_token)
-
-                        # Get user's new balance
-                        user_coins = await database.get_user_coins(user_id)
-
-                        message = (
-                            f"✅ <b>Payment Successful!</b>\n\n"
-                            f"🪙 {total_coins} coins have been added to your account!\n"
-                            f"💰 New balance: {user_coins['balance']} coins\n\n"
-                            f"Use /balance to check your balance."
-                        )
-
-                        await bot.send_message(
-                            chat_id=user_id,
-                            text=message,
-                            parse_mode='HTML'
-                        )
-                        logger.info(f"Notification sent to user {user_id}")
-                    except Exception as e:
-                        logger.error(f"Failed to notify user: {e}")
+                    # Send payment confirmation to user
+                    await _notify_payment_success(database, user_id, total_coins)
                     return True
                 else:
                     logger.error(f"Failed to add coins to user {user_id}")
@@ -535,6 +616,9 @@ def get_user_coins(user_id):
             return await database.get_user_coins(user_id)
 
         coins = run_async(get_coins())
+        # The database layer returns a datetime; keep the ISO string in the API
+        if coins.get('expires_at') is not None:
+            coins = {**coins, 'expires_at': coins['expires_at'].isoformat()}
         return jsonify(coins)
     except Exception as e:
         logger.error(f"Error getting user coins: {e}")
@@ -635,10 +719,10 @@ def get_all_users():
     try:
         async def get_users():
             database = await get_db()
-            return await database.get_all_users()
+            return await database.get_all_users_json()
 
-        users = run_async(get_users())
-        return jsonify(users)
+        # The database returns the body already serialised
+        return Response(run_async(get_users()), mimetype='application/json')
     except Exception as e:
         logger.error(f"Error getting users: {e}")
         return jsonify({'error': str(e)}), 500
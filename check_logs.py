@@ -3,9 +3,16 @@ Check if Telegram is sending updates to the bot
 """
 
 import os
+import json
 import requests
 from dotenv import load_dotenv
 
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
 load_dotenv()
 
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
@@ -21,7 +28,7 @@ def check_webhook_info():
 
     response = requests.get(url)
     if response.status_code == 200:
-        data = response.json()
+        data = json_loads(response.content)
         if data.get('ok'):
             info = data.get('result', {})
 
@@ -104,7 +111,7 @@ def check_database():
         response = requests.get(url, timeout=15)
 
         if response.status_code == 200:
-            data = response.json()
+            data = json_loads(response.content)
             status = data.get('status')
             database = data.get('database')
 
@@ -127,7 +134,7 @@ def check_database():
         else:
             print(f"\n   ❌ Database check failed: HTTP {response.status_code}")
             try:
-                error_data = response.json()
+                error_data = json_loads(response.content)
                 print(f"   Error: {error_data.get('error', 'Unknown')}")
             except:
                 print(f"   Response: {response.text[:200]}")
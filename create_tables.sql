@@ -67,16 +67,30 @@ CREATE TABLE IF NOT EXISTS command_costs (
 );
 
 -- 6. Usage logs table (track all command usage)
+-- Partitioned by month. The asyncpg backend (lib/database.py) creates monthly
+-- partitions on startup; the Supabase REST backend does not, so with it every
+-- row lands in the default partition below
 CREATE TABLE IF NOT EXISTS usage_logs (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     user_id BIGINT REFERENCES users(user_id),
     username TEXT,
     first_name TEXT,
     command TEXT,
     params TEXT,
     coins_spent INTEGER DEFAULT 0,
-    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
+    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+-- Catches rows outside the monthly partitions. Partitions are UNLOGGED:
+-- usage logs are analytics, so skipping WAL is worth losing recent rows on a crash.
+-- Installs from before partitioning keep usage_logs as a plain table; skip it there
+DO $$
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'usage_logs'::regclass) = 'p' THEN
+        CREATE UNLOGGED TABLE IF NOT EXISTS usage_logs_default PARTITION OF usage_logs DEFAULT;
+    END IF;
+END $$;
 
 -- Index for faster log queries
 CREATE INDEX IF NOT EXISTS idx_usage_logs_timestamp
@@ -99,6 +113,207 @@ CREATE TABLE IF NOT EXISTS bot_stats (
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- BRIN index for time-range scans on usage_logs (append-mostly)
+CREATE INDEX IF NOT EXISTS idx_usage_logs_timestamp_brin
+ON usage_logs USING brin(timestamp) WITH (pages_per_range = 32);
+
+-- Rolling 7-day command counts (refreshed by the bot's statistics query)
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_top_commands_7d AS
+SELECT command, COUNT(*) AS cnt
+FROM usage_logs
+WHERE timestamp > CURRENT_TIMESTAMP - INTERVAL '7 days'
+GROUP BY command;
+
+-- Unique index required by REFRESH MATERIALIZED VIEW CONCURRENTLY
+CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_top_commands_7d_command
+ON mv_top_commands_7d(command);
+
+-- BRIN index for time-range scans on coin_transactions (append-only)
+CREATE INDEX IF NOT EXISTS idx_coin_transactions_created_at_brin
+ON coin_transactions USING brin(created_at);
+
+-- Webhook lookups by checkout session; one payment row per session
+CREATE UNIQUE INDEX IF NOT EXISTS idx_payment_history_session
+ON payment_history(stripe_session_id);
+
+-- Users with coin expiry evaluated in the database (Supabase REST backend's balance read);
+-- effective_balance is already zero for expired coins
+CREATE OR REPLACE VIEW users_with_expiry AS
+SELECT user_id, coin_balance, coins_expire_at, is_admin,
+       COALESCE(coins_expire_at <= LOCALTIMESTAMP, FALSE) AS is_expired,
+       CASE WHEN coins_expire_at <= LOCALTIMESTAMP THEN 0 ELSE coin_balance END AS effective_balance
+FROM users;
+
+-- ========================================
+-- Functions (called over RPC by the Supabase REST backend)
+-- ========================================
+
+-- Atomic coin spend: checks admin/expiry/balance, updates and logs in one call.
+-- Admins keep their balance. Returns {"ok", "new_balance", "is_admin"}.
+CREATE OR REPLACE FUNCTION deduct_coins_atomic(p_user_id BIGINT, p_amount INTEGER, p_description TEXT)
+RETURNS JSONB LANGUAGE sql AS $$
+    WITH upd AS (
+        UPDATE users SET
+            coin_balance = CASE WHEN is_admin THEN coin_balance
+                                ELSE coin_balance - p_amount END,
+            last_seen = CURRENT_TIMESTAMP
+        WHERE user_id = p_user_id
+          AND (is_admin OR (
+              coin_balance >= p_amount
+              AND (coins_expire_at IS NULL OR coins_expire_at > LOCALTIMESTAMP)
+          ))
+        RETURNING coin_balance, is_admin
+    ), tx AS (
+        INSERT INTO coin_transactions
+            (user_id, transaction_type, amount, balance_after, description)
+        SELECT p_user_id, 'spend', -p_amount,
+               CASE WHEN is_admin THEN 999999 ELSE coin_balance END, p_description
+        FROM upd
+        RETURNING balance_after
+    )
+    SELECT jsonb_build_object(
+        'ok', EXISTS(SELECT 1 FROM upd),
+        'new_balance', (SELECT balance_after FROM tx),
+        'is_admin', COALESCE((SELECT is_admin FROM upd), FALSE)
+    );
+$$;
+
+-- Atomic coin credit plus ledger row; admins are left untouched (and count as ok).
+-- With p_extend the expiry moves to p_days from now. Returns {"ok", "new_balance"}.
+CREATE OR REPLACE FUNCTION add_coins_atomic(p_user_id BIGINT, p_amount INTEGER, p_type TEXT,
+                                            p_extend BOOLEAN, p_days INTEGER, p_description TEXT)
+RETURNS JSONB LANGUAGE sql AS $$
+    WITH upd AS (
+        UPDATE users SET
+            coin_balance = COALESCE(coin_balance, 0) + p_amount,
+            coins_expire_at = CASE WHEN p_extend THEN LOCALTIMESTAMP + make_interval(days => p_days)
+                                   ELSE coins_expire_at END,
+            total_coins_purchased = total_coins_purchased + CASE WHEN p_extend THEN p_amount ELSE 0 END,
+            last_seen = CURRENT_TIMESTAMP
+        WHERE user_id = p_user_id AND is_admin IS NOT TRUE
+        RETURNING coin_balance
+    ), tx AS (
+        INSERT INTO coin_transactions
+            (user_id, transaction_type, amount, balance_after, description)
+        SELECT p_user_id, p_type, p_amount, coin_balance, p_description
+        FROM upd
+        RETURNING balance_after
+    )
+    SELECT jsonb_build_object(
+        'ok', EXISTS(SELECT 1 FROM upd)
+              OR EXISTS(SELECT 1 FROM users WHERE user_id = p_user_id AND is_admin),
+        'new_balance', (SELECT balance_after FROM tx)
+    );
+$$;
+
+-- Checkout paid: upserts the payment row to 'completed' and credits the coins
+-- (expiry moves to p_days from now) with a ledger row; admins are left untouched.
+-- A session that is already completed credits nothing (redelivered webhooks).
+-- Returns {"fresh", "ok"}.
+CREATE OR REPLACE FUNCTION complete_purchase_atomic(p_session_id TEXT, p_payment_intent TEXT,
+                                                    p_user_id BIGINT, p_coins INTEGER,
+                                                    p_days INTEGER, p_description TEXT,
+                                                    p_amount_usd NUMERIC)
+RETURNS JSONB LANGUAGE sql AS $$
+    WITH paid AS (
+        INSERT INTO payment_history
+            (user_id, stripe_session_id, amount_usd, coins_purchased, status,
+             stripe_payment_intent, completed_at)
+        VALUES (p_user_id, p_session_id, p_amount_usd, p_coins, 'completed',
+                p_payment_intent, CURRENT_TIMESTAMP)
+        ON CONFLICT (stripe_session_id) DO UPDATE SET
+            status = 'completed',
+            stripe_payment_intent = EXCLUDED.stripe_payment_intent,
+            completed_at = CURRENT_TIMESTAMP
+        WHERE payment_history.status IS DISTINCT FROM 'completed'
+        RETURNING 1
+    ), upd AS (
+        UPDATE users SET
+            coin_balance = COALESCE(coin_balance, 0) + p_coins,
+            coins_expire_at = LOCALTIMESTAMP + make_interval(days => p_days),
+            total_coins_purchased = total_coins_purchased + p_coins,
+            last_seen = CURRENT_TIMESTAMP
+        WHERE user_id = p_user_id AND is_admin IS NOT TRUE AND EXISTS (SELECT 1 FROM paid)
+        RETURNING coin_balance
+    ), tx AS (
+        INSERT INTO coin_transactions
+            (user_id, transaction_type, amount, balance_after, description)
+        SELECT p_user_id, 'purchase', p_coins, coin_balance, p_description
+        FROM upd
+        RETURNING balance_after
+    )
+    SELECT jsonb_build_object(
+        'fresh', EXISTS(SELECT 1 FROM paid),
+        'ok', EXISTS(SELECT 1 FROM tx)
+              OR EXISTS(SELECT 1 FROM users WHERE user_id = p_user_id AND is_admin)
+    );
+$$;
+
+-- Upsert a user in one call; new users get the welcome coins (logged once),
+-- existing users only have their profile refreshed. Returns TRUE for a new user.
+CREATE OR REPLACE FUNCTION add_user_atomic(p_user_id BIGINT, p_username TEXT, p_first_name TEXT,
+                                           p_last_name TEXT, p_added_by BIGINT,
+                                           p_initial_coins INTEGER, p_expiry_days INTEGER)
+RETURNS BOOLEAN LANGUAGE sql AS $$
+    WITH ins AS (
+        INSERT INTO users
+        (user_id, username, first_name, last_name, added_by,
+         coin_balance, coins_expire_at, free_coins_claimed)
+        VALUES (p_user_id, p_username, p_first_name, p_last_name, p_added_by, p_initial_coins,
+                LOCALTIMESTAMP + make_interval(days => p_expiry_days), TRUE)
+        ON CONFLICT (user_id) DO UPDATE SET
+            username = EXCLUDED.username,
+            first_name = EXCLUDED.first_name,
+            last_name = EXCLUDED.last_name,
+            is_active = TRUE,
+            last_seen = CURRENT_TIMESTAMP
+        RETURNING user_id, is_admin, coin_balance, (xmax = 0) AS is_new
+    ), tx AS (
+        INSERT INTO coin_transactions
+            (user_id, transaction_type, amount, balance_after, description)
+        SELECT user_id, 'initial_signup', p_initial_coins, coin_balance, 'Welcome bonus coins'
+        FROM ins
+        WHERE is_new AND is_admin IS NOT TRUE
+    )
+    SELECT is_new FROM ins;
+$$;
+
+-- All dashboard numbers in one call (Supabase REST backend's get_bot_statistics).
+-- Top commands cover the last 7 days, like the asyncpg backend's rollup.
+CREATE OR REPLACE FUNCTION bot_stats()
+RETURNS JSONB LANGUAGE sql STABLE AS $$
+    SELECT jsonb_build_object(
+        'total_users', (SELECT COUNT(*) FROM users),
+        'active_users', (SELECT COUNT(*) FROM users WHERE is_active),
+        'commands_24h', (SELECT COUNT(*) FROM usage_logs
+                         WHERE timestamp > CURRENT_TIMESTAMP - INTERVAL '24 hours'),
+        'top_commands', COALESCE((
+            SELECT jsonb_agg(jsonb_build_object('command', command, 'count', cnt)
+                             ORDER BY cnt DESC, command)
+            FROM (
+                SELECT command, COUNT(*) AS cnt
+                FROM usage_logs
+                WHERE timestamp > CURRENT_TIMESTAMP - INTERVAL '7 days'
+                GROUP BY command
+                ORDER BY cnt DESC, command
+                LIMIT 5
+            ) top
+        ), '[]'::jsonb)
+    );
+$$;
+
+-- Startup check for the Supabase REST backend: true once every function and
+-- view above exists with its current signature
+CREATE OR REPLACE FUNCTION bot_schema_ready()
+RETURNS BOOLEAN LANGUAGE sql STABLE AS $$
+    SELECT to_regclass('users_with_expiry') IS NOT NULL
+       AND to_regprocedure('deduct_coins_atomic(bigint, integer, text)') IS NOT NULL
+       AND to_regprocedure('add_coins_atomic(bigint, integer, text, boolean, integer, text)') IS NOT NULL
+       AND to_regprocedure('complete_purchase_atomic(text, text, bigint, integer, integer, text, numeric)') IS NOT NULL
+       AND to_regprocedure('add_user_atomic(bigint, text, text, text, bigint, integer, integer)') IS NOT NULL
+       AND to_regprocedure('bot_stats()') IS NOT NULL;
+$$;
+
 -- ========================================
 -- Insert Default Data
 -- ========================================
@@ -4,288 +4,398 @@ Checks all components and identifies issues
 """
 
 import os
-import requests
-from dotenv import load_dotenv
+import asyncio
+import aiohttp
+import json
 import sys
+from types import MappingProxyType
+
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+def _load_env(path='.env'):
+    """Load KEY=VALUE pairs from a .env file without overriding the real environment"""
+    try:
+        f = open(path, encoding='utf-8')
+    except FileNotFoundError:
+        return
+    with f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#') or '=' not in line:
+                continue
+            key, _, value = line.partition('=')
+            os.environ.setdefault(key.strip(), value.strip().strip('"\''))
 
 # Load environment variables
-load_dotenv()
+_load_env()
+
+# Snapshot of the environment taken once at import
+ENV = MappingProxyType(dict(os.environ))
 
 # Configuration
 VERCEL_URL = 'https://redditanalyzer-kappa.vercel.app'
-TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
-
-def print_header(text):
-    """Print a formatted header"""
-    print("\n" + "=" * 60)
-    print(f"  {text}")
-    print("=" * 60)
-
-def print_status(check_name, status, message=""):
-    """Print a check status"""
+TELEGRAM_BOT_TOKEN = ENV.get('TELEGRAM_BOT_TOKEN')
+
+REQUIRED_VARS = ('TELEGRAM_BOT_TOKEN', 'DATABASE_URL', 'OPENAI_API_KEY')
+OPTIONAL_VARS = ('STRIPE_SECRET_KEY', 'STRIPE_WEBHOOK_SECRET', 'REDDIT_CLIENT_ID', 'REDDIT_CLIENT_SECRET')
+
+# Wall-time budget for all network checks, and the limit for each request
+DIAG_TOTAL_TIMEOUT = 7.0
+DIAG_REQ_TIMEOUT = 4.0
+
+# Report framing, built once
+_SEP = "=" * 60
+_HDR_BOX_TOP = "╔" + "═" * 58 + "╗"
+_HDR_BOX_TITLE = "║" + " " * 10 + "Reddit Analyzer Bot - Diagnostics" + " " * 14 + "║"
+_HDR_BOX_BOT = "╚" + "═" * 58 + "╝"
+
+SECTION_TITLES = (
+    "1. Vercel Deployment Check",
+    "2. Database Connectivity Check",
+    "3. Telegram Bot Configuration Check",
+    "4. Webhook Configuration Check",
+    "5. Environment Variables Check (Local)",
+)
+
+def add_header(lines, text):
+    """Add a formatted header to an output buffer"""
+    lines.append(f"\n{_SEP}\n  {text}\n{_SEP}")
+
+def add_status(lines, check_name, status, message=""):
+    """Add a check status to an output buffer"""
     symbol = "✅" if status else "❌"
-    print(f"{symbol} {check_name}")
+    lines.append(f"{symbol} {check_name}")
     if message:
-        print(f"   → {message}")
+        lines.append(f"   → {message}")
 
-def check_vercel_deployment():
+async def check_vercel_deployment(session):
     """Check if Vercel deployment is accessible"""
-    print_header("1. Vercel Deployment Check")
+    lines = []
+    add_header(lines, SECTION_TITLES[0])
 
     try:
-        # Check main endpoint
-        response = requests.get(f"{VERCEL_URL}/", timeout=10)
-        if response.status_code == 200:
-            print_status("Main endpoint", True, f"Status: {response.status_code}")
-            data = response.json()
-            print(f"   Service: {data.get('service', 'Unknown')}")
-            print(f"   Version: {data.get('version', 'Unknown')}")
-        else:
-            print_status("Main endpoint", False, f"HTTP {response.status_code}")
-            return False
-
-        # Check health endpoint
-        response = requests.get(f"{VERCEL_URL}/health", timeout=10)
-        if response.status_code == 200:
-            print_status("Health endpoint", True)
-        else:
-            print_status("Health endpoint", False, f"HTTP {response.status_code}")
+        # Check main and health endpoints together
+        async with session.get(f"{VERCEL_URL}/") as response:
+            main_status = response.status
+            data = await response.json(loads=json_loads) if main_status == 200 else None
+
+        async with session.get(f"{VERCEL_URL}/health") as response:
+            health_status = response.status
+
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        add_status(lines, "Vercel deployment", False, f"Error: {e}")
+        return False, lines
+
+    if main_status == 200:
+        add_status(lines, "Main endpoint", True, f"Status: {main_status}")
+        lines.append(f"   Service: {data.get('service', 'Unknown')}")
+        lines.append(f"   Version: {data.get('version', 'Unknown')}")
+    else:
+        add_status(lines, "Main endpoint", False, f"HTTP {main_status}")
+        return False, lines
 
-        return True
+    if health_status == 200:
+        add_status(lines, "Health endpoint", True)
+    else:
+        add_status(lines, "Health endpoint", False, f"HTTP {health_status}")
 
-    except requests.exceptions.RequestException as e:
-        print_status("Vercel deployment", False, f"Error: {e}")
-        return False
+    return True, lines
 
-def check_database():
+async def check_database(session):
     """Check database connectivity"""
-    print_header("2. Database Connectivity Check")
+    lines = []
+    add_header(lines, SECTION_TITLES[1])
 
     try:
-        response = requests.get(f"{VERCEL_URL}/database-health", timeout=15)
-
-        if response.status_code == 200:
-            data = response.json()
-            status = data.get('status')
-            database = data.get('database')
-
-            if status == 'healthy' and database == 'connected':
-                print_status("Database connection", True, "Connected successfully")
-                stats = data.get('stats', {})
-                if stats:
-                    print(f"   Total users: {stats.get('total_users', 0)}")
-                    print(f"   Active users: {stats.get('active_users', 0)}")
-                return True
-            else:
-                print_status("Database connection", False, "Not connected")
-                return False
+        async with session.get(f"{VERCEL_URL}/database-health") as response:
+            status_code = response.status
+            try:
+                data = await response.json(loads=json_loads, content_type=None)
+            except ValueError:
+                data = None
+
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        add_status(lines, "Database health check", False, f"Error: {e}")
+        return False, lines
+
+    if status_code == 200 and data is not None:
+        status = data.get('status')
+        database = data.get('database')
+
+        if status == 'healthy' and database == 'connected':
+            add_status(lines, "Database connection", True, "Connected successfully")
+            stats = data.get('stats', {})
+            if stats:
+                lines.append(f"   Total users: {stats.get('total_users', 0)}")
+                lines.append(f"   Active users: {stats.get('active_users', 0)}")
+            return True, lines
         else:
-            print_status("Database connection", False, f"HTTP {response.status_code}")
-            if response.status_code == 500:
-                try:
-                    error_data = response.json()
-                    print(f"   Error: {error_data.get('error', 'Unknown error')}")
-                except:
-                    pass
-            return False
-
-    except requests.exceptions.RequestException as e:
-        print_status("Database health check", False, f"Error: {e}")
-        return False
-
-def check_telegram_bot():
-    """Check Telegram bot configuration"""
-    print_header("3. Telegram Bot Configuration Check")
+            add_status(lines, "Database connection", False, "Not connected")
+            return False, lines
+    else:
+        add_status(lines, "Database connection", False, f"HTTP {status_code}")
+        if status_code == 500 and data is not None:
+            lines.append(f"   Error: {data.get('error', 'Unknown error')}")
+        return False, lines
+
+async def _fetch_telegram(session, method):
+    """Call a Telegram Bot API method, returning (status_code, json or None)"""
+    async with session.get(
+        f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/{method}"
+    ) as response:
+        status_code = response.status
+        data = await response.json(loads=json_loads) if status_code == 200 else None
+    return status_code, data
+
+def render_bot_status(me_resp):
+    """Render the bot configuration check from a getMe response"""
+    lines = []
+    add_header(lines, SECTION_TITLES[2])
 
     if not TELEGRAM_BOT_TOKEN:
-        print_status("Bot token", False, "TELEGRAM_BOT_TOKEN not found in .env file")
-        print("\n   ⚠️  Please create a .env file with your TELEGRAM_BOT_TOKEN")
-        return False
+        add_status(lines, "Bot token", False, "TELEGRAM_BOT_TOKEN not found in .env file")
+        lines.append("\n   ⚠️  Please create a .env file with your TELEGRAM_BOT_TOKEN")
+        return False, lines
+
+    add_status(lines, "Bot token", True, f"Found (ends with: ...{TELEGRAM_BOT_TOKEN[-5:]})")
+
+    if isinstance(me_resp, BaseException):
+        add_status(lines, "Telegram API", False, f"Error: {me_resp}")
+        return False, lines
+
+    status_code, data = me_resp
+    if status_code == 200:
+        if data.get('ok'):
+            bot_info = data.get('result', {})
+            add_status(lines, "Bot API connection", True)
+            lines.append(f"   Bot username: @{bot_info.get('username', 'Unknown')}")
+            lines.append(f"   Bot name: {bot_info.get('first_name', 'Unknown')}")
+            return True, lines
+        else:
+            add_status(lines, "Bot API connection", False, "Invalid response")
+            return False, lines
+    else:
+        add_status(lines, "Bot API connection", False, f"HTTP {status_code}")
+        if status_code == 401:
+            lines.append("   ⚠️  Invalid bot token!")
+        return False, lines
 
-    print_status("Bot token", True, f"Found (ends with: ...{TELEGRAM_BOT_TOKEN[-5:]})")
+def render_webhook_status(wh_resp):
+    """Render the webhook configuration check from a getWebhookInfo response"""
+    lines = []
+    add_header(lines, SECTION_TITLES[3])
 
-    try:
-        # Get bot info
-        response = requests.get(
-            f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/getMe",
-            timeout=10
-        )
-
-        if response.status_code == 200:
-            data = response.json()
-            if data.get('ok'):
-                bot_info = data.get('result', {})
-                print_status("Bot API connection", True)
-                print(f"   Bot username: @{bot_info.get('username', 'Unknown')}")
-                print(f"   Bot name: {bot_info.get('first_name', 'Unknown')}")
-                return True
+    if not TELEGRAM_BOT_TOKEN:
+        add_status(lines, "Webhook check", False, "Bot token not available")
+        return False, lines
+
+    if isinstance(wh_resp, BaseException):
+        add_status(lines, "Webhook check", False, f"Error: {wh_resp}")
+        return False, lines
+
+    status_code, data = wh_resp
+    if status_code == 200:
+        if data.get('ok'):
+            info = data.get('result', {})
+
+            # Check webhook URL
+            webhook_url = info.get('url', '')
+            expected_url = f"{VERCEL_URL}/webhook"
+
+            if webhook_url == expected_url:
+                add_status(lines, "Webhook URL", True, webhook_url)
+            elif webhook_url:
+                add_status(lines, "Webhook URL", False, f"Wrong URL: {webhook_url}")
+                lines.append(f"   Expected: {expected_url}")
+                lines.append(f"\n   💡 Run: python setup_webhook.py to fix this")
+                return False, lines
             else:
-                print_status("Bot API connection", False, "Invalid response")
-                return False
-        else:
-            print_status("Bot API connection", False, f"HTTP {response.status_code}")
-            if response.status_code == 401:
-                print("   ⚠️  Invalid bot token!")
-            return False
+                add_status(lines, "Webhook URL", False, "Not configured")
+                lines.append(f"   Expected: {expected_url}")
+                lines.append(f"\n   💡 Run: python setup_webhook.py to set it up")
+                return False, lines
+
+            # Check for errors
+            last_error = info.get('last_error_message')
+            if last_error:
+                add_status(lines, "Webhook errors", False, last_error)
+                last_error_date = info.get('last_error_date', 'Unknown')
+                lines.append(f"   Last error date: {last_error_date}")
+            else:
+                add_status(lines, "Webhook errors", True, "No errors")
 
-    except requests.exceptions.RequestException as e:
-        print_status("Telegram API", False, f"Error: {e}")
-        return False
+            # Check pending updates
+            pending = info.get('pending_update_count', 0)
+            if pending > 0:
+                add_status(lines, "Pending updates", False, f"{pending} updates waiting")
+                lines.append("   💡 Updates are queued but not being processed")
+            else:
+                add_status(lines, "Pending updates", True, "No pending updates")
 
-def check_webhook():
-    """Check webhook configuration"""
-    print_header("4. Webhook Configuration Check")
+            return webhook_url == expected_url and not last_error, lines
 
-    if not TELEGRAM_BOT_TOKEN:
-        print_status("Webhook check", False, "Bot token not available")
-        return False
+        return False, lines
 
-    try:
-        response = requests.get(
-            f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/getWebhookInfo",
-            timeout=10
-        )
-
-        if response.status_code == 200:
-            data = response.json()
-            if data.get('ok'):
-                info = data.get('result', {})
-
-                # Check webhook URL
-                webhook_url = info.get('url', '')
-                expected_url = f"{VERCEL_URL}/webhook"
-
-                if webhook_url == expected_url:
-                    print_status("Webhook URL", True, webhook_url)
-                elif webhook_url:
-                    print_status("Webhook URL", False, f"Wrong URL: {webhook_url}")
-                    print(f"   Expected: {expected_url}")
-                    print(f"\n   💡 Run: python setup_webhook.py to fix this")
-                    return False
-                else:
-                    print_status("Webhook URL", False, "Not configured")
-                    print(f"   Expected: {expected_url}")
-                    print(f"\n   💡 Run: python setup_webhook.py to set it up")
-                    return False
-
-                # Check for errors
-                last_error = info.get('last_error_message')
-                if last_error:
-                    print_status("Webhook errors", False, last_error)
-                    last_error_date = info.get('last_error_date', 'Unknown')
-                    print(f"   Last error date: {last_error_date}")
-                else:
-                    print_status("Webhook errors", True, "No errors")
-
-                # Check pending updates
-                pending = info.get('pending_update_count', 0)
-                if pending > 0:
-                    print_status("Pending updates", False, f"{pending} updates waiting")
-                    print("   💡 Updates are queued but not being processed")
-                else:
-                    print_status("Pending updates", True, "No pending updates")
-
-                return webhook_url == expected_url and not last_error
+    else:
+        add_status(lines, "Webhook info", False, f"HTTP {status_code}")
+        return False, lines
 
-        else:
-            print_status("Webhook info", False, f"HTTP {response.status_code}")
-            return False
+async def check_telegram(session):
+    """Check bot and webhook configuration, fetching both concurrently"""
+    if not TELEGRAM_BOT_TOKEN:
+        return render_bot_status(None), render_webhook_status(None)
 
-    except requests.exceptions.RequestException as e:
-        print_status("Webhook check", False, f"Error: {e}")
-        return False
+    me_resp, wh_resp = await asyncio.gather(
+        _fetch_telegram(session, 'getMe'),
+        _fetch_telegram(session, 'getWebhookInfo'),
+        return_exceptions=True
+    )
+    return render_bot_status(me_resp), render_webhook_status(wh_resp)
 
 def check_environment_variables():
     """Check required environment variables"""
-    print_header("5. Environment Variables Check (Local)")
-
-    required_vars = {
-        'TELEGRAM_BOT_TOKEN': TELEGRAM_BOT_TOKEN,
-        'DATABASE_URL': os.getenv('DATABASE_URL'),
-        'OPENAI_API_KEY': os.getenv('OPENAI_API_KEY'),
-    }
-
-    optional_vars = {
-        'STRIPE_SECRET_KEY': os.getenv('STRIPE_SECRET_KEY'),
-        'STRIPE_WEBHOOK_SECRET': os.getenv('STRIPE_WEBHOOK_SECRET'),
-        'REDDIT_CLIENT_ID': os.getenv('REDDIT_CLIENT_ID'),
-        'REDDIT_CLIENT_SECRET': os.getenv('REDDIT_CLIENT_SECRET'),
-    }
+    lines = []
+    add_header(lines, SECTION_TITLES[4])
 
     all_good = True
 
-    print("\n  Required variables:")
-    for var_name, var_value in required_vars.items():
+    lines.append("\n  Required variables:")
+    for var_name in REQUIRED_VARS:
+        var_value = ENV.get(var_name)
         if var_value:
             masked = f"...{var_value[-5:]}" if len(var_value) > 5 else "***"
-            print_status(var_name, True, masked)
+            add_status(lines, var_name, True, masked)
         else:
-            print_status(var_name, False, "Not set")
+            add_status(lines, var_name, False, "Not set")
             all_good = False
 
-    print("\n  Optional variables:")
-    for var_name, var_value in optional_vars.items():
+    lines.append("\n  Optional variables:")
+    for var_name in OPTIONAL_VARS:
+        var_value = ENV.get(var_name)
         if var_value:
             masked = f"...{var_value[-5:]}" if len(var_value) > 5 else "***"
-            print_status(var_name, True, masked)
+            add_status(lines, var_name, True, masked)
         else:
-            print_status(var_name, False, "Not set (optional)")
+            add_status(lines, var_name, False, "Not set (optional)")
 
     if not all_good:
-        print("\n   ⚠️  Missing required variables in local .env file")
-        print("   Note: These must also be set in Vercel dashboard!")
-
-    return all_good
+        lines.append("\n   ⚠️  Missing required variables in local .env file")
+        lines.append("   Note: These must also be set in Vercel dashboard!")
+
+    return all_good, lines
+
+def _failed(title, detail):
+    """Failed result for a check that produced no report of its own"""
+    lines = []
+    add_header(lines, title)
+    add_status(lines, title.split(". ", 1)[1], False, detail)
+    return False, lines
+
+def _task_results(task, titles):
+    """A check task's sections: its own result, or one failed section per title
+    saying whether it timed out (cancelled by wait_for) or raised"""
+    if task.cancelled() or not task.done():
+        detail = f"Timed out after {DIAG_TOTAL_TIMEOUT:.0f}s"
+    elif task.exception() is not None:
+        error = task.exception()
+        detail = f"Check failed: {type(error).__name__}: {error}"
+    else:
+        result = task.result()
+        return result if len(titles) > 1 else (result,)
+    return tuple(_failed(title, detail) for title in titles)
+
+async def run_http_checks():
+    """Run the network checks concurrently, returning (ok, lines) per section in order"""
+    timeout = aiohttp.ClientTimeout(total=DIAG_REQ_TIMEOUT, connect=2.0)
+    # Small keep-alive pool: sequential calls to the same host reuse the TLS connection
+    connector = aiohttp.TCPConnector(limit=8, limit_per_host=4, keepalive_timeout=30)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        tasks = [
+            asyncio.ensure_future(check_vercel_deployment(session)),
+            asyncio.ensure_future(check_database(session)),
+            asyncio.ensure_future(check_telegram(session)),
+        ]
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*tasks, return_exceptions=True),
+                timeout=DIAG_TOTAL_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            pass
+
+    # Checks that timed out or raised count as failed; the Telegram check
+    # covers both the bot and webhook sections
+    vercel_task, database_task, telegram_task = tasks
+    return (
+        *_task_results(vercel_task, SECTION_TITLES[:1]),
+        *_task_results(database_task, SECTION_TITLES[1:2]),
+        *_task_results(telegram_task, SECTION_TITLES[2:4]),
+    )
 
 def main():
     """Run all diagnostic checks"""
-    print("\n")
-    print("╔" + "═" * 58 + "╗")
-    print("║" + " " * 10 + "Reddit Analyzer Bot - Diagnostics" + " " * 14 + "║")
-    print("╚" + "═" * 58 + "╝")
-
-    results = {
-        'vercel': check_vercel_deployment(),
-        'database': check_database(),
-        'telegram': check_telegram_bot(),
-        'webhook': check_webhook(),
-        'env_vars': check_environment_variables(),
-    }
+    out = [
+        "\n",
+        _HDR_BOX_TOP,
+        _HDR_BOX_TITLE,
+        _HDR_BOX_BOT,
+    ]
+
+    sections = (*asyncio.run(run_http_checks()), check_environment_variables())
+    for _, lines in sections:
+        out.extend(lines)
+
+    results = dict(zip(('vercel', 'database', 'telegram', 'webhook', 'env_vars'),
+                       (ok for ok, _ in sections)))
 
     # Summary
-    print_header("Summary")
+    add_header(out, "Summary")
 
     total_checks = len(results)
     passed_checks = sum(1 for v in results.values() if v)
 
-    print(f"\n  Checks passed: {passed_checks}/{total_checks}")
+    out.append(f"\n  Checks passed: {passed_checks}/{total_checks}")
 
     if all(results.values()):
-        print("\n  ✅ All checks passed! Your bot should be working.")
-        print("  Try sending /start to your bot on Telegram.")
+        out.append("\n  ✅ All checks passed! Your bot should be working.")
+        out.append("  Try sending /start to your bot on Telegram.")
     else:
-        print("\n  ⚠️  Some checks failed. Please review the issues above.")
+        out.append("\n  ⚠️  Some checks failed. Please review the issues above.")
 
         if not results['vercel']:
-            print("\n  → Vercel deployment issue - check your deployment")
+            out.append("\n  → Vercel deployment issue - check your deployment")
 
         if not results['database']:
-            print("\n  → Database issue - check DATABASE_URL in Vercel dashboard")
-            print("     Make sure you're using port 6543 for Supabase connection pooling")
+            out.append("\n  → Database issue - check DATABASE_URL in Vercel dashboard")
+            out.append("     Make sure you're using port 6543 for Supabase connection pooling")
 
         if not results['telegram']:
-            print("\n  → Telegram bot token issue - check TELEGRAM_BOT_TOKEN")
+            out.append("\n  → Telegram bot token issue - check TELEGRAM_BOT_TOKEN")
 
         if not results['webhook']:
-            print("\n  → Webhook not configured - run: python setup_webhook.py")
+            out.append("\n  → Webhook not configured - run: python setup_webhook.py")
 
         if not results['env_vars']:
-            print("\n  → Environment variables missing - check .env file")
-            print("     Also ensure they are set in Vercel dashboard!")
+            out.append("\n  → Environment variables missing - check .env file")
+            out.append("     Also ensure they are set in Vercel dashboard!")
+
+    out.append("\n" + _SEP)
+    out.append("\n  📚 For more help, see: DEPLOYMENT_GUIDE.md")
+    out.append(_SEP + "\n")
 
-    print("\n" + "=" * 60)
-    print("\n  📚 For more help, see: DEPLOYMENT_GUIDE.md")
-    print("=" * 60 + "\n")
+    # One write for the whole report, sections in a fixed order
+    sys.stdout.write("\n".join(out) + "\n")
 
 if __name__ == "__main__":
+    if uvloop is not None:
+        uvloop.install()
     main()
@@ -2,68 +2,68 @@
 Button continuation system for Reddit Analyzer Bot
 """
 
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional, Tuple
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ParseMode
 import logging
+from functools import lru_cache
 
 logger = logging.getLogger(__name__)
 
+# Continuation actions as (action_key, label, callback_data prefix)
+_ACTIONS: Tuple[Tuple[str, str, str], ...] = (
+    ('requirements', '📋 Requirements', 'continue_req_'),
+    ('rules', '📜 Rules', 'continue_rules_'),
+    ('flairs', '🏷️ Flairs', 'continue_flairs_'),
+    ('compare', '🆚 Compare Similar', 'continue_compare_'),
+)
+_DONE_ACTION = ('done', '✅ Done', 'continue_done_')
+
+@lru_cache(maxsize=512)
+def _build_kb(subreddit: str, completed: frozenset) -> Optional[InlineKeyboardMarkup]:
+    """Build (and memoize) the continuation keyboard for a subreddit"""
+    # Pending actions, 2 per row
+    pending = [
+        InlineKeyboardButton(label, callback_data=prefix + subreddit)
+        for action_key, label, prefix in _ACTIONS
+        if action_key not in completed
+    ]
+    buttons = [pending[i:i + 2] for i in range(0, len(pending), 2)]
+    
+    # Done button on separate row
+    action_key, label, prefix = _DONE_ACTION
+    if action_key not in completed:
+        buttons.append([InlineKeyboardButton(label, callback_data=prefix + subreddit)])
+    
+    return InlineKeyboardMarkup(buttons) if buttons else None
+
+class AnalyzeSession:
+    """Stored analyze result plus the follow-up actions already run"""
+    __slots__ = ('data', 'completed_actions', 'timestamp')
+
+    def __init__(self, data: Dict, timestamp=None):
+        self.data = data
+        self.completed_actions = set()
+        self.timestamp = timestamp
+
 class ButtonContinuationManager:
     """Manages button continuations after analyze command"""
     
     def create_continuation_keyboard(self, subreddit: str, completed_actions: List[str] = None) -> InlineKeyboardMarkup:
         """Create keyboard with remaining actions"""
-        if completed_actions is None:
-            completed_actions = []
-        
-        buttons = []
-        
-        # Available actions
-        actions = {
-            'requirements': ('📋 Requirements', f'continue_req_{subreddit}'),
-            'rules': ('📜 Rules', f'continue_rules_{subreddit}'),
-            'flairs': ('🏷️ Flairs', f'continue_flairs_{subreddit}'),
-            'compare': ('🆚 Compare Similar', f'continue_compare_{subreddit}'),
-            'done': ('✅ Done', f'continue_done_{subreddit}')
-        }
-        
-        # Add buttons for uncompleted actions
-        for action_key, (label, callback_data) in actions.items():
-            if action_key not in completed_actions:
-                if action_key == 'done':
-                    # Done button on separate row
-                    buttons.append([InlineKeyboardButton(label, callback_data=callback_data)])
-                else:
-                    # Other buttons, 2 per row
-                    if len(buttons) == 0 or len(buttons[-1]) == 2:
-                        buttons.append([])
-                    if len(buttons[-1]) < 2:
-                        buttons[-1].append(InlineKeyboardButton(label, callback_data=callback_data))
-        
-        return InlineKeyboardMarkup(buttons) if buttons else None
+        return _build_kb(subreddit, frozenset(completed_actions or ()))
     
     def store_analyze_context(self, context, subreddit: str, analyze_data: Dict):
         """Store analyze data for button continuations"""
-        if 'analyze_sessions' not in context.user_data:
-            context.user_data['analyze_sessions'] = {}
-        
-        context.user_data['analyze_sessions'][subreddit] = {
-            'data': analyze_data,
-            'completed_actions': [],
-            'timestamp': analyze_data.get('analyzed_at')
-        }
+        sessions = context.user_data.setdefault('analyze_sessions', {})
+        sessions[subreddit] = AnalyzeSession(analyze_data, analyze_data.get('analyzed_at'))
     
-    def get_analyze_context(self, context, subreddit: str) -> Dict:
+    def get_analyze_context(self, context, subreddit: str) -> Optional[AnalyzeSession]:
         """Retrieve stored analyze data"""
-        sessions = context.user_data.get('analyze_sessions', {})
-        return sessions.get(subreddit, {})
+        return context.user_data.get('analyze_sessions', {}).get(subreddit)
     
     def mark_action_complete(self, context, subreddit: str, action: str):
         """Mark an action as completed"""
-        if 'analyze_sessions' in context.user_data:
-            if subreddit in context.user_data['analyze_sessions']:
-                completed = context.user_data['analyze_sessions'][subreddit].get('completed_actions', [])
-                if action not in completed:
-                    completed.append(action)
-                context.user_data['analyze_sessions'][subreddit]['completed_actions'] = completed
\ No newline at end of file
+        session = self.get_analyze_context(context, subreddit)
+        if session is not None:
+            session.completed_actions.add(action)
@@ -3,6 +3,9 @@ Coin system integration for Reddit Analyzer Bot
 Add this to your reddit_bot.py
 """
 
+import asyncio
+import logging
+from datetime import datetime
 from functools import wraps
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.constants import ParseMode
@@ -10,6 +13,7 @@ from payment import PaymentProcessor, CoinManager
 import os
 from database import Database
 
+logger = logging.getLogger(__name__)
 
 # Then when initializing:
 db = Database()  # Create your own instance
@@ -19,6 +23,48 @@ payment_processor = PaymentProcessor(
     database=db  # Now db is defined
 )
 
+# Strong references to fire-and-forget tasks until they finish
+_background_tasks = set()
+
+def _on_background_done(task):
+    """Drop a finished background task and log its failure, if any"""
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Background task failed: {task.exception()}")
+
+def _spawn(coro):
+    """Run non-critical work (logging, notifications) without blocking the reply"""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_on_background_done)
+
+# Static replies, built once at import
+_PRICES_RESPONSE = (
+    "💎 <b>Command Prices</b>\n\n"
+    "Here's how much each command costs:\n\n"
+    "<b>Analysis Commands:</b>\n"
+    f"📊 /analyze - {CoinManager.format_coin_display(2)}\n"
+    f"📋 /requirements - {CoinManager.format_coin_display(2)}\n"
+    f"🆚 /compare - {CoinManager.format_coin_display(5)}\n"
+    f"🔍 /search - {CoinManager.format_coin_display(1)}\n"
+    f"🎯 /niche - {CoinManager.format_coin_display(3)}\n\n"
+    "<b>Data Commands:</b>\n"
+    f"📜 /rules - {CoinManager.format_coin_display(1)}\n"
+    f"🏷️ /flairs - {CoinManager.format_coin_display(1)}\n"
+    f"⛏️ /scrape - FREE\n"
+    f"🤖 AI Recreation:\n"
+    f"  • 10 posts - {CoinManager.format_coin_display(2)}\n"
+    f"  • 20 posts - {CoinManager.format_coin_display(4)}\n"
+    f"  • 30 posts - {CoinManager.format_coin_display(6)}\n\n"
+    "💰 Use /balance to check your coins\n"
+    "🛒 Use /buy to purchase more coins"
+)
+
+_PRICES_KEYBOARD = InlineKeyboardMarkup([[
+    InlineKeyboardButton("💰 Check Balance", callback_data="check_balance"),
+    InlineKeyboardButton("🛒 Buy Coins", callback_data="buy_coins")
+]])
+
 # ========== COIN MANAGEMENT COMMANDS ==========
 
 async def balance_command(update: Update, context):
@@ -41,7 +87,7 @@ async def balance_command(update: Update, context):
     # Format expiration date
     expires_text = "Never"
     if user_coins['expires_at']:
-        expire_date = datetime.fromisoformat(user_coins['expires_at'])
+        expire_date = user_coins['expires_at']
         days_left = (expire_date - datetime.now()).days
         if days_left > 365:
             expires_text = "Never"
@@ -49,28 +95,27 @@ async def balance_command(update: Update, context):
             expires_text = f"{days_left} days"
     
     # Get transaction history
-    history = await db.get_user_transaction_history(user.id, limit=5)
+    history = await db.get_recent_transaction_lines(user.id, limit=5)
     
     # Format response
-    response = (
-        f"💰 <b>Your Coin Balance</b>\n\n"
-        f"Balance: {CoinManager.format_coin_display(user_coins['balance'])}\n"
-        f"Expires in: {expires_text}\n\n"
-    )
+    parts = [
+        "💰 <b>Your Coin Balance</b>\n\n",
+        f"Balance: {CoinManager.format_coin_display(user_coins['balance'])}\n",
+        f"Expires in: {expires_text}\n\n",
+    ]
     
     if user_coins['is_expired']:
-        response += "⚠️ <b>Your coins have expired!</b>\n"
-        response += "Purchase new coins to continue using the bot.\n\n"
+        parts.append(
+            "⚠️ <b>Your coins have expired!</b>\n"
+            "Purchase new coins to continue using the bot.\n\n"
+        )
     
     # Add recent transactions
     if history:
-        response += "<b>Recent Transactions:</b>\n"
-        for trans in history[:5]:
-            if trans['amount'] > 0:
-                emoji = "➕"
-            else:
-                emoji = "➖"
-            response += f"{emoji} {abs(trans['amount'])} coins - {trans['description'][:30]}\n"
+        parts.append("<b>Recent Transactions:</b>\n")
+        parts.append("\n".join(history) + "\n")
+    
+    response = "".join(parts)
     
     # Add buttons
     keyboard = [[
@@ -91,14 +136,8 @@ async def balance_command(update: Update, context):
         reply_markup=reply_markup
     )
 
-async def buy_coins_command(update: Update, context):
-    """Show coin packages for purchase"""
-    user = update.effective_user
-    if not user:
-        return
-    
-    packages = payment_processor.get_all_packages()
-    
+def _build_buy_coins_view(packages):
+    """Build the package list message and keyboard (packages are fixed at startup)"""
     response = (
         "🛒 <b>Coin Packages</b>\n\n"
         "Choose a package to purchase:\n\n"
@@ -140,12 +179,20 @@ async def buy_coins_command(update: Update, context):
         InlineKeyboardButton("💰 Check Balance", callback_data="check_balance")
     ])
     
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    return response, InlineKeyboardMarkup(keyboard)
+
+_BUY_COINS_RESPONSE, _BUY_COINS_KEYBOARD = _build_buy_coins_view(payment_processor.get_all_packages())
+
+async def buy_coins_command(update: Update, context):
+    """Show coin packages for purchase"""
+    user = update.effective_user
+    if not user:
+        return
     
     await update.message.reply_text(
-        response,
+        _BUY_COINS_RESPONSE,
         parse_mode=ParseMode.HTML,
-        reply_markup=reply_markup
+        reply_markup=_BUY_COINS_KEYBOARD
     )
 
 async def prices_command(update: Update, context):
@@ -154,38 +201,10 @@ async def prices_command(update: Update, context):
     if not user:
         return
     
-    response = (
-        "💎 <b>Command Prices</b>\n\n"
-        "Here's how much each command costs:\n\n"
-        "<b>Analysis Commands:</b>\n"
-        f"📊 /analyze - {CoinManager.format_coin_display(2)}\n"
-        f"📋 /requirements - {CoinManager.format_coin_display(2)}\n"
-        f"🆚 /compare - {CoinManager.format_coin_display(5)}\n"
-        f"🔍 /search - {CoinManager.format_coin_display(1)}\n"
-        f"🎯 /niche - {CoinManager.format_coin_display(3)}\n\n"
-        "<b>Data Commands:</b>\n"
-        f"📜 /rules - {CoinManager.format_coin_display(1)}\n"
-        f"🏷️ /flairs - {CoinManager.format_coin_display(1)}\n"
-        f"⛏️ /scrape - FREE\n"
-        f"🤖 AI Recreation:\n"
-        f"  • 10 posts - {CoinManager.format_coin_display(2)}\n"
-        f"  • 20 posts - {CoinManager.format_coin_display(4)}\n"
-        f"  • 30 posts - {CoinManager.format_coin_display(6)}\n\n"
-        "💰 Use /balance to check your coins\n"
-        "🛒 Use /buy to purchase more coins"
-    )
-    
-    keyboard = [[
-        InlineKeyboardButton("💰 Check Balance", callback_data="check_balance"),
-        InlineKeyboardButton("🛒 Buy Coins", callback_data="buy_coins")
-    ]]
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
     await update.message.reply_text(
-        response,
+        _PRICES_RESPONSE,
         parse_mode=ParseMode.HTML,
-        reply_markup=reply_markup
+        reply_markup=_PRICES_KEYBOARD
     )
 
 # ========== ADMIN COIN COMMANDS ==========
@@ -220,25 +239,20 @@ async def add_coins_command(update: Update, context):
         )
         
         if success:
-            # Log admin action
-            await db.log_admin_action(
+            # Log admin action and notify the user in the background
+            _spawn(db.log_admin_action(
                 admin.id,
                 'add_coins',
                 f"Added {amount} coins to user {target_user_id}: {description}"
-            )
-            
-            # Try to notify the user
-            try:
-                await context.bot.send_message(
-                    chat_id=target_user_id,
-                    text=f"🎁 You received {CoinManager.format_coin_display(amount)}!\n\n"
-                         f"Reason: {description}\n\n"
-                         f"Use /balance to check your new balance.",
-                    parse_mode=ParseMode.HTML
-                )
-                notification = "✅ User notified"
-            except:
-                notification = "⚠️ Could not notify user"
+            ))
+            _spawn(context.bot.send_message(
+                chat_id=target_user_id,
+                text=f"🎁 You received {CoinManager.format_coin_display(amount)}!\n\n"
+                     f"Reason: {description}\n\n"
+                     f"Use /balance to check your new balance.",
+                parse_mode=ParseMode.HTML
+            ))
+            notification = "📨 User notification scheduled"
             
             await update.message.reply_text(
                 f"✅ Successfully added {CoinManager.format_coin_display(amount)} to user {target_user_id}\n\n"
@@ -311,11 +325,11 @@ async def set_coins_command(update: Update, context):
             return
         
         if success:
-            await db.log_admin_action(
+            _spawn(db.log_admin_action(
                 admin.id,
                 'set_coins',
                 f"Set user {target_user_id} balance to {new_balance} coins"
-            )
+            ))
             
             await update.message.reply_text(
                 f"✅ Set user {target_user_id}'s balance to {CoinManager.format_coin_display(new_balance)}",
@@ -5,13 +5,15 @@ Replaces the queue system with smart concurrent execution
 
 import asyncio
 import time
+import itertools
 from typing import Dict, Any, Optional
-from collections import deque
 from functools import wraps
 import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ParseMode, ChatAction
 from telegram.ext import ContextTypes
+from database import Database
+from payment import CoinManager
 
 logger = logging.getLogger(__name__)
 
@@ -21,51 +23,75 @@ class ConcurrentCommandManager:
     def __init__(self, rate_limit: int = 90, time_window: int = 60):
         self.rate_limit = rate_limit  # Max requests per minute
         self.time_window = time_window  # Time window in seconds
-        self.request_times = deque()  # Track request timestamps
+        self.refill_rate = rate_limit / time_window  # Tokens regained per second
+        self.tokens = float(rate_limit)  # Token bucket, starts full
+        self.last_refill = time.monotonic()
         self.active_commands = {}  # Track active commands per user
         self.command_counter = 0  # Total commands processed
+        self._command_ids = itertools.count(1)  # Keys for active_commands
         
-    def _cleanup_old_requests(self):
-        """Remove request timestamps older than the time window"""
-        current_time = time.time()
-        while self.request_times and current_time - self.request_times[0] > self.time_window:
-            self.request_times.popleft()
+    def _refill(self):
+        """Top the bucket up for the time elapsed since the last refill"""
+        now = time.monotonic()
+        self.tokens = min(self.rate_limit, self.tokens + (now - self.last_refill) * self.refill_rate)
+        self.last_refill = now
     
     def can_execute_immediately(self) -> tuple[bool, Optional[float]]:
-        """Check if command can execute immediately or needs to wait"""
-        self._cleanup_old_requests()
-        current_time = time.time()
-        
-        # Check current rate
-        current_rate = len(self.request_times)
+        """Take a token for a command; returns whether it can run now, or how long to wait"""
+        self._refill()
+        self.tokens -= 1
+        self.command_counter += 1
         
-        if current_rate >= self.rate_limit:
-            # Calculate wait time until oldest request expires
-            oldest_request = self.request_times[0]
-            wait_time = self.time_window - (current_time - oldest_request) + 0.1
-            return False, wait_time
+        if self.tokens >= 0:
+            return True, None
         
-        return True, None
+        # Token is reserved on credit; wait until the bucket has refilled it
+        return False, -self.tokens / self.refill_rate
     
-    def record_request(self):
-        """Record a new request timestamp"""
-        self.request_times.append(time.time())
-        self.command_counter += 1
+    def next_command_id(self) -> int:
+        """Unique integer key for an active command"""
+        return next(self._command_ids)
     
     def get_status(self) -> Dict[str, Any]:
         """Get current manager status"""
-        self._cleanup_old_requests()
+        self._refill()
+        current_rate = max(0, round(self.rate_limit - self.tokens))
         return {
-            'current_rate': len(self.request_times),
+            'current_rate': current_rate,
             'rate_limit': self.rate_limit,
-            'rate_percentage': (len(self.request_times) / self.rate_limit) * 100,
+            'rate_percentage': (current_rate / self.rate_limit) * 100,
             'total_commands': self.command_counter,
             'active_commands': len(self.active_commands)
         }
 
+# Throttled commands only get a "high traffic" reply when the wait is this long
+HIGH_TRAFFIC_NOTICE_SECONDS = 5
+
 # Initialize the concurrent manager
 concurrent_manager = ConcurrentCommandManager(rate_limit=90, time_window=60)
 
+# Static keyboards for the expired/insufficient coin replies
+_EXPIRED_MARKUP = InlineKeyboardMarkup([[
+    InlineKeyboardButton("🛒 Buy Coins", callback_data="buy_coins"),
+    InlineKeyboardButton("📊 View Packages", callback_data="view_packages")
+]])
+_INSUFFICIENT_MARKUP = InlineKeyboardMarkup([[
+    InlineKeyboardButton("🛒 Buy Coins", callback_data="buy_coins"),
+    InlineKeyboardButton("💰 Check Balance", callback_data="check_balance")
+]])
+
+# Shared pooled database instance for coin-gated commands (created on first use)
+_db = None
+
+async def get_db():
+    """Get or create the shared database instance"""
+    global _db
+    if _db is None:
+        database = Database()
+        await database.init_pool()  # raises if the schema is missing; retried next call
+        _db = database
+    return _db
+
 def concurrent_command(func):
     """Decorator for concurrent command execution with smart rate limiting"""
     @wraps(func)
@@ -74,31 +100,34 @@ def concurrent_command(func):
         if not user:
             return
         
+        # Admins skip the shared rate limiter (in-memory admin id set, reloaded every minute)
+        if await (await get_db()).is_admin(user.id):
+            return await func(update, context)
+        
         command_name = update.message.text.split()[0] if update.message else "unknown"
         
         # Check if we can execute immediately
         can_execute, wait_time = concurrent_manager.can_execute_immediately()
         
         if not can_execute:
-            # Only queue if we're over the Reddit API limit
-            await update.message.reply_text(
-                f"⚠️ <b>High traffic detected!</b>\n\n"
-                f"Reddit API limit reached ({concurrent_manager.rate_limit} requests/min).\n"
-                f"Your command will execute in {wait_time:.1f} seconds.\n\n"
-                f"<i>This only happens during peak usage.</i>",
-                parse_mode=ParseMode.HTML
-            )
+            # Only queue if we're over the Reddit API limit; short waits run silently
+            logger.info(f"Rate limited {command_name} for user {user.id}, waiting {wait_time:.1f}s")
+            if wait_time > HIGH_TRAFFIC_NOTICE_SECONDS:
+                await update.message.reply_text(
+                    f"⚠️ <b>High traffic detected!</b>\n\n"
+                    f"Reddit API limit reached ({concurrent_manager.rate_limit} requests/min).\n"
+                    f"Your command will execute in {wait_time:.1f} seconds.\n\n"
+                    f"<i>This only happens during peak usage.</i>",
+                    parse_mode=ParseMode.HTML
+                )
             await asyncio.sleep(wait_time)
         
-        # Record the request
-        concurrent_manager.record_request()
-        
         # Track active command for this user
-        command_id = f"{user.id}_{time.time()}"
+        command_id = concurrent_manager.next_command_id()
         concurrent_manager.active_commands[command_id] = {
             'user_id': user.id,
             'command': command_name,
-            'start_time': time.time()
+            'start_time': time.monotonic()
         }
         
         try:
@@ -131,8 +160,7 @@ def requires_coins_with_notification(cost: int = None, command_name: str = None)
                 return
             
             # Check if admin (admins don't need coins)
-            from database import Database
-            db = Database()
+            db = await get_db()
             is_admin = await db.is_admin(user.id)
             
             if is_admin:
@@ -144,9 +172,6 @@ def requires_coins_with_notification(cost: int = None, command_name: str = None)
                 )
                 return await func(update, context)
             
-            # Import CoinManager locally to avoid circular imports
-            from payment import CoinManager
-            
             # Determine cost
             if cost is not None:
                 required_coins = cost
@@ -156,99 +181,70 @@ def requires_coins_with_notification(cost: int = None, command_name: str = None)
                 cmd = func.__name__.replace('_command', '').replace('_endpoint', '')
                 required_coins = CoinManager.get_command_cost(cmd)
             
-            # Get user's coin balance
-            user_coins = await db.get_user_coins(user.id)
-            
-            # Check if coins expired
-            if user_coins['is_expired']:
-                keyboard = [[
-                    InlineKeyboardButton("🛒 Buy Coins", callback_data="buy_coins"),
-                    InlineKeyboardButton("📊 View Packages", callback_data="view_packages")
-                ]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                await update.message.reply_text(
-                    "⏰ <b>Your coins have expired!</b>\n\n"
-                    "Purchase a new coin package to continue using the bot.\n"
-                    "All purchases extend your expiration by 30 days.",
-                    parse_mode=ParseMode.HTML,
-                    reply_markup=reply_markup
-                )
-                return
-            
-            # Check sufficient balance
-            if user_coins['balance'] < required_coins:
-                keyboard = [[
-                    InlineKeyboardButton("🛒 Buy Coins", callback_data="buy_coins"),
-                    InlineKeyboardButton("💰 Check Balance", callback_data="check_balance")
-                ]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                await update.message.reply_text(
-                    f"❌ <b>Insufficient coins!</b>\n\n"
-                    f"This command costs: {CoinManager.format_coin_display(required_coins)}\n"
-                    f"Your balance: {CoinManager.format_coin_display(user_coins['balance'])}\n"
-                    f"You need: {CoinManager.format_coin_display(required_coins - user_coins['balance'])} more\n\n"
-                    f"Purchase coins to continue using the bot!",
-                    parse_mode=ParseMode.HTML,
-                    reply_markup=reply_markup
-                )
-                return
-            
-            # Deduct coins
+            # Deduct coins (balance and expiry are checked in the same UPDATE)
             command = func.__name__.replace('_command', '').replace('_endpoint', '')
             target = context.args[0] if context.args else 'unknown'
-            success = await db.deduct_coins(
+            deducted = await db.try_deduct_coins(
                 user.id, 
                 required_coins, 
                 command,
                 f"Used /{command} on {target}"
             )
             
-            if not success:
+            if deducted is None:
+                # Slow path: work out why the user could not pay
+                user_coins = await db.get_user_coins(user.id)
+                
+                # Check if coins expired
+                if user_coins['is_expired']:
+                    await update.message.reply_text(
+                        "⏰ <b>Your coins have expired!</b>\n\n"
+                        "Purchase a new coin package to continue using the bot.\n"
+                        "All purchases extend your expiration by 30 days.",
+                        parse_mode=ParseMode.HTML,
+                        reply_markup=_EXPIRED_MARKUP
+                    )
+                    return
+                
+                # Check sufficient balance
+                if user_coins['balance'] < required_coins:
+                    await update.message.reply_text(
+                        f"❌ <b>Insufficient coins!</b>\n\n"
+                        f"This command costs: {CoinManager.format_coin_display(required_coins)}\n"
+                        f"Your balance: {CoinManager.format_coin_display(user_coins['balance'])}\n"
+                        f"You need: {CoinManager.format_coin_display(required_coins - user_coins['balance'])} more\n\n"
+                        f"Purchase coins to continue using the bot!",
+                        parse_mode=ParseMode.HTML,
+                        reply_markup=_INSUFFICIENT_MARKUP
+                    )
+                    return
+                
                 await update.message.reply_text(
                     "❌ Failed to process payment. Please try again.",
                     parse_mode=ParseMode.HTML
                 )
                 return
             
-            # Calculate new balance
-            new_balance = user_coins['balance'] - required_coins
-            
-            # Send coin deduction notification
-            coin_message = await update.message.reply_text(
-                f"💰 <b>Coins Deducted</b>\n\n"
-                f"Command: /{command} {target}\n"
-                f"Cost: {CoinManager.format_coin_display(required_coins)}\n"
-                f"New balance: {CoinManager.format_coin_display(new_balance)}\n\n"
-                f"<i>Processing your request...</i>",
-                parse_mode=ParseMode.HTML
-            )
+            new_balance, _ = deducted
             
-            # Store the coin message ID so we can delete it later
-            context.user_data['coin_message_id'] = coin_message.message_id
-            context.user_data['coins_deducted'] = required_coins
-            context.user_data['coins_remaining'] = new_balance
-            
-            # Execute the command
-            return await func(update, context)
+            try:
+                # Execute the command
+                return await func(update, context)
+            finally:
+                # One silent line under the command's reply (sent even if it
+                # failed, since the coins are already spent)
+                try:
+                    await update.message.reply_text(
+                        f"<i>💰 -{required_coins} coins (balance: {new_balance})</i>",
+                        parse_mode=ParseMode.HTML,
+                        disable_notification=True
+                    )
+                except Exception as e:
+                    logger.warning(f"Failed to send coin notice to user {user.id}: {e}")
         
         return wrapper
     return decorator
 
-async def cleanup_coin_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Clean up the coin deduction message after command completes"""
-    if 'coin_message_id' in context.user_data:
-        try:
-            await context.bot.delete_message(
-                chat_id=update.effective_chat.id,
-                message_id=context.user_data['coin_message_id']
-            )
-        except:
-            pass  # Message might already be deleted
-        finally:
-            del context.user_data['coin_message_id']
-
 # Status command to check concurrent execution
 async def concurrent_status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Check concurrent execution status"""
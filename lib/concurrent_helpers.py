@@ -10,45 +10,56 @@ from functools import wraps
 from typing import Dict, Any, Callable
 from collections import defaultdict
 
+class _UserBucket:
+    """Per-user token bucket; last_refill=0 makes the first refill fill it"""
+    __slots__ = ('tokens', 'last_refill')
+
+    def __init__(self):
+        self.tokens = 0.0
+        self.last_refill = 0.0
+
 class EnhancedRateLimiter:
+    # Buckets idle this long are full again, so dropping them loses nothing
+    IDLE_TTL = 300
+    SWEEP_EVERY = 1000  # can_proceed calls between sweeps
+
     def __init__(self):
-        self.user_limits: Dict[int, Dict] = defaultdict(lambda: {
-            'requests': [],
-            'last_request': 0,
-            'burst_used': 0
-        })
+        self.user_limits: Dict[int, _UserBucket] = defaultdict(_UserBucket)
+        self._calls_since_sweep = 0
+    
+    def _sweep(self, current_time: float):
+        """Evict buckets of users idle for longer than IDLE_TTL"""
+        stale = [
+            user_id for user_id, bucket in self.user_limits.items()
+            if current_time - bucket.last_refill > self.IDLE_TTL
+        ]
+        for user_id in stale:
+            del self.user_limits[user_id]
     
     async def can_proceed(self, user_id: int, requests_per_second: float = 1.0,
                          burst_allowance: int = 3) -> tuple[bool, float]:
-        """Check if request can proceed"""
-        current_time = time.time()
-        user_data = self.user_limits[user_id]
+        """Check if request can proceed, taking a token if it can"""
+        current_time = time.monotonic()
         
-        # Clean old requests
-        user_data['requests'] = [
-            req for req in user_data['requests'] 
-            if current_time - req < 60
-        ]
+        self._calls_since_sweep += 1
+        if self._calls_since_sweep >= self.SWEEP_EVERY:
+            self._calls_since_sweep = 0
+            self._sweep(current_time)
         
-        time_since_last = current_time - user_data['last_request']
-        min_interval = 1.0 / requests_per_second
+        user_data = self.user_limits[user_id]
         
-        if time_since_last < min_interval:
-            if user_data['burst_used'] >= burst_allowance:
-                wait_time = min_interval - time_since_last
-                return False, wait_time
-            else:
-                user_data['burst_used'] += 1
-        else:
-            user_data['burst_used'] = max(0, user_data['burst_used'] - 1)
+        # One steady request plus the burst allowance can be banked
+        capacity = burst_allowance + 1
+        tokens = min(capacity, user_data.tokens +
+                     (current_time - user_data.last_refill) * requests_per_second)
+        user_data.last_refill = current_time
         
+        if tokens < 1:
+            user_data.tokens = tokens
+            return False, (1 - tokens) / requests_per_second
+        
+        user_data.tokens = tokens - 1
         return True, 0.0
-    
-    async def record_request(self, user_id: int):
-        """Record successful request"""
-        current_time = time.time()
-        self.user_limits[user_id]['requests'].append(current_time)
-        self.user_limits[user_id]['last_request'] = current_time
 
 # Global rate limiter instance
 rate_limiter = EnhancedRateLimiter()
@@ -70,7 +81,6 @@ def enhanced_rate_limit(requests_per_second: float = 1.0, burst_allowance: int =
                 )
                 return
             
-            await rate_limiter.record_request(user_id)
             return await func(update, context)
         return wrapper
     return decorator
\ No newline at end of file
@@ -4,53 +4,42 @@ Handles environment variables and configuration settings
 """
 
 import os
+import platform
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
 
+# Platform-appropriate default database path, resolved once
+_DEFAULT_DB = (
+    'reddit_bot.db'  # Local to script directory
+    if platform.system() == 'Windows'
+    else '/opt/render/project/data/reddit_bot.db'
+)
+
+
+@dataclass(frozen=True, slots=True)
 class Config:
-    def __init__(self):
-        # Telegram Bot Token
-        self.TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
-        if not self.TELEGRAM_BOT_TOKEN:
-            raise ValueError("TELEGRAM_BOT_TOKEN not found in environment variables")
-            
-        # Reddit API URL
-        self.REDDIT_API_URL = os.getenv('REDDIT_API_URL', 'https://reddit-analyzer-api.onrender.com')
-        
-        # OpenAI API Key
-        self.OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
-        if not self.OPENAI_API_KEY:
-            raise ValueError("OPENAI_API_KEY not found in environment variables")
-            
-        # Database path
-        # Use platform-appropriate default
-        import platform
-        if platform.system() == 'Windows':
-            default_path = 'reddit_bot.db'  # Local to script directory
-        else:
-            default_path = '/opt/render/project/data/reddit_bot.db'
-        self.DATABASE_PATH = os.getenv('DATABASE_PATH', default_path) 
-               
-        # Bot settings
-        self.MAX_SCRAPE_POSTS = int(os.getenv('MAX_SCRAPE_POSTS', '50'))
-        self.DEFAULT_ANALYSIS_DAYS = int(os.getenv('DEFAULT_ANALYSIS_DAYS', '7'))
-        self.DEFAULT_SEARCH_LIMIT = int(os.getenv('DEFAULT_SEARCH_LIMIT', '100'))
-        
-        # Rate limiting
-        self.RATE_LIMIT_SECONDS = int(os.getenv('RATE_LIMIT_SECONDS', '1'))
-        
-        # Logging
-        self.LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    """Bot configuration; build it with get_config()"""
+    TELEGRAM_BOT_TOKEN: str
+    REDDIT_API_URL: str
+    OPENAI_API_KEY: str
+    DATABASE_PATH: str
+    MAX_SCRAPE_POSTS: int
+    DEFAULT_ANALYSIS_DAYS: int
+    DEFAULT_SEARCH_LIMIT: int
+    RATE_LIMIT_SECONDS: int
+    LOG_LEVEL: str
+    STRIPE_SECRET_KEY: Optional[str]
+    STRIPE_PUBLISHABLE_KEY: Optional[str]
+    STRIPE_WEBHOOK_SECRET: Optional[str]
+    INITIAL_FREE_COINS: int
+    COINS_EXPIRY_DAYS: int
 
-        self.STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY')
-        self.STRIPE_PUBLISHABLE_KEY = os.getenv('STRIPE_PUBLISHABLE_KEY')
-        self.STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET')
-        self.INITIAL_FREE_COINS = int(os.getenv('INITIAL_FREE_COINS', '10'))
-        self.COINS_EXPIRY_DAYS = int(os.getenv('COINS_EXPIRY_DAYS', '30'))
-        
     def __str__(self):
         """String representation for debugging (hide sensitive data)"""
         return f"""
@@ -64,4 +53,40 @@ Reddit Analyzer Bot Configuration:
 - Default Search Limit: {self.DEFAULT_SEARCH_LIMIT}
 - Rate Limit Seconds: {self.RATE_LIMIT_SECONDS}
 - Log Level: {self.LOG_LEVEL}
-"""
\ No newline at end of file
+"""
+
+
+@lru_cache(maxsize=1)
+def get_config() -> Config:
+    """Read the configuration from the environment (once per process)"""
+    # Telegram Bot Token
+    telegram_bot_token = os.getenv('TELEGRAM_BOT_TOKEN')
+    if not telegram_bot_token:
+        raise ValueError("TELEGRAM_BOT_TOKEN not found in environment variables")
+
+    # OpenAI API Key
+    openai_api_key = os.getenv('OPENAI_API_KEY')
+    if not openai_api_key:
+        raise ValueError("OPENAI_API_KEY not found in environment variables")
+
+    return Config(
+        TELEGRAM_BOT_TOKEN=telegram_bot_token,
+        # Reddit API URL
+        REDDIT_API_URL=os.getenv('REDDIT_API_URL', 'https://reddit-analyzer-api.onrender.com'),
+        OPENAI_API_KEY=openai_api_key,
+        # Database path
+        DATABASE_PATH=os.getenv('DATABASE_PATH', _DEFAULT_DB),
+        # Bot settings
+        MAX_SCRAPE_POSTS=int(os.getenv('MAX_SCRAPE_POSTS', '50')),
+        DEFAULT_ANALYSIS_DAYS=int(os.getenv('DEFAULT_ANALYSIS_DAYS', '7')),
+        DEFAULT_SEARCH_LIMIT=int(os.getenv('DEFAULT_SEARCH_LIMIT', '100')),
+        # Rate limiting
+        RATE_LIMIT_SECONDS=int(os.getenv('RATE_LIMIT_SECONDS', '1')),
+        # Logging
+        LOG_LEVEL=os.getenv('LOG_LEVEL', 'INFO'),
+        STRIPE_SECRET_KEY=os.getenv('STRIPE_SECRET_KEY'),
+        STRIPE_PUBLISHABLE_KEY=os.getenv('STRIPE_PUBLISHABLE_KEY'),
+        STRIPE_WEBHOOK_SECRET=os.getenv('STRIPE_WEBHOOK_SECRET'),
+        INITIAL_FREE_COINS=int(os.getenv('INITIAL_FREE_COINS', '10')),
+        COINS_EXPIRY_DAYS=int(os.getenv('COINS_EXPIRY_DAYS', '30')),
+    )
@@ -7,14 +7,405 @@ import asyncio
 import asyncpg
 import logging
 import os
-from datetime import datetime, timedelta
-from typing import Optional, List, Dict, Any
+import time
+from datetime import date, timedelta
+from typing import Optional, List, Dict, Any, Tuple, AsyncIterator
 from contextlib import asynccontextmanager
+from functools import lru_cache
 
 logger = logging.getLogger(__name__)
 
+# asyncpg caches prepared statements per connection, keyed by the exact SQL
+# text, so hot queries live in shared constants and hit the same cache entry
+STATEMENT_CACHE_SIZE = 1024
+
+ADMIN_IDS_SQL = "SELECT user_id FROM users WHERE is_admin"
+
+IS_ACTIVE_SQL = "SELECT is_active FROM users WHERE user_id = $1"
+
+ALL_COMMAND_COSTS_SQL = "SELECT command, cost FROM command_costs"
+
+LOG_TRANSACTION_SQL = """
+    INSERT INTO coin_transactions
+    (user_id, transaction_type, amount, balance_after,
+     description, stripe_payment_id)
+    VALUES ($1, $2, $3, $4, $5, $6)
+"""
+
+@lru_cache(maxsize=None)
+def _unnest_insert_sql(table: str, columns: Tuple[str, ...], types: Tuple[str, ...],
+                       suffix: str = '') -> str:
+    """INSERT ... SELECT FROM unnest() text: one array parameter per column,
+    so the statement is parsed once whatever the row count (and is cached)"""
+    arrays = ", ".join(f"${i}::{t}[]" for i, t in enumerate(types, 1))
+    return (f"INSERT INTO {table} ({', '.join(columns)}) "
+            f"SELECT * FROM unnest({arrays}) {suffix}")
+
+SEED_ADMINS_SQL = """
+    INSERT INTO users
+    (user_id, username, first_name, last_name, is_admin, is_active,
+     coin_balance, coins_expire_at, free_coins_claimed)
+    SELECT a.user_id, a.username, a.first_name, a.last_name, TRUE, TRUE, 999999,
+           CURRENT_TIMESTAMP + INTERVAL '10 years', TRUE
+    FROM unnest($1::bigint[], $2::text[], $3::text[], $4::text[])
+         AS a(user_id, username, first_name, last_name)
+    ON CONFLICT (user_id) DO UPDATE SET
+        is_admin = TRUE,
+        coin_balance = 999999,
+        coins_expire_at = CURRENT_TIMESTAMP + INTERVAL '10 years'
+"""
+
+# usage_logs columns written by the background COPY in log_usage
+USAGE_LOG_COLUMNS = ('user_id', 'username', 'first_name', 'command', 'params', 'coins_spent')
+
+ALL_USERS_SQL = """
+    SELECT user_id, username, first_name, last_name,
+           is_admin, is_active, added_date, coin_balance
+    FROM users
+    ORDER BY is_admin DESC, added_date DESC
+"""
+
+# Same rows as ALL_USERS_SQL, serialised by Postgres as one JSON array
+ALL_USERS_JSON_SQL = f"""
+    SELECT COALESCE(json_agg(u), '[]'::json)::text
+    FROM ({ALL_USERS_SQL}) u
+"""
+
+RECENT_LOGS_SQL = """
+    SELECT user_id, username, first_name, command,
+           params, coins_spent, timestamp
+    FROM usage_logs
+    ORDER BY timestamp DESC
+    LIMIT $1
+"""
+
+# Expiry is decided by the server, on the same clock DEDUCT_COINS_SQL uses
+USER_COINS_SQL = """
+    SELECT CASE WHEN is_admin THEN 999999
+                WHEN coins_expire_at <= LOCALTIMESTAMP THEN 0
+                ELSE coin_balance END AS balance,
+           CASE WHEN is_admin THEN NULL ELSE coins_expire_at END AS expires_at,
+           COALESCE(NOT is_admin AND coins_expire_at <= LOCALTIMESTAMP, FALSE) AS is_expired,
+           COALESCE(is_admin, FALSE) AS is_admin
+    FROM users WHERE user_id = $1
+"""
+
+TRANSACTION_HISTORY_SQL = """
+    SELECT transaction_type, amount, balance_after,
+           description, created_at
+    FROM coin_transactions
+    WHERE user_id = $1
+    ORDER BY created_at DESC
+    LIMIT $2
+"""
+
+# Recent transactions pre-formatted for chat display ("➕ 5 coins - ...")
+TRANSACTION_LINES_SQL = """
+    SELECT (CASE WHEN amount > 0 THEN '➕ ' ELSE '➖ ' END)
+           || abs(amount) || ' coins - '
+           || left(COALESCE(description, ''), 30) AS line
+    FROM coin_transactions
+    WHERE user_id = $1
+    ORDER BY created_at DESC
+    LIMIT $2
+"""
+
+# Conditional spend plus its ledger row in one statement; admins keep their
+# balance and are logged at 999999. No row back means the user cannot pay.
+DEDUCT_COINS_SQL = """
+    WITH upd AS (
+        UPDATE users SET
+            coin_balance = CASE WHEN is_admin THEN coin_balance
+                                ELSE coin_balance - $2 END,
+            last_seen = CURRENT_TIMESTAMP
+        WHERE user_id = $1
+          AND (is_admin OR (
+              coin_balance >= $2
+              AND (coins_expire_at IS NULL OR coins_expire_at > LOCALTIMESTAMP)
+          ))
+        RETURNING coin_balance, is_admin
+    )
+    INSERT INTO coin_transactions
+        (user_id, transaction_type, amount, balance_after, description)
+    SELECT $1, 'spend', -$2,
+           CASE WHEN upd.is_admin THEN 999999 ELSE upd.coin_balance END, $3
+    FROM upd
+    RETURNING balance_after, (SELECT is_admin FROM upd) AS is_admin
+"""
+
+# Credit plus its ledger row in one statement; admins are left untouched.
+# With extend_expiry ($4) the expiry moves to $5 days from now.
+ADD_COINS_SQL = """
+    WITH upd AS (
+        UPDATE users SET
+            coin_balance = COALESCE(coin_balance, 0) + $2,
+            coins_expire_at = CASE WHEN $4 THEN LOCALTIMESTAMP + make_interval(days => $5)
+                                   ELSE coins_expire_at END,
+            total_coins_purchased = total_coins_purchased + CASE WHEN $4 THEN $2 ELSE 0 END,
+            last_seen = CURRENT_TIMESTAMP
+        WHERE user_id = $1 AND is_admin IS NOT TRUE
+        RETURNING coin_balance
+    )
+    INSERT INTO coin_transactions
+        (user_id, transaction_type, amount, balance_after, description)
+    SELECT $1, $3, $2, coin_balance, $6
+    FROM upd
+    RETURNING balance_after
+"""
+
+# Checkout paid: payment row upserted to 'completed', purchase credit (expiry
+# moves to $3 days from now) and its ledger row in one statement. A session
+# that is already completed (a redelivered webhook) credits nothing, which the
+# unique index on stripe_session_id enforces even for concurrent deliveries.
+# Admins are left untouched.
+COMPLETE_PURCHASE_SQL = """
+    WITH paid AS (
+        INSERT INTO payment_history
+            (user_id, stripe_session_id, amount_usd, coins_purchased, status,
+             stripe_payment_intent, completed_at)
+        VALUES ($1, $5, $7, $2, 'completed', $6, CURRENT_TIMESTAMP)
+        ON CONFLICT (stripe_session_id) DO UPDATE SET
+            status = 'completed',
+            stripe_payment_intent = EXCLUDED.stripe_payment_intent,
+            completed_at = CURRENT_TIMESTAMP
+        WHERE payment_history.status IS DISTINCT FROM 'completed'
+        RETURNING 1
+    ), upd AS (
+        UPDATE users SET
+            coin_balance = COALESCE(coin_balance, 0) + $2,
+            coins_expire_at = LOCALTIMESTAMP + make_interval(days => $3),
+            total_coins_purchased = total_coins_purchased + $2,
+            last_seen = CURRENT_TIMESTAMP
+        WHERE user_id = $1 AND is_admin IS NOT TRUE AND EXISTS (SELECT 1 FROM paid)
+        RETURNING coin_balance
+    ), tx AS (
+        INSERT INTO coin_transactions
+            (user_id, transaction_type, amount, balance_after, description)
+        SELECT $1, 'purchase', $2, coin_balance, $4
+        FROM upd
+        RETURNING balance_after
+    )
+    SELECT EXISTS (SELECT 1 FROM paid) AS fresh,
+           (SELECT balance_after FROM tx) AS balance_after
+"""
+
+# Upsert a user and, only for a real insert (xmax = 0), log the welcome bonus
+ADD_USER_SQL = """
+    WITH ins AS (
+        INSERT INTO users
+        (user_id, username, first_name, last_name, added_by,
+         coin_balance, coins_expire_at, free_coins_claimed)
+        VALUES ($1, $2, $3, $4, $5, $6,
+                LOCALTIMESTAMP + make_interval(days => $7), TRUE)
+        ON CONFLICT (user_id) DO UPDATE SET
+            username = EXCLUDED.username,
+            first_name = EXCLUDED.first_name,
+            last_name = EXCLUDED.last_name,
+            is_active = TRUE,
+            last_seen = CURRENT_TIMESTAMP
+        RETURNING user_id, is_admin, coin_balance, (xmax = 0) AS is_new
+    )
+    INSERT INTO coin_transactions
+        (user_id, transaction_type, amount, balance_after, description)
+    SELECT user_id, 'initial_signup', $6, coin_balance, 'Welcome bonus coins'
+    FROM ins
+    WHERE is_new AND is_admin IS NOT TRUE
+"""
+
+# All dashboard numbers in one round trip; top commands (read from the
+# mv_top_commands_7d rollup) come back as two parallel arrays in the same order
+BOT_STATISTICS_SQL = """
+    WITH u AS (
+        SELECT COUNT(*) AS total,
+               COUNT(*) FILTER (WHERE is_active = TRUE) AS active
+        FROM users
+    ), c AS (
+        SELECT COUNT(*) AS cnt
+        FROM usage_logs
+        WHERE timestamp > CURRENT_TIMESTAMP - INTERVAL '24 hours'
+    ), t AS (
+        SELECT array_agg(command ORDER BY cnt DESC, command) AS commands,
+               array_agg(cnt ORDER BY cnt DESC, command) AS counts
+        FROM (
+            SELECT command, cnt
+            FROM mv_top_commands_7d
+            ORDER BY cnt DESC, command
+            LIMIT 5
+        ) top
+    )
+    SELECT u.total AS total_users, u.active AS active_users,
+           c.cnt AS commands_24h,
+           t.commands AS top_commands, t.counts AS top_counts
+    FROM u, c, t
+"""
+
+# Claims the next mv_top_commands_7d refresh; the last refresh time lives in
+# bot_stats, so it survives cold starts and only one instance per window wins.
+# $1 = max age in seconds. Returns a row only when the caller should refresh
+CLAIM_TOP_COMMANDS_REFRESH_SQL = """
+    INSERT INTO bot_stats (stat_name, stat_value, updated_at)
+    VALUES ('mv_top_commands_7d_refreshed', NULL, CURRENT_TIMESTAMP)
+    ON CONFLICT (stat_name) DO UPDATE SET updated_at = EXCLUDED.updated_at
+    WHERE bot_stats.updated_at < CURRENT_TIMESTAMP - make_interval(secs => $1)
+    RETURNING 1
+"""
+
+# Full schema, sent as one multi-statement simple query
+SCHEMA_DDL = """
+    -- Users table (enhanced with coin fields)
+    CREATE TABLE IF NOT EXISTS users (
+        user_id BIGINT PRIMARY KEY,
+        username TEXT,
+        first_name TEXT,
+        last_name TEXT,
+        is_admin BOOLEAN DEFAULT FALSE,
+        is_active BOOLEAN DEFAULT TRUE,
+        added_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        added_by BIGINT,
+        last_seen TIMESTAMP,
+        coin_balance INTEGER DEFAULT 10,
+        coins_expire_at TIMESTAMP,
+        total_coins_purchased INTEGER DEFAULT 0,
+        free_coins_claimed BOOLEAN DEFAULT TRUE
+    );
+
+    -- Coin transactions table
+    CREATE TABLE IF NOT EXISTS coin_transactions (
+        id SERIAL PRIMARY KEY,
+        user_id BIGINT REFERENCES users(user_id),
+        transaction_type TEXT,
+        amount INTEGER,
+        balance_after INTEGER,
+        description TEXT,
+        stripe_payment_id TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    -- Create index on user_id for faster lookups
+    CREATE INDEX IF NOT EXISTS idx_coin_transactions_user_id
+    ON coin_transactions(user_id);
+
+    -- Coin packages table
+    CREATE TABLE IF NOT EXISTS coin_packages (
+        id SERIAL PRIMARY KEY,
+        package_name TEXT,
+        coins INTEGER,
+        price_usd DECIMAL(10, 2),
+        stripe_price_id TEXT,
+        bonus_coins INTEGER DEFAULT 0,
+        is_active BOOLEAN DEFAULT TRUE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    -- Payment history table
+    CREATE TABLE IF NOT EXISTS payment_history (
+        id SERIAL PRIMARY KEY,
+        user_id BIGINT REFERENCES users(user_id),
+        stripe_payment_intent TEXT UNIQUE,
+        stripe_session_id TEXT,
+        amount_usd DECIMAL(10, 2),
+        coins_purchased INTEGER,
+        status TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        completed_at TIMESTAMP
+    );
+
+    -- Command costs table
+    CREATE TABLE IF NOT EXISTS command_costs (
+        command TEXT PRIMARY KEY,
+        cost INTEGER,
+        description TEXT
+    );
+
+    -- Usage logs table
+    CREATE TABLE IF NOT EXISTS usage_logs (
+        id SERIAL,
+        user_id BIGINT REFERENCES users(user_id),
+        username TEXT,
+        first_name TEXT,
+        command TEXT,
+        params TEXT,
+        coins_spent INTEGER DEFAULT 0,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (id, timestamp)
+    ) PARTITION BY RANGE (timestamp);
+
+    -- Catches rows outside the monthly partitions. Partitions are UNLOGGED:
+    -- usage logs are analytics, so skipping WAL is worth losing recent rows on a crash.
+    -- Installs from before partitioning keep usage_logs as a plain table; skip it there
+    DO $$
+    BEGIN
+        IF (SELECT relkind FROM pg_class WHERE oid = 'usage_logs'::regclass) = 'p' THEN
+            CREATE UNLOGGED TABLE IF NOT EXISTS usage_logs_default PARTITION OF usage_logs DEFAULT;
+        END IF;
+    END $$;
+
+    -- Create index for faster log queries
+    CREATE INDEX IF NOT EXISTS idx_usage_logs_timestamp
+    ON usage_logs(timestamp DESC);
+
+    -- Admin actions table
+    CREATE TABLE IF NOT EXISTS admin_actions (
+        id SERIAL PRIMARY KEY,
+        admin_id BIGINT REFERENCES users(user_id),
+        action TEXT,
+        details TEXT,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    -- Bot statistics table
+    CREATE TABLE IF NOT EXISTS bot_stats (
+        id SERIAL PRIMARY KEY,
+        stat_name TEXT UNIQUE,
+        stat_value TEXT,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    -- Append-mostly time series: BRIN keeps the range index tiny
+    CREATE INDEX IF NOT EXISTS idx_usage_logs_timestamp_brin
+    ON usage_logs USING brin(timestamp) WITH (pages_per_range = 32);
+
+    -- Rolling 7-day command counts, refreshed by get_bot_statistics
+    CREATE MATERIALIZED VIEW IF NOT EXISTS mv_top_commands_7d AS
+    SELECT command, COUNT(*) AS cnt
+    FROM usage_logs
+    WHERE timestamp > CURRENT_TIMESTAMP - INTERVAL '7 days'
+    GROUP BY command;
+
+    -- Unique index required by REFRESH ... CONCURRENTLY
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_top_commands_7d_command
+    ON mv_top_commands_7d(command);
+
+    CREATE INDEX IF NOT EXISTS idx_coin_transactions_created_at_brin
+    ON coin_transactions USING brin(created_at);
+
+    -- Webhook lookups by checkout session; one payment row per session
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_payment_history_session
+    ON payment_history(stripe_session_id);
+"""
+
+# Monthly usage_logs partition; old months can be dropped as whole tables.
+# UNLOGGED like the default partition (WAL is skipped for analytics rows)
+USAGE_LOG_PARTITION_SQL = """
+    CREATE UNLOGGED TABLE IF NOT EXISTS {name} PARTITION OF usage_logs
+    FOR VALUES FROM ('{start}') TO ('{end}')
+"""
+
+# Last object SCHEMA_DDL creates; keep in sync when appending to the script
+SCHEMA_SENTINEL = 'idx_payment_history_session'
+
 
 class Database:
+    # Row-returning read methods hand back asyncpg.Record objects as-is: they
+    # support row['column'] and .get() like a dict but are immutable and
+    # need no per-row copy. Note that iterating a Record yields values, not keys.
+    COMMAND_COSTS_TTL = 300  # seconds
+    COIN_PACKAGES_TTL = 60
+    TOP_COMMANDS_REFRESH = 300  # max age of mv_top_commands_7d
+    ADMIN_IDS_TTL = 60  # reload admin ids so changes made elsewhere are picked up
+    USAGE_QUEUE_SIZE = 10_000  # queued usage rows before new ones are dropped
+    USAGE_FLUSH_BATCH = 1000  # rows per COPY
+    CURSOR_PREFETCH = 500  # rows per round trip for iter_* methods
+
     def __init__(self, database_url: str = None):
         """Initialize database connection pool"""
         self.database_url = database_url or os.getenv('DATABASE_URL')
@@ -23,13 +414,35 @@ class Database:
 
         self.pool = None
         self._lock = asyncio.Lock()
+        # Set once the pool exists and schema/admin ids are loaded
+        self._ready = asyncio.Event()
+
+        # Near-static lookup tables, cached in-process (see *_TTL)
+        self._command_costs: Dict[str, int] = {}
+        self._command_costs_loaded_at = float('-inf')
+        self._coin_packages: List[asyncpg.Record] = []
+        self._coin_packages_loaded_at = float('-inf')
+        self._top_commands_refreshed_at = float('-inf')
+
+        # Admin user ids, loaded by init_pool, kept current by make_admin/remove_admin
+        # and reloaded every ADMIN_IDS_TTL (other instances or SQL may change them)
+        self._admin_ids: set[int] = set()
+        self._admin_ids_loaded_at = float('-inf')
+
+        # Usage rows are queued and written in the background (see log_usage)
+        self._usage_queue: asyncio.Queue = asyncio.Queue(maxsize=self.USAGE_QUEUE_SIZE)
+        self._usage_flusher: Optional[asyncio.Task] = None
         self._is_serverless = os.getenv('VERCEL') or os.getenv('AWS_LAMBDA_FUNCTION_NAME')
 
+        # Coin settings, read once per process
+        self._initial_coins = int(os.getenv('INITIAL_FREE_COINS', '10'))
+        self._expiry_days = int(os.getenv('COINS_EXPIRY_DAYS', '30'))
+
     async def init_pool(self):
         """Initialize connection pool (or single connection for serverless)"""
-        if not self.pool:
+        if not self._ready.is_set():
             async with self._lock:
-                if not self.pool:
+                if not self._ready.is_set():
                     try:
                         if self._is_serverless:
                             # For serverless: use single connection with specific settings
@@ -45,6 +458,7 @@ class Database:
                                 min_size=1,
                                 max_size=1,
                                 command_timeout=10,
+                                statement_cache_size=STATEMENT_CACHE_SIZE,
                                 timeout=10,
                                 ssl=ssl_context,
                                 server_settings={
@@ -55,17 +469,31 @@ class Database:
                             # For regular deployment: use standard pool
                             self.pool = await asyncpg.create_pool(
                                 self.database_url,
-                                min_size=1,
-                                max_size=10,
-                                command_timeout=60
+                                min_size=int(os.getenv('DB_POOL_MIN', '5')),
+                                max_size=int(os.getenv('DB_POOL_MAX', '25')),
+                                command_timeout=60,
+                                statement_cache_size=STATEMENT_CACHE_SIZE,
+                                max_cached_statement_lifetime=0,
+                                max_inactive_connection_lifetime=300
                             )
                         await self._init_db()
+                        await self._load_admin_ids()
+                        self._ready.set()
                     except Exception as e:
                         logger.error(f"Failed to create connection pool: {e}")
+                        # Leave no half-initialised pool behind; the next call retries
+                        if self.pool:
+                            await self.pool.close()
+                            self.pool = None
                         raise
 
     async def close_pool(self):
         """Close connection pool"""
+        # Write out queued usage rows first
+        if self._usage_flusher is not None and not self._usage_flusher.done():
+            await self._usage_flusher
+
+        self._ready.clear()
         if self.pool:
             await self.pool.close()
             self.pool = None
@@ -73,132 +501,25 @@ class Database:
     @asynccontextmanager
     async def _get_connection(self):
         """Get a database connection from pool"""
-        if not self.pool:
+        if not self._ready.is_set():
             await self.init_pool()
 
         async with self.pool.acquire() as conn:
             yield conn
 
     async def _init_db(self):
-        """Initialize database tables"""
-        async with self._get_connection() as conn:
-            # Users table (enhanced with coin fields)
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id BIGINT PRIMARY KEY,
-                    username TEXT,
-                    first_name TEXT,
-                    last_name TEXT,
-                    is_admin BOOLEAN DEFAULT FALSE,
-                    is_active BOOLEAN DEFAULT TRUE,
-                    added_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    added_by BIGINT,
-                    last_seen TIMESTAMP,
-                    coin_balance INTEGER DEFAULT 10,
-                    coins_expire_at TIMESTAMP,
-                    total_coins_purchased INTEGER DEFAULT 0,
-                    free_coins_claimed BOOLEAN DEFAULT TRUE
-                )
-            """)
-
-            # Coin transactions table
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS coin_transactions (
-                    id SERIAL PRIMARY KEY,
-                    user_id BIGINT REFERENCES users(user_id),
-                    transaction_type TEXT,
-                    amount INTEGER,
-                    balance_after INTEGER,
-                    description TEXT,
-                    stripe_payment_id TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-
-            # Create index on user_id for faster lookups
-            await conn.execute("""
-                CREATE INDEX IF NOT EXISTS idx_coin_transactions_user_id
-                ON coin_transactions(user_id)
-            """)
-
-            # Coin packages table
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS coin_packages (
-                    id SERIAL PRIMARY KEY,
-                    package_name TEXT,
-                    coins INTEGER,
-                    price_usd DECIMAL(10, 2),
-                    stripe_price_id TEXT,
-                    bonus_coins INTEGER DEFAULT 0,
-                    is_active BOOLEAN DEFAULT TRUE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-
-            # Payment history table
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS payment_history (
-                    id SERIAL PRIMARY KEY,
-                    user_id BIGINT REFERENCES users(user_id),
-                    stripe_payment_intent TEXT UNIQUE,
-                    stripe_session_id TEXT,
-                    amount_usd DECIMAL(10, 2),
-                    coins_purchased INTEGER,
-                    status TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    completed_at TIMESTAMP
-                )
-            """)
-
-            # Command costs table
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS command_costs (
-                    command TEXT PRIMARY KEY,
-                    cost INTEGER,
-                    description TEXT
-                )
-            """)
-
-            # Usage logs table
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS usage_logs (
-                    id SERIAL PRIMARY KEY,
-                    user_id BIGINT REFERENCES users(user_id),
-                    username TEXT,
-                    first_name TEXT,
-                    command TEXT,
-                    params TEXT,
-                    coins_spent INTEGER DEFAULT 0,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-
-            # Create index for faster log queries
-            await conn.execute("""
-                CREATE INDEX IF NOT EXISTS idx_usage_logs_timestamp
-                ON usage_logs(timestamp DESC)
-            """)
-
-            # Admin actions table
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS admin_actions (
-                    id SERIAL PRIMARY KEY,
-                    admin_id BIGINT REFERENCES users(user_id),
-                    action TEXT,
-                    details TEXT,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-
-            # Bot statistics table
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS bot_stats (
-                    id SERIAL PRIMARY KEY,
-                    stat_name TEXT UNIQUE,
-                    stat_value TEXT,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
+        """Initialize database tables (runs inside init_pool, before the pool is ready)"""
+        async with self.pool.acquire() as conn:
+            # The DDL script runs as one implicit transaction, so its last object
+            # existing means the whole schema is already in place
+            if await conn.fetchval("SELECT to_regclass($1) IS NULL", SCHEMA_SENTINEL):
+                await conn.execute(SCHEMA_DDL)
+
+            await self._ensure_usage_log_partitions(conn)
+
+            # Seed defaults once; warm starts find command_costs populated and skip this
+            if await conn.fetchval("SELECT EXISTS(SELECT 1 FROM command_costs)"):
+                return
 
             # Insert default coin packages
             default_packages = [
@@ -209,14 +530,6 @@ class Database:
                 ('Ultimate Pack', 500, 139.99, None, 150),
             ]
 
-            for package in default_packages:
-                await conn.execute("""
-                    INSERT INTO coin_packages
-                    (package_name, coins, price_usd, stripe_price_id, bonus_coins)
-                    VALUES ($1, $2, $3, $4, $5)
-                    ON CONFLICT DO NOTHING
-                """, *package)
-
             # Insert default command costs
             default_costs = [
                 ('analyze', 2, 'Full subreddit analysis'),
@@ -233,15 +546,6 @@ class Database:
                 ('discover', 10, 'Discover related subreddits (admin only)'),
             ]
 
-            for cost_data in default_costs:
-                await conn.execute("""
-                    INSERT INTO command_costs (command, cost, description)
-                    VALUES ($1, $2, $3)
-                    ON CONFLICT (command) DO UPDATE SET
-                        cost = EXCLUDED.cost,
-                        description = EXCLUDED.description
-                """, *cost_data)
-
             # Add initial admins with unlimited coins
             initial_admins = [
                 (5028346767, 'panagiotis_krb', 'Panagiotis', 'Karampetsos'),
@@ -250,18 +554,73 @@ class Database:
                 (6923635816, None, 'Admin4', None)
             ]
 
-            for admin_id, username, first_name, last_name in initial_admins:
-                await conn.execute("""
-                    INSERT INTO users
-                    (user_id, username, first_name, last_name, is_admin, is_active,
-                     coin_balance, coins_expire_at, free_coins_claimed)
-                    VALUES ($1, $2, $3, $4, TRUE, TRUE, 999999,
-                            CURRENT_TIMESTAMP + INTERVAL '10 years', TRUE)
-                    ON CONFLICT (user_id) DO UPDATE SET
-                        is_admin = TRUE,
-                        coin_balance = 999999,
-                        coins_expire_at = CURRENT_TIMESTAMP + INTERVAL '10 years'
-                """, admin_id, username, first_name, last_name)
+            async with conn.transaction():
+                await self.bulk_insert(
+                    'coin_packages',
+                    ('package_name', 'coins', 'price_usd', 'stripe_price_id', 'bonus_coins'),
+                    ('text', 'int', 'numeric', 'text', 'int'),
+                    default_packages,
+                    on_conflict="ON CONFLICT DO NOTHING",
+                    conn=conn
+                )
+
+                await self.bulk_insert(
+                    'command_costs',
+                    ('command', 'cost', 'description'),
+                    ('text', 'int', 'text'),
+                    default_costs,
+                    on_conflict="""ON CONFLICT (command) DO UPDATE SET
+                        cost = EXCLUDED.cost,
+                        description = EXCLUDED.description""",
+                    conn=conn
+                )
+
+                await conn.execute(SEED_ADMINS_SQL, *map(list, zip(*initial_admins)))
+
+    async def bulk_insert(self, table: str, columns: Tuple[str, ...], types: Tuple[str, ...],
+                          rows: List[tuple], on_conflict: str = '', conn=None) -> None:
+        """Insert many rows in one statement using one array parameter per column.
+
+        ``types`` are the Postgres element types for ``columns`` (e.g. 'int',
+        'text'); ``on_conflict`` is appended verbatim. Pass ``conn`` to run
+        inside an existing transaction.
+        """
+        if not rows:
+            return
+        sql = _unnest_insert_sql(table, tuple(columns), tuple(types), on_conflict)
+        arrays = [list(col) for col in zip(*rows)]
+        if conn is not None:
+            await conn.execute(sql, *arrays)
+            return
+        async with self._get_connection() as conn:
+            await conn.execute(sql, *arrays)
+
+    async def _ensure_usage_log_partitions(self, conn):
+        """Create this month's and next month's usage_logs partitions.
+
+        Runs on every cold start, so the next partition exists before it is
+        needed. Tables created before usage_logs was partitioned are left alone.
+        """
+        this_month = date.today().replace(day=1)
+        next_month = (this_month + timedelta(days=32)).replace(day=1)
+        after_next = (next_month + timedelta(days=32)).replace(day=1)
+        next_name = f"usage_logs_{next_month:%Y_%m}"
+
+        needed = await conn.fetchval("""
+            SELECT relkind = 'p' AND to_regclass($1) IS NULL
+            FROM pg_class WHERE oid = 'usage_logs'::regclass
+        """, next_name)
+        if not needed:
+            return
+
+        for start, end in ((this_month, next_month), (next_month, after_next)):
+            try:
+                await conn.execute(USAGE_LOG_PARTITION_SQL.format(
+                    name=f"usage_logs_{start:%Y_%m}", start=start, end=end
+                ))
+            except asyncpg.PostgresError as e:
+                # e.g. the default partition already holds rows for this month
+                logger.error(f"Error creating usage_logs partition for {start:%Y-%m}: {e}")
 
     # ========== USER MANAGEMENT METHODS ==========
 
@@ -271,31 +630,10 @@ class Database:
         """Add a new user with initial free coins"""
         try:
             async with self._get_connection() as conn:
-                initial_coins = int(os.getenv('INITIAL_FREE_COINS', '10'))
-                expiry_days = int(os.getenv('COINS_EXPIRY_DAYS', '30'))
-                expiry_date = datetime.now() + timedelta(days=expiry_days)
+                await conn.execute(ADD_USER_SQL, user_id, username, first_name, last_name,
+                                   added_by, self._initial_coins, self._expiry_days)
 
-                await conn.execute("""
-                    INSERT INTO users
-                    (user_id, username, first_name, last_name, added_by,
-                     coin_balance, coins_expire_at, free_coins_claimed)
-                    VALUES ($1, $2, $3, $4, $5, $6, $7, TRUE)
-                    ON CONFLICT (user_id) DO UPDATE SET
-                        username = EXCLUDED.username,
-                        first_name = EXCLUDED.first_name,
-                        last_name = EXCLUDED.last_name,
-                        is_active = TRUE,
-                        last_seen = CURRENT_TIMESTAMP
-                """, user_id, username, first_name, last_name, added_by,
-                     initial_coins, expiry_date)
-
-                # Log the transaction
-                await self.add_coins(
-                    user_id, initial_coins, 'initial_signup',
-                    'Welcome bonus coins', extend_expiry=False
-                )
-
-                logger.info(f"User {user_id} added with {initial_coins} coins")
+                logger.info(f"User {user_id} added with {self._initial_coins} coins")
                 return True
 
         except Exception as e:
@@ -306,22 +644,32 @@ class Database:
         """Check if user is active"""
         try:
             async with self._get_connection() as conn:
-                result = await conn.fetchval("""
-                    SELECT is_active FROM users WHERE user_id = $1
-                """, user_id)
+                result = await conn.fetchval(IS_ACTIVE_SQL, user_id)
                 return result if result is not None else False
         except Exception as e:
             logger.error(f"Error checking user access: {e}")
             return False
 
+    async def _load_admin_ids(self):
+        """Load the admin user ids into memory (admins are few)"""
+        loaded_at = time.monotonic()
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(ADMIN_IDS_SQL)
+        self._admin_ids = {row['user_id'] for row in rows}
+        self._admin_ids_loaded_at = loaded_at
+
+    async def _get_admin_ids(self) -> set[int]:
+        """Admin user ids, reloaded once older than ADMIN_IDS_TTL"""
+        if not self._ready.is_set():
+            await self.init_pool()
+        if time.monotonic() - self._admin_ids_loaded_at > self.ADMIN_IDS_TTL:
+            await self._load_admin_ids()
+        return self._admin_ids
+
     async def is_admin(self, user_id: int) -> bool:
         """Check if user has admin privileges"""
         try:
-            async with self._get_connection() as conn:
-                result = await conn.fetchval("""
-                    SELECT is_admin FROM users WHERE user_id = $1
-                """, user_id)
-                return result if result is not None else False
+            return user_id in await self._get_admin_ids()
         except Exception as e:
             logger.error(f"Error checking admin status: {e}")
             return False
@@ -337,7 +685,8 @@ class Database:
                         coins_expire_at = CURRENT_TIMESTAMP + INTERVAL '10 years'
                     WHERE user_id = $1
                 """, user_id)
-                return True
+            self._admin_ids.add(user_id)
+            return True
         except Exception as e:
             logger.error(f"Error making user admin: {e}")
             return False
@@ -349,7 +698,8 @@ class Database:
                 await conn.execute("""
                     UPDATE users SET is_admin = FALSE WHERE user_id = $1
                 """, user_id)
-                return True
+            self._admin_ids.discard(user_id)
+            return True
         except Exception as e:
             logger.error(f"Error removing admin: {e}")
             return False
@@ -366,31 +716,40 @@ class Database:
             logger.error(f"Error deactivating user: {e}")
             return False
 
-    async def get_all_users(self) -> List[Dict[str, Any]]:
+    async def iter_all_users(self) -> AsyncIterator[asyncpg.Record]:
+        """Yield all users sorted by admin status and date, fetched in pages
+        through a server-side cursor. The connection is held until the
+        iteration finishes, so don't await slow work between items."""
+        async with self._get_connection() as conn:
+            async with conn.transaction():
+                async for row in conn.cursor(ALL_USERS_SQL, prefetch=self.CURSOR_PREFETCH):
+                    yield row
+
+    async def get_all_users(self) -> List[asyncpg.Record]:
         """Get all users sorted by admin status and date"""
         try:
-            async with self._get_connection() as conn:
-                rows = await conn.fetch("""
-                    SELECT user_id, username, first_name, last_name,
-                           is_admin, is_active, added_date, coin_balance
-                    FROM users
-                    ORDER BY is_admin DESC, added_date DESC
-                """)
-                return [dict(row) for row in rows]
+            return [user async for user in self.iter_all_users()]
         except Exception as e:
             logger.error(f"Error getting users: {e}")
             return []
 
+    async def get_all_users_json(self) -> str:
+        """Get all users as a JSON array string, built by Postgres so no
+        per-row dicts are created (for HTTP endpoints)"""
+        try:
+            async with self._get_connection() as conn:
+                return await conn.fetchval(ALL_USERS_JSON_SQL)
+        except Exception as e:
+            logger.error(f"Error getting users: {e}")
+            return '[]'
+
     # ========== COIN SYSTEM METHODS ==========
 
     async def get_user_coins(self, user_id: int) -> Dict[str, Any]:
         """Get user coins"""
         try:
             async with self._get_connection() as conn:
-                result = await conn.fetchrow("""
-                    SELECT coin_balance, coins_expire_at, is_admin
-                    FROM users WHERE user_id = $1
-                """, user_id)
+                result = await conn.fetchrow(USER_COINS_SQL, user_id)
 
                 if not result:
                     return {
@@ -400,29 +759,7 @@ class Database:
                         'is_admin': False
                     }
 
-                balance, expire_at, is_admin = result['coin_balance'], result['coins_expire_at'], result['is_admin']
-
-                # Admins have unlimited coins
-                if is_admin:
-                    return {
-                        'balance': 999999,
-                        'expires_at': None,
-                        'is_expired': False,
-                        'is_admin': True
-                    }
-
-                # Check if coins expired
-                is_expired = False
-                if expire_at and datetime.now() > expire_at:
-                    is_expired = True
-                    balance = 0
-
-                return {
-                    'balance': balance,
-                    'expires_at': expire_at.isoformat() if expire_at else None,
-                    'is_expired': is_expired,
-                    'is_admin': False
-                }
+                return dict(result)
 
         except Exception as e:
             logger.error(f"Error getting user coins: {e}")
@@ -436,47 +773,28 @@ class Database:
     async def deduct_coins(self, user_id: int, amount: int, command: str,
                           description: str = None) -> bool:
         """Deduct coins from user"""
-        try:
-            async with self._get_connection() as conn:
-                # Check if admin (unlimited coins)
-                is_admin = await conn.fetchval("""
-                    SELECT is_admin FROM users WHERE user_id = $1
-                """, user_id)
+        return await self.try_deduct_coins(user_id, amount, command, description) is not None
 
-                if is_admin:
-                    # Log the transaction but don't deduct
-                    await self._log_transaction(
-                        user_id, 'spend', -amount, 999999,
-                        description or f"Used {command} command"
-                    )
-                    return True
+    async def try_deduct_coins(self, user_id: int, amount: int, command: str,
+                               description: str = None) -> Optional[Tuple[int, bool]]:
+        """Deduct coins and log the spend in one atomic statement if the user can pay.
 
-                # Get current balance
-                coins_data = await self.get_user_coins(user_id)
-
-                if coins_data['is_expired'] or coins_data['balance'] < amount:
-                    return False
-
-                # Deduct coins
-                new_balance = coins_data['balance'] - amount
-                await conn.execute("""
-                    UPDATE users SET
-                        coin_balance = $1,
-                        last_seen = CURRENT_TIMESTAMP
-                    WHERE user_id = $2
-                """, new_balance, user_id)
-
-                # Log transaction
-                await self._log_transaction(
-                    user_id, 'spend', -amount, new_balance,
+        Returns (balance_after, is_admin), or None if the balance is too low,
+        the coins have expired or the user does not exist.
+        """
+        try:
+            async with self._get_connection() as conn:
+                row = await conn.fetchrow(
+                    DEDUCT_COINS_SQL, user_id, amount,
                     description or f"Used {command} command"
                 )
-
-                return True
+                if row is None:
+                    return None
+                return row['balance_after'], row['is_admin']
 
         except Exception as e:
             logger.error(f"Error deducting coins: {e}")
-            return False
+            return None
 
     async def add_coins(self, user_id: int, amount: int,
                        transaction_type: str = 'admin_add',
@@ -485,53 +803,17 @@ class Database:
         """Add coins to user"""
         try:
             async with self._get_connection() as conn:
-                # Check if admin
-                is_admin = await conn.fetchval("""
-                    SELECT is_admin FROM users WHERE user_id = $1
-                """, user_id)
-
-                if is_admin:
-                    # Admins always have unlimited coins
-                    return True
-
-                # Get current balance
-                current_balance = await conn.fetchval("""
-                    SELECT coin_balance FROM users WHERE user_id = $1
-                """, user_id)
-
-                if current_balance is None:
-                    current_balance = 0
-
-                new_balance = current_balance + amount
-
-                # Update balance
-                if extend_expiry:
-                    expiry_days = int(os.getenv('COINS_EXPIRY_DAYS', '30'))
-                    new_expiry = datetime.now() + timedelta(days=expiry_days)
-
-                    await conn.execute("""
-                        UPDATE users SET
-                            coin_balance = $1,
-                            coins_expire_at = $2,
-                            last_seen = CURRENT_TIMESTAMP,
-                            total_coins_purchased = total_coins_purchased + $3
-                        WHERE user_id = $4
-                    """, new_balance, new_expiry, amount, user_id)
-                else:
-                    await conn.execute("""
-                        UPDATE users SET
-                            coin_balance = $1,
-                            last_seen = CURRENT_TIMESTAMP
-                        WHERE user_id = $2
-                    """, new_balance, user_id)
-
-                # Log transaction
-                await self._log_transaction(
-                    user_id, transaction_type, amount, new_balance,
+                balance_after = await conn.fetchval(
+                    ADD_COINS_SQL, user_id, amount, transaction_type,
+                    extend_expiry, self._expiry_days,
                     description or f"Added {amount} coins"
                 )
+                if balance_after is not None:
+                    return True
 
-                return True
+                # Nothing updated: admins always have unlimited coins,
+                # otherwise the user does not exist
+                return user_id in await self._get_admin_ids()
 
         except Exception as e:
             logger.error(f"Error adding coins: {e}")
@@ -543,62 +825,76 @@ class Database:
         """Log a coin transaction"""
         try:
             async with self._get_connection() as conn:
-                await conn.execute("""
-                    INSERT INTO coin_transactions
-                    (user_id, transaction_type, amount, balance_after,
-                     description, stripe_payment_id)
-                    VALUES ($1, $2, $3, $4, $5, $6)
-                """, user_id, transaction_type, amount, balance_after,
-                     description, stripe_payment_id)
+                await conn.execute(LOG_TRANSACTION_SQL, user_id, transaction_type, amount,
+                                   balance_after, description, stripe_payment_id)
         except Exception as e:
             logger.error(f"Error logging transaction: {e}")
 
     async def get_user_transaction_history(self, user_id: int,
-                                          limit: int = 50) -> List[Dict[str, Any]]:
+                                          limit: int = 50) -> List[asyncpg.Record]:
         """Get user's transaction history"""
         try:
             async with self._get_connection() as conn:
-                rows = await conn.fetch("""
-                    SELECT transaction_type, amount, balance_after,
-                           description, created_at
-                    FROM coin_transactions
-                    WHERE user_id = $1
-                    ORDER BY created_at DESC
-                    LIMIT $2
-                """, user_id, limit)
-                return [dict(row) for row in rows]
+                rows = await conn.fetch(TRANSACTION_HISTORY_SQL, user_id, limit)
+                return rows
         except Exception as e:
             logger.error(f"Error getting transaction history: {e}")
             return []
 
-    # ========== COMMAND & PRICING METHODS ==========
-
-    async def get_command_cost(self, command: str) -> int:
-        """Get coin cost for a command"""
+    async def get_recent_transaction_lines(self, user_id: int,
+                                           limit: int = 5) -> List[str]:
+        """Get the user's latest transactions as display lines"""
         try:
             async with self._get_connection() as conn:
-                cost = await conn.fetchval("""
-                    SELECT cost FROM command_costs WHERE command = $1
-                """, command)
-                return cost if cost is not None else 0
+                rows = await conn.fetch(TRANSACTION_LINES_SQL, user_id, limit)
+                return [row['line'] for row in rows]
         except Exception as e:
-            logger.error(f"Error getting command cost: {e}")
-            return 0
+            logger.error(f"Error getting transaction lines: {e}")
+            return []
 
-    async def get_coin_packages(self) -> List[Dict[str, Any]]:
+    # ========== COMMAND & PRICING METHODS ==========
+
+    async def get_command_cost(self, command: str) -> int:
+        """Get coin cost for a command"""
+        now = time.monotonic()
+        if now - self._command_costs_loaded_at > self.COMMAND_COSTS_TTL:
+            # Load the whole (small) table so other commands hit the cache too
+            try:
+                async with self._get_connection() as conn:
+                    rows = await conn.fetch(ALL_COMMAND_COSTS_SQL)
+                self._command_costs = {row['command']: row['cost'] for row in rows}
+                self._command_costs_loaded_at = now
+            except Exception as e:
+                logger.error(f"Error getting command cost: {e}")
+
+        cost = self._command_costs.get(command)
+        return cost if cost is not None else 0
+
+    def invalidate_command_costs(self):
+        """Drop cached command costs after changing the command_costs table"""
+        self._command_costs_loaded_at = float('-inf')
+
+    async def get_coin_packages(self) -> List[asyncpg.Record]:
         """Get available coin packages"""
-        try:
-            async with self._get_connection() as conn:
-                rows = await conn.fetch("""
-                    SELECT package_name, coins, price_usd, bonus_coins
-                    FROM coin_packages
-                    WHERE is_active = TRUE
-                    ORDER BY price_usd ASC
-                """)
-                return [dict(row) for row in rows]
-        except Exception as e:
-            logger.error(f"Error getting packages: {e}")
-            return []
+        now = time.monotonic()
+        if now - self._coin_packages_loaded_at > self.COIN_PACKAGES_TTL:
+            try:
+                async with self._get_connection() as conn:
+                    rows = await conn.fetch("""
+                        SELECT package_name, coins, price_usd, bonus_coins
+                        FROM coin_packages
+                        WHERE is_active = TRUE
+                        ORDER BY price_usd ASC
+                    """)
+                self._coin_packages = rows
+                self._coin_packages_loaded_at = now
+            except Exception as e:
+                logger.error(f"Error getting packages: {e}")
+        return list(self._coin_packages)
+
+    def invalidate_coin_packages(self):
+        """Drop cached coin packages after changing the coin_packages table"""
+        self._coin_packages_loaded_at = float('-inf')
 
     # ========== PAYMENT METHODS ==========
 
@@ -635,20 +931,60 @@ class Database:
             logger.error(f"Error updating payment status: {e}")
             return False
 
+    async def complete_purchase(self, session_id: str, payment_intent: Optional[str],
+                                user_id: int, coins: int, description: str,
+                                amount_usd: Optional[float] = None) -> Optional[bool]:
+        """Mark a checkout completed and credit its coins (one atomic statement).
+
+        Returns True once the coins are credited, None if the session was
+        already completed (nothing done) and False on failure.
+        """
+        try:
+            async with self._get_connection() as conn:
+                row = await conn.fetchrow(
+                    COMPLETE_PURCHASE_SQL, user_id, coins, self._expiry_days,
+                    description, session_id, payment_intent, amount_usd
+                )
+            if not row['fresh']:
+                return None
+            return row['balance_after'] is not None or user_id in await self._get_admin_ids()
+        except Exception as e:
+            logger.error(f"Error completing purchase: {e}")
+            return False
+
     # ========== LOGGING & ANALYTICS METHODS ==========
 
     async def log_usage(self, user_id: int, username: str, first_name: str,
                        command: str, params: str = None, coins_spent: int = 0):
-        """Log command usage"""
+        """Log command usage (queued; written in the background with COPY)"""
         try:
-            async with self._get_connection() as conn:
-                await conn.execute("""
-                    INSERT INTO usage_logs
-                    (user_id, username, first_name, command, params, coins_spent)
-                    VALUES ($1, $2, $3, $4, $5, $6)
-                """, user_id, username, first_name, command, params, coins_spent)
-        except Exception as e:
-            logger.error(f"Error logging usage: {e}")
+            self._usage_queue.put_nowait(
+                (user_id, username, first_name, command, params, coins_spent)
+            )
+        except asyncio.QueueFull:
+            logger.warning("Usage log queue full, dropping entry")
+            return
+
+        if self._usage_flusher is None or self._usage_flusher.done():
+            self._usage_flusher = asyncio.create_task(self._flush_usage_logs())
+
+    async def _flush_usage_logs(self):
+        """Drain the usage queue into usage_logs in COPY batches, then exit.
+
+        Rows queued while a COPY is in flight make up the next batch. The task
+        ends once the queue is empty so per-request event loops can finish.
+        """
+        while not self._usage_queue.empty():
+            batch = []
+            while len(batch) < self.USAGE_FLUSH_BATCH and not self._usage_queue.empty():
+                batch.append(self._usage_queue.get_nowait())
+            try:
+                async with self._get_connection() as conn:
+                    await conn.copy_records_to_table(
+                        'usage_logs', records=batch, columns=USAGE_LOG_COLUMNS
+                    )
+            except Exception as e:
+                logger.error(f"Error logging usage: {e}")
 
     async def log_admin_action(self, admin_id: int, action: str, details: str):
         """Log admin actions"""
@@ -665,47 +1001,40 @@ class Database:
         """Get overall bot statistics"""
         try:
             async with self._get_connection() as conn:
-                total_users = await conn.fetchval("SELECT COUNT(*) FROM users")
-                active_users = await conn.fetchval("""
-                    SELECT COUNT(*) FROM users WHERE is_active = TRUE
-                """)
-                total_commands = await conn.fetchval("""
-                    SELECT COUNT(*) FROM usage_logs
-                    WHERE timestamp > CURRENT_TIMESTAMP - INTERVAL '24 hours'
-                """)
-
-                # Get top commands
-                top_commands = await conn.fetch("""
-                    SELECT command, COUNT(*) as count
-                    FROM usage_logs
-                    WHERE timestamp > CURRENT_TIMESTAMP - INTERVAL '7 days'
-                    GROUP BY command
-                    ORDER BY count DESC
-                    LIMIT 5
-                """)
+                # Refresh the 7-day rollup lazily; no background loop survives serverless.
+                # The in-process timestamp only saves the claim query on warm instances
+                now = time.monotonic()
+                if now - self._top_commands_refreshed_at > self.TOP_COMMANDS_REFRESH:
+                    self._top_commands_refreshed_at = now
+                    if await conn.fetchval(CLAIM_TOP_COMMANDS_REFRESH_SQL, self.TOP_COMMANDS_REFRESH):
+                        await conn.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY mv_top_commands_7d")
+
+                row = await conn.fetchrow(BOT_STATISTICS_SQL)
 
                 return {
-                    'total_users': total_users,
-                    'active_users': active_users,
-                    'commands_24h': total_commands,
-                    'top_commands': [dict(row) for row in top_commands]
+                    'total_users': row['total_users'],
+                    'active_users': row['active_users'],
+                    'commands_24h': row['commands_24h'],
+                    'top_commands': [
+                        {'command': command, 'count': count}
+                        for command, count in zip(row['top_commands'] or (), row['top_counts'] or ())
+                    ]
                 }
         except Exception as e:
             logger.error(f"Error getting statistics: {e}")
             return {}
 
-    async def get_recent_logs(self, limit: int = 100) -> List[Dict[str, Any]]:
+    async def iter_recent_logs(self, limit: int = 100) -> AsyncIterator[asyncpg.Record]:
+        """Yield recent usage logs, newest first, through a server-side cursor"""
+        async with self._get_connection() as conn:
+            async with conn.transaction():
+                async for row in conn.cursor(RECENT_LOGS_SQL, limit, prefetch=self.CURSOR_PREFETCH):
+                    yield row
+
+    async def get_recent_logs(self, limit: int = 100) -> List[asyncpg.Record]:
         """Get recent usage logs"""
         try:
-            async with self._get_connection() as conn:
-                rows = await conn.fetch("""
-                    SELECT user_id, username, first_name, command,
-                           params, coins_spent, timestamp
-                    FROM usage_logs
-                    ORDER BY timestamp DESC
-                    LIMIT $1
-                """, limit)
-                return [dict(row) for row in rows]
+            return [log async for log in self.iter_recent_logs(limit)]
         except Exception as e:
             logger.error(f"Error getting recent logs: {e}")
             return []
@@ -4,17 +4,54 @@ Uses Supabase REST API instead of direct PostgreSQL connections
 """
 
 import os
+import json
+import asyncio
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime
+from functools import lru_cache
 from typing import Optional, List, Dict, Any
 from supabase import create_client, Client
+from cachetools import TTLCache
+
+try:
+    import httpx
+    from supabase.lib.client_options import SyncClientOptions
+except ImportError:  # older supabase-py, fall back to its default transport
+    httpx = None
 
 logger = logging.getLogger(__name__)
 
+HTTP_KEEPALIVE_CONNECTIONS = 20
+HTTP_KEEPALIVE_EXPIRY = 60  # seconds
+
+# Columns callers actually read (same projections as the asyncpg backend)
+USER_LIST_COLUMNS = 'user_id, username, first_name, last_name, is_admin, is_active, added_date, coin_balance'
+PACKAGE_COLUMNS = 'package_name, coins, price_usd, bonus_coins'
+
+
+@lru_cache(maxsize=None)
+def _shared_client(url: str, key: str) -> Client:
+    """One Supabase client per process, so warm invocations reuse its TLS connections"""
+    if httpx is not None:
+        limits = httpx.Limits(max_keepalive_connections=HTTP_KEEPALIVE_CONNECTIONS,
+                              keepalive_expiry=HTTP_KEEPALIVE_EXPIRY)
+        try:
+            http = httpx.Client(http2=True, limits=limits)
+        except ImportError:  # HTTP/2 needs the optional h2 package
+            http = httpx.Client(limits=limits)
+        try:
+            return create_client(url, key, SyncClientOptions(httpx_client=http))
+        except TypeError:  # supabase-py too old to accept a custom httpx client
+            http.close()
+    return create_client(url, key)
+
 
 class SupabaseDatabase:
     """Database wrapper using Supabase REST API for Vercel compatibility"""
 
+    ADMIN_TTL = 60  # seconds
+    LOOKUP_TTL = 600  # command costs and coin packages
+
     def __init__(self):
         """Initialize Supabase client"""
         # Extract Supabase URL and key from DATABASE_URL or environment
@@ -39,14 +76,44 @@ class SupabaseDatabase:
                 "environment variables"
             )
 
-        self.client: Client = create_client(self.supabase_url, self.supabase_key)
+        self.client: Client = _shared_client(self.supabase_url, self.supabase_key)
+
+        # Coin settings, read once per process
+        self._initial_coins = int(os.getenv('INITIAL_FREE_COINS', '10'))
+        self._expiry_days = int(os.getenv('COINS_EXPIRY_DAYS', '30'))
+
+        # Every cache hit saves a full HTTPS round trip to Supabase
+        self._admin_cache = TTLCache(maxsize=10_000, ttl=self.ADMIN_TTL)
+        self._lookup_cache = TTLCache(maxsize=8, ttl=self.LOOKUP_TTL)
         logger.info(f"Supabase client initialized for {self.supabase_url}")
 
+    async def _exec(self, query):
+        """Run a supabase-py query builder off the event loop.
+
+        The client is synchronous, so executing it inline would block every
+        other coroutine for the whole HTTPS round trip.
+        """
+        return await asyncio.to_thread(query.execute)
+
     async def init_pool(self):
-        """No-op for compatibility with existing code"""
+        """Check the database has the functions this backend calls.
+
+        Coin spends, purchases, sign-ups and stats all go through Postgres
+        functions from create_tables.sql; without them every one of those
+        requests would fail, so refuse to start instead.
+        """
         logger.info("Using Supabase REST API (no pool initialization needed)")
-        # Tables should already exist in Supabase
-        pass
+        try:
+            result = await self._exec(self.client.rpc('bot_schema_ready', {}))
+            ready = result.data is True
+        except Exception as e:
+            # Also raised when bot_schema_ready itself is missing
+            logger.error(f"Error checking Supabase schema: {e}")
+            ready = False
+        if not ready:
+            raise RuntimeError(
+                "Supabase schema is out of date: re-run create_tables.sql in the SQL Editor"
+            )
 
     async def close_pool(self):
         """No-op for compatibility"""
@@ -58,67 +125,47 @@ class SupabaseDatabase:
                       first_name: str = None, last_name: str = None,
                       added_by: int = None) -> bool:
         """Add a new user with initial free coins (or update existing user profile)"""
+        self.invalidate_admin(user_id)
         try:
-            # Check if user already exists
-            existing = self.client.table('users')\
-                .select('user_id, coin_balance')\
-                .eq('user_id', user_id)\
-                .execute()
-
-            if existing.data:
-                # User exists - only update profile info, NOT coins
-                update_data = {
-                    'username': username,
-                    'first_name': first_name,
-                    'last_name': last_name,
-                    'is_active': True,
-                    'last_seen': datetime.now().isoformat()
-                }
-
-                self.client.table('users')\
-                    .update(update_data)\
-                    .eq('user_id', user_id)\
-                    .execute()
-
-                logger.info(f"User {user_id} profile updated")
-                return True
+            result = await self._exec(self.client.rpc('add_user_atomic', {
+                'p_user_id': user_id,
+                'p_username': username,
+                'p_first_name': first_name,
+                'p_last_name': last_name,
+                'p_added_by': added_by,
+                'p_initial_coins': self._initial_coins,
+                'p_expiry_days': self._expiry_days
+            }))
 
+            if result.data:
+                logger.info(f"User {user_id} added with {self._initial_coins} coins")
             else:
-                # New user - add with initial coins
-                initial_coins = int(os.getenv('INITIAL_FREE_COINS', '10'))
-                expiry_days = int(os.getenv('COINS_EXPIRY_DAYS', '30'))
-                expiry_date = (datetime.now() + timedelta(days=expiry_days)).isoformat()
-
-                data = {
-                    'user_id': user_id,
-                    'username': username,
-                    'first_name': first_name,
-                    'last_name': last_name,
-                    'added_by': added_by,
-                    'coin_balance': initial_coins,
-                    'coins_expire_at': expiry_date,
-                    'free_coins_claimed': True
-                }
-
-                self.client.table('users').insert(data).execute()
-
-                logger.info(f"User {user_id} added with {initial_coins} coins")
-                return True
+                logger.info(f"User {user_id} profile updated")
+            return True
 
         except Exception as e:
             logger.error(f"Error adding user: {e}")
             return False
 
+    def invalidate_admin(self, user_id: int):
+        """Forget a cached admin flag after the user's row changes"""
+        self._admin_cache.pop(user_id, None)
+
     async def is_admin(self, user_id: int) -> bool:
-        """Check if user has admin privileges"""
+        """Check if user has admin privileges (cached for ADMIN_TTL seconds)"""
+        is_admin = self._admin_cache.get(user_id)
+        if is_admin is not None:
+            return is_admin
+
         try:
-            result = self.client.table('users')\
-                .select('is_admin')\
-                .eq('user_id', user_id)\
-                .single()\
-                .execute()
+            result = await self._exec(self.client.table('users')
+                .select('is_admin')
+                .eq('user_id', user_id)
+                .single())
 
-            return result.data.get('is_admin', False) if result.data else False
+            is_admin = bool(result.data.get('is_admin', False)) if result.data else False
+            self._admin_cache[user_id] = is_admin
+            return is_admin
 
         except Exception as e:
             logger.error(f"Error checking admin status: {e}")
@@ -127,11 +174,11 @@ class SupabaseDatabase:
     async def get_user_coins(self, user_id: int) -> Dict[str, Any]:
         """Get user coins"""
         try:
-            result = self.client.table('users')\
-                .select('coin_balance, coins_expire_at, is_admin')\
-                .eq('user_id', user_id)\
-                .single()\
-                .execute()
+            # The view evaluates expiry and zeroes expired balances in the database
+            result = await self._exec(self.client.table('users_with_expiry')
+                .select('effective_balance, coins_expire_at, is_admin, is_expired')
+                .eq('user_id', user_id)
+                .single())
 
             if not result.data:
                 return {
@@ -141,7 +188,7 @@ class SupabaseDatabase:
                     'is_admin': False
                 }
 
-            balance = result.data.get('coin_balance', 0)
+            balance = result.data.get('effective_balance', 0)
             expire_at = result.data.get('coins_expire_at')
             is_admin = result.data.get('is_admin', False)
 
@@ -154,18 +201,14 @@ class SupabaseDatabase:
                     'is_admin': True
                 }
 
-            # Check if coins expired
-            is_expired = False
-            if expire_at:
-                expire_dt = datetime.fromisoformat(expire_at.replace('Z', '+00:00'))
-                if datetime.now() > expire_dt.replace(tzinfo=None):
-                    is_expired = True
-                    balance = 0
+            # coins_expire_at is a plain TIMESTAMP, so this is already the
+            # naive datetime asyncpg would return
+            expire_dt = datetime.fromisoformat(expire_at) if expire_at else None
 
             return {
                 'balance': balance,
-                'expires_at': expire_at,
-                'is_expired': is_expired,
+                'expires_at': expire_dt,
+                'is_expired': bool(result.data.get('is_expired')),
                 'is_admin': False
             }
 
@@ -180,59 +223,51 @@ class SupabaseDatabase:
 
     async def deduct_coins(self, user_id: int, amount: int, command: str,
                           description: str = None) -> bool:
-        """Deduct coins from user"""
+        """Deduct coins from user (checks, update and ledger row in one RPC)"""
         try:
-            # Check if admin
-            is_admin = await self.is_admin(user_id)
-            if is_admin:
-                # Admins have unlimited coins - just log
-                return True
-
-            # Get current balance
-            coins_data = await self.get_user_coins(user_id)
-
-            if coins_data['is_expired'] or coins_data['balance'] < amount:
-                return False
-
-            # Deduct coins
-            new_balance = coins_data['balance'] - amount
-
-            self.client.table('users')\
-                .update({'coin_balance': new_balance, 'last_seen': datetime.now().isoformat()})\
-                .eq('user_id', user_id)\
-                .execute()
-
-            return True
+            result = await self._exec(self.client.rpc('deduct_coins_atomic', {
+                'p_user_id': user_id,
+                'p_amount': amount,
+                'p_description': description or f"Used {command} command"
+            }))
+            return bool(result.data and result.data.get('ok'))
 
         except Exception as e:
             logger.error(f"Error deducting coins: {e}")
             return False
 
     async def get_command_cost(self, command: str) -> int:
-        """Get coin cost for a command"""
+        """Get coin cost for a command (the whole table is cached for LOOKUP_TTL seconds)"""
+        costs = self._lookup_cache.get('command_costs')
+        if costs is not None:
+            return costs.get(command, 0)
+
         try:
-            result = self.client.table('command_costs')\
-                .select('cost')\
-                .eq('command', command)\
-                .single()\
-                .execute()
+            result = await self._exec(self.client.table('command_costs')
+                .select('command, cost'))
 
-            return result.data.get('cost', 0) if result.data else 0
+            costs = {row['command']: row['cost'] for row in result.data or []}
+            self._lookup_cache['command_costs'] = costs
+            return costs.get(command, 0)
 
         except Exception as e:
             logger.error(f"Error getting command cost: {e}")
             return 0
 
     async def get_coin_packages(self) -> List[Dict[str, Any]]:
-        """Get available coin packages"""
+        """Get available coin packages (cached for LOOKUP_TTL seconds)"""
+        packages = self._lookup_cache.get('coin_packages')
+        if packages is not None:
+            return list(packages)
+
         try:
-            result = self.client.table('coin_packages')\
-                .select('*')\
-                .eq('is_active', True)\
-                .order('price_usd')\
-                .execute()
+            result = await self._exec(self.client.table('coin_packages')
+                .select(PACKAGE_COLUMNS)
+                .eq('is_active', True)
+                .order('price_usd'))
 
-            return result.data if result.data else []
+            packages = self._lookup_cache['coin_packages'] = result.data or []
+            return list(packages)
 
         except Exception as e:
             logger.error(f"Error getting packages: {e}")
@@ -251,7 +286,8 @@ class SupabaseDatabase:
                 'status': status
             }
 
-            self.client.table('payment_history').insert(data).execute()
+            await self._exec(self.client.table('payment_history')
+                .insert(data, returning='minimal'))
             return True
 
         except Exception as e:
@@ -268,10 +304,9 @@ class SupabaseDatabase:
                 'completed_at': datetime.now().isoformat()
             }
 
-            self.client.table('payment_history')\
-                .update(data)\
-                .eq('stripe_session_id', session_id)\
-                .execute()
+            await self._exec(self.client.table('payment_history')
+                .update(data, returning='minimal')
+                .eq('stripe_session_id', session_id))
 
             return True
 
@@ -279,48 +314,56 @@ class SupabaseDatabase:
             logger.error(f"Error updating payment status: {e}")
             return False
 
+    async def complete_purchase(self, session_id: str, payment_intent: Optional[str],
+                                user_id: int, coins: int, description: str,
+                                amount_usd: Optional[float] = None) -> Optional[bool]:
+        """Mark a checkout completed and credit its coins (one RPC).
+
+        Returns True once the coins are credited, None if the session was
+        already completed (nothing done) and False on failure.
+        """
+        try:
+            result = await self._exec(self.client.rpc('complete_purchase_atomic', {
+                'p_session_id': session_id,
+                'p_payment_intent': payment_intent,
+                'p_user_id': user_id,
+                'p_coins': coins,
+                'p_days': self._expiry_days,
+                'p_description': description,
+                'p_amount_usd': amount_usd
+            }))
+
+            data = result.data or {}
+            if data.get('fresh') is False:
+                return None
+            return bool(data.get('ok'))
+
+        except Exception as e:
+            logger.error(f"Error completing purchase: {e}", exc_info=True)
+            return False
+
     async def add_coins(self, user_id: int, amount: int,
                        transaction_type: str = 'admin_add',
                        description: str = None,
                        extend_expiry: bool = True) -> bool:
-        """Add coins to user"""
+        """Add coins to user (update and ledger row in one RPC)"""
         try:
-            # Check if admin
-            is_admin = await self.is_admin(user_id)
-            if is_admin:
-                return True  # Admins always have unlimited
-
-            # Get current balance
-            user = self.client.table('users')\
-                .select('coin_balance')\
-                .eq('user_id', user_id)\
-                .single()\
-                .execute()
-
-            current_balance = user.data.get('coin_balance', 0) if user.data else 0
-            new_balance = current_balance + amount
-
-            # Update balance
-            update_data = {'coin_balance': new_balance}
-
-            if extend_expiry:
-                expiry_days = int(os.getenv('COINS_EXPIRY_DAYS', '30'))
-                new_expiry = (datetime.now() + timedelta(days=expiry_days)).isoformat()
-                update_data['coins_expire_at'] = new_expiry
-
-            result = self.client.table('users')\
-                .update(update_data)\
-                .eq('user_id', user_id)\
-                .execute()
-
-            # Check if update was successful
-            if result.data:
-                logger.info(f"Successfully added {amount} coins to user {user_id}. New balance: {new_balance}")
+            result = await self._exec(self.client.rpc('add_coins_atomic', {
+                'p_user_id': user_id,
+                'p_amount': amount,
+                'p_type': transaction_type,
+                'p_extend': extend_expiry,
+                'p_days': self._expiry_days,
+                'p_description': description or f"Added {amount} coins"
+            }))
+
+            data = result.data or {}
+            if data.get('ok'):
+                logger.info(f"Successfully added {amount} coins to user {user_id}. New balance: {data.get('new_balance')}")
                 return True
-            else:
-                logger.warning(f"Update returned no data for user {user_id}. May be RLS issue.")
-                logger.warning(f"Result: {result}")
-                return False
+
+            logger.warning(f"Could not add coins for user {user_id} (unknown user or RLS issue)")
+            return False
 
         except Exception as e:
             logger.error(f"Error adding coins: {e}", exc_info=True)
@@ -329,10 +372,9 @@ class SupabaseDatabase:
     async def get_all_users(self) -> List[Dict[str, Any]]:
         """Get all users"""
         try:
-            result = self.client.table('users')\
-                .select('*')\
-                .order('added_date', desc=True)\
-                .execute()
+            result = await self._exec(self.client.table('users')
+                .select(USER_LIST_COLUMNS)
+                .order('added_date', desc=True))
 
             return result.data if result.data else []
 
@@ -340,21 +382,22 @@ class SupabaseDatabase:
             logger.error(f"Error getting users: {e}")
             return []
 
+    async def get_all_users_json(self) -> str:
+        """Get all users as a JSON array string"""
+        return json.dumps(await self.get_all_users())
+
     async def get_bot_statistics(self) -> Dict[str, Any]:
         """Get overall bot statistics"""
         try:
-            # Get user counts
-            all_users = self.client.table('users').select('user_id', count='exact').execute()
-            active_users = self.client.table('users')\
-                .select('user_id', count='exact')\
-                .eq('is_active', True)\
-                .execute()
+            # One RPC computes every metric server-side
+            result = await self._exec(self.client.rpc('bot_stats', {}))
+            stats = result.data or {}
 
             return {
-                'total_users': all_users.count if hasattr(all_users, 'count') else 0,
-                'active_users': active_users.count if hasattr(active_users, 'count') else 0,
-                'commands_24h': 0,  # Would need usage_logs query
-                'top_commands': []
+                'total_users': stats.get('total_users', 0),
+                'active_users': stats.get('active_users', 0),
+                'commands_24h': stats.get('commands_24h', 0),
+                'top_commands': stats.get('top_commands') or []
             }
 
         except Exception as e:
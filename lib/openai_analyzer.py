@@ -4,20 +4,32 @@ Handles AI-powered analysis using OpenAI API
 """
 
 from openai import AsyncOpenAI
+from cachetools import TTLCache
 import asyncio
+import httpx
+import hashlib
 import logging
-from typing import Dict, List, Any
+import re
+from functools import lru_cache
+from typing import Dict, List, Any, Optional, AsyncIterator
+
+try:
+    import tiktoken
+except ImportError:  # optional - titles are then capped by count and length only
+    tiktoken = None
 
 logger = logging.getLogger(__name__)
 
+TITLE_TOKEN_BUDGET = 2000  # input tokens spent on titles in analyze_titles
 
-class OpenAIAnalyzer:
-    def __init__(self, api_key: str):
-        self.client = AsyncOpenAI(api_key=api_key)
-        
-    async def analyze_subreddit(self, prompt: str) -> str:
-        """Analyze subreddit data with AI"""
-        system_prompt = """You are a Reddit marketing expert. Your job is to give brutally honest assessments of subreddits.
+# Connection pool limits for each analyzer client
+HTTP_LIMITS = httpx.Limits(max_connections=200, max_keepalive_connections=100,
+                           keepalive_expiry=60)
+HTTP_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+
+# System prompts, kept byte-identical across calls so the provider's
+# prompt-prefix cache can reuse them
+SUBREDDIT_SYSTEM_PROMPT = """You are a Reddit marketing expert. Your job is to give brutally honest assessments of subreddits.
 
 **Critical Rules:**
 1. NEVER include follow-up suggestions like "Let me know if you need help" or "Feel free to ask questions"
@@ -57,19 +69,246 @@ class OpenAIAnalyzer:
 5. For GOOD verdict, check MEDIAN score is 25+ (not average)
 6. Warn about inconsistency if only small percentage are high performers"""
 
+COMPARE_SYSTEM_PROMPT = """You are a Reddit marketing expert comparing multiple subreddits.
+
+**Critical Rules:**
+1. NEVER include follow-up suggestions or offers to help further
+2. Be brutally honest about which subreddit is best
+3. End with your final recommendation, period
+4. Keep TOTAL response under 2500 characters
+5. Format for Telegram HTML only
+6. Rank subreddits honestly, even if they're all bad
+7. Analyze numbers carefully and pick the truly best choice
+8. Never use literal < or > characters - spell out comparisons
+9. Format for Telegram using ONLY: <b>, <i>, <u>, <code>, <pre>
+10. NEVER use <ul>, <li>, <br>, or <table> tags
+11. Use preformatted text blocks with <pre> tags for tabular data
+12. NEVER use asterisks (*) for formatting - use HTML tags instead
+
+**Response Structure:**
+- Clear winner identification
+- Data-driven comparison
+- Specific strategies for each
+- Risk assessment
+- Final verdict with no follow-up"""
+
+POSTS_SYSTEM_PROMPT = "You are a Reddit content analyst. Provide helpful, actionable insights based on the user's request."
+
+NICHE_SYSTEM_PROMPT = "You are a Reddit niche community analyst. Focus on engagement potential and community characteristics for content marketing."
+
+TITLES_SYSTEM_PROMPT = """You are a Reddit content expert. Recreate post titles based on the user's request. Be creative and engaging. Format for Telegram using HTML tags (<b>, <i>, <u>, <code>). NEVER include follow-up suggestions or offers to help further. NEVER use asterisks (*) for formatting - use HTML tags instead."""
+
+RULES_SYSTEM_PROMPT = """You are a Reddit content strategist. Analyze subreddit rules and provide actionable insights for content creators. Format your response for Telegram using HTML tags (<b>, <i>, <u>, <code>). Be concise but strategic. NEVER include follow-up suggestions or offers to help further.
+
+Never use literal < or > characters for comparisons - spell out (e.g., "less than", "greater than"). NEVER use asterisks (*) for formatting - use HTML tags instead."""
+
+FLAIRS_SYSTEM_PROMPT = """You are a Reddit marketing expert. Analyze flair performance and provide strategic recommendations for content creators. Format your response for Telegram using HTML tags (<b>, <i>, <u>, <code>). Be strategic and actionable. NEVER include follow-up suggestions or offers to help further and NEVER use hashtags.
+
+Never use literal < or > characters for comparisons - spell out (e.g., "less than", "greater than"). NEVER use asterisks (*) for formatting - use HTML tags instead."""
+
+
+# Follow-up offers the model sometimes appends despite the system prompt
+_FOLLOW_UP_RE = re.compile(
+    r"Let me know if you|Feel free to ask|If you have any questions"
+    r"|Would you like|Need any help|Is there anything else"
+)
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    """The gpt-4o-mini tokenizer, loaded on first use (None when unavailable)"""
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model("gpt-4o-mini")
+    except Exception as e:  # unknown model in an old tiktoken, or the BPE download failed
+        logger.warning(f"Token counting disabled: {e}")
+        return None
+
+
+@lru_cache(maxsize=4096)
+def _count_tokens(text: str) -> int:
+    return len(_encoding().encode(text))
+
+
+def _within_token_budget(titles: List[str], budget: int) -> List[str]:
+    """Longest prefix of titles whose combined token count fits the budget"""
+    if _encoding() is None:
+        return titles
+    used = 0
+    for n, title in enumerate(titles):
+        used += _count_tokens(title)
+        if used > budget:
+            return titles[:n]
+    return titles
+
+
+def _new_client(api_key: str) -> AsyncOpenAI:
+    """OpenAI client with its own keep-alive connection pool"""
+    try:
+        http = httpx.AsyncClient(http2=True, limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT,
+                                 follow_redirects=True)
+    except ImportError:  # HTTP/2 needs the optional h2 package
+        http = httpx.AsyncClient(limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT,
+                                 follow_redirects=True)
+    return AsyncOpenAI(api_key=api_key, http_client=http, max_retries=2)
+
+
+class OpenAIAnalyzer:
+    RESPONSE_CACHE_TTL = 6 * 60 * 60  # seconds
+
+    def __init__(self, api_key: str):
+        self._api_key = api_key
+        self._client = None
+        self._client_loop = None
+        # Finished completions and those currently being generated, keyed by
+        # a digest of the full request
+        self._cache = TTLCache(maxsize=2048, ttl=self.RESPONSE_CACHE_TTL)
+        self._inflight: Dict[tuple, asyncio.Task] = {}
+
+    @property
+    def client(self) -> AsyncOpenAI:
+        """OpenAI client for the running event loop.
+
+        Webhook handlers run every update on a fresh event loop, and pooled
+        connections can't be used from a loop other than their own, so each
+        loop gets its own client (see close).
+        """
+        loop = asyncio.get_running_loop()
+        if self._client_loop is not loop:
+            self._client = _new_client(self._api_key)
+            self._client_loop = loop
+        return self._client
+
+    async def close(self):
+        """Close the running loop's client and its connections; call before the loop ends"""
+        if self._client is not None and self._client_loop is asyncio.get_running_loop():
+            await self._client.close()
+        self._client = None
+        self._client_loop = None
+
+    @staticmethod
+    def _request_key(system_prompt, prompt, model, temperature, max_tokens, extra) -> bytes:
+        """Digest identifying a completion request (response cache key)"""
+        return hashlib.blake2b(
+            repr((model, system_prompt, prompt, temperature, max_tokens,
+                  sorted(extra.items()))).encode(),
+            digest_size=16
+        ).digest()
+
+    async def _complete(self, system_prompt: Optional[str], prompt: str, *, model: str,
+                        temperature: float, max_tokens: int, cache: bool = True,
+                        **extra) -> str:
+        """Run one chat completion and return the message text.
+
+        Successful answers are cached for RESPONSE_CACHE_TTL (unless
+        ``cache`` is False), and identical requests arriving while one is
+        already in flight share its result. Errors propagate so every
+        caller keeps its own fallback message.
+        """
+        key = self._request_key(system_prompt, prompt, model, temperature, max_tokens, extra)
+        if cache:
+            cached = self._cache.get(key)
+            if cached is not None:
+                return cached
+
+        inflight_key = (id(asyncio.get_running_loop()), key)
+        task = self._inflight.get(inflight_key)
+        if task is None:
+            messages = [{"role": "user", "content": prompt}]
+            if system_prompt:
+                messages.insert(0, {"role": "system", "content": system_prompt})
+            task = asyncio.ensure_future(self.client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                **extra
+            ))
+            self._inflight[inflight_key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(inflight_key, None))
+
+        # Shield so one caller giving up does not cancel the others
+        response = await asyncio.shield(task)
+        content = response.choices[0].message.content
+        if cache and content:
+            self._cache[key] = content
+        return content
+
+    async def _stream(self, system_prompt: str, prompt: str, *, model: str,
+                      temperature: float, max_tokens: int,
+                      fallback: str) -> AsyncIterator[str]:
+        """Yield a completion's text as it is generated.
+
+        Shares the response cache with _complete: a cached answer is yielded
+        in one piece, and a fully streamed answer is stored. On an API error
+        before any text arrived, ``fallback`` is yielded instead.
+        """
+        key = self._request_key(system_prompt, prompt, model, temperature, max_tokens, {})
+        cached = self._cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+
+        parts = []
         try:
-            response = await self.client.chat.completions.create(
-                model="gpt-4o-mini",
+            stream = await self.client.chat.completions.create(
+                model=model,
                 messages=[
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": prompt}
                 ],
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=True
+            )
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    yield delta
+        except Exception as e:
+            logger.error(f"OpenAI API error: {e}")
+            if not parts:
+                yield fallback
+            return
+
+        content = "".join(parts)
+        if content:
+            self._cache[key] = content
+
+    def stream_subreddit_analysis(self, prompt: str) -> AsyncIterator[str]:
+        """Streaming variant of analyze_subreddit"""
+        return self._stream(
+            SUBREDDIT_SYSTEM_PROMPT, prompt,
+            model="gpt-4o-mini",
+            temperature=0.7,
+            max_tokens=3000,
+            fallback="AI analysis unavailable at the moment. Please try again later."
+        )
+
+    def stream_comparison(self, prompt: str) -> AsyncIterator[str]:
+        """Streaming variant of compare_subreddits"""
+        return self._stream(
+            COMPARE_SYSTEM_PROMPT, prompt,
+            model="gpt-4o-mini",
+            temperature=0.7,
+            max_tokens=3000,
+            fallback="AI comparison unavailable at the moment. Please try again later."
+        )
+
+    async def analyze_subreddit(self, prompt: str) -> str:
+        """Analyze subreddit data with AI"""
+        try:
+            return await self._complete(
+                SUBREDDIT_SYSTEM_PROMPT, prompt,
+                model="gpt-4o-mini",
                 temperature=0.7,
                 max_tokens=3000
             )
             
-            return response.choices[0].message.content
-            
         except Exception as e:
             logger.error(f"OpenAI API error: {e}")
             return "AI analysis unavailable at the moment. Please try again later."
@@ -77,20 +316,14 @@ class OpenAIAnalyzer:
     async def analyze_posts(self, prompt: str) -> str:
         """Analyze posts with custom AI prompt"""
         try:
-            response = await self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {
-                        "role": "system", 
-                        "content": "You are a Reddit content analyst. Provide helpful, actionable insights based on the user's request."
-                    },
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=1000,
-                temperature=0.7
+            result = await self._complete(
+                POSTS_SYSTEM_PROMPT, prompt,
+                model="gpt-4o-mini",
+                temperature=0.7,
+                max_tokens=1000
             )
             
-            return response.choices[0].message.content.strip()
+            return result.strip()
             
         except Exception as e:
             logger.error(f"Error in AI posts analysis: {e}")
@@ -99,20 +332,14 @@ class OpenAIAnalyzer:
     async def analyze_niche(self, prompt: str) -> str:
         """Analyze niche communities"""
         try:
-            response = await self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {
-                        "role": "system", 
-                        "content": "You are a Reddit niche community analyst. Focus on engagement potential and community characteristics for content marketing."
-                    },
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=800,
-                temperature=0.6
+            result = await self._complete(
+                NICHE_SYSTEM_PROMPT, prompt,
+                model="gpt-4o-mini",
+                temperature=0.6,
+                max_tokens=800
             )
             
-            return response.choices[0].message.content.strip()
+            return result.strip()
             
         except Exception as e:
             logger.error(f"Error in AI niche analysis: {e}")
@@ -120,42 +347,14 @@ class OpenAIAnalyzer:
             
     async def compare_subreddits(self, prompt: str) -> str:
         """Compare multiple subreddits with AI"""
-        system_prompt = """You are a Reddit marketing expert comparing multiple subreddits.
-
-**Critical Rules:**
-1. NEVER include follow-up suggestions or offers to help further
-2. Be brutally honest about which subreddit is best
-3. End with your final recommendation, period
-4. Keep TOTAL response under 2500 characters
-5. Format for Telegram HTML only
-6. Rank subreddits honestly, even if they're all bad
-7. Analyze numbers carefully and pick the truly best choice
-8. Never use literal < or > characters - spell out comparisons
-9. Format for Telegram using ONLY: <b>, <i>, <u>, <code>, <pre>
-10. NEVER use <ul>, <li>, <br>, or <table> tags
-11. Use preformatted text blocks with <pre> tags for tabular data
-12. NEVER use asterisks (*) for formatting - use HTML tags instead
-
-**Response Structure:**
-- Clear winner identification
-- Data-driven comparison
-- Specific strategies for each
-- Risk assessment
-- Final verdict with no follow-up"""
-
         try:
-            response = await self.client.chat.completions.create(
+            return await self._complete(
+                COMPARE_SYSTEM_PROMPT, prompt,
                 model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": prompt}
-                ],
                 temperature=0.7,
                 max_tokens=3000
             )
             
-            return response.choices[0].message.content
-            
         except Exception as e:
             logger.error(f"OpenAI API error: {e}")
             return "AI comparison unavailable at the moment. Please try again later."
@@ -163,50 +362,40 @@ class OpenAIAnalyzer:
     async def analyze_titles(self, posts: List[Dict], subreddit: str, 
                            ai_prompt: str) -> str:
         """Analyze or recreate Reddit post titles - FIXED VERSION"""
-        system_prompt = """You are a Reddit content expert. Recreate post titles based on the user's request. Be creative and engaging. Format for Telegram using HTML tags (<b>, <i>, <u>, <code>). NEVER include follow-up suggestions or offers to help further. NEVER use asterisks (*) for formatting - use HTML tags instead."""
         
-        # Build the prompt with limited posts to avoid token issues
-        posts_to_use = posts[:15]  # Limit to 15 posts
-        user_prompt = f"Here are {len(posts_to_use)} Reddit post titles from r/{subreddit}:\n\n"
-        
-        for i, post in enumerate(posts_to_use, 1):
-            title = post.get("title", "")[:200]  # Limit title length
-            user_prompt += f'{i}. "{title}"\n'
-            
-        user_prompt += f"\nUser request: {ai_prompt}\n\n"
-        user_prompt += "Recreate these titles based on the user's request. Format as:\n"
-        user_prompt += "<b>1.</b> [Recreated title]\n<b>2.</b> [Recreated title]\n..."
+        # Build the prompt with limited posts to avoid token issues: at most
+        # 15 titles of 200 characters, trimmed further to the token budget
+        posts_to_use = _within_token_budget(
+            [post.get("title", "")[:200] for post in posts[:15]], TITLE_TOKEN_BUDGET
+        )
+        titles = "".join(
+            f'{i}. "{title}"\n' for i, title in enumerate(posts_to_use, 1)
+        )
+        user_prompt = (
+            f"Here are {len(posts_to_use)} Reddit post titles from r/{subreddit}:\n\n"
+            f"{titles}"
+            f"\nUser request: {ai_prompt}\n\n"
+            "Recreate these titles based on the user's request. Format as:\n"
+            "<b>1.</b> [Recreated title]\n<b>2.</b> [Recreated title]\n..."
+        )
         
         try:
             # Try with gpt-4o-mini first (more reliable and available)
             logger.info(f"Attempting title recreation with gpt-4o-mini for {len(posts_to_use)} posts")
             
-            response = await self.client.chat.completions.create(
-                model="gpt-4o",  # Using the mini model which is more reliable
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
+            result = await self._complete(
+                TITLES_SYSTEM_PROMPT, user_prompt,
+                model="gpt-4o-mini",  # Using the mini model which is more reliable
                 temperature=0.8,
                 max_tokens=2500,  # Reduced to avoid issues
+                cache=False,  # re-running should give fresh recreations
                 timeout=30
             )
             
-            result = response.choices[0].message.content
-            
-            # Clean up response
-            follow_up_patterns = [
-                "Let me know if you",
-                "Feel free to ask",
-                "If you have any questions",
-                "Would you like",
-                "Need any help",
-                "Is there anything else"
-            ]
-            
-            for pattern in follow_up_patterns:
-                if pattern in result:
-                    result = result.split(pattern)[0].strip()
+            # Clean up response: cut at the first follow-up offer
+            match = _FOLLOW_UP_RE.search(result)
+            if match:
+                result = result[:match.start()].strip()
                     
             return result
             
@@ -216,22 +405,20 @@ class OpenAIAnalyzer:
             # Try a simpler fallback with fewer posts
             try:
                 logger.info("Attempting fallback with fewer posts")
-                simple_prompt = f"Recreate these Reddit titles: {ai_prompt}\n\n"
-                for i, post in enumerate(posts[:8], 1):  # Even fewer posts
-                    simple_prompt += f'{i}. {post["title"][:150]}\n'
+                simple_prompt = f"Recreate these Reddit titles: {ai_prompt}\n\n" + "".join(
+                    f'{i}. {post["title"][:150]}\n'
+                    for i, post in enumerate(posts[:8], 1)  # Even fewer posts
+                )
                 
-                response = await self.client.chat.completions.create(
-                    model="gpt-3.5-turbo",  # Fallback to simpler model
-                    messages=[
-                        {"role": "user", "content": simple_prompt}
-                    ],
-                    max_tokens=1500,
+                return await self._complete(
+                    None, simple_prompt,
+                    model="gpt-4o-mini",  # Fallback with a shorter prompt
                     temperature=0.7,
+                    max_tokens=1500,
+                    cache=False,
                     timeout=20
                 )
                 
-                return response.choices[0].message.content
-                
             except Exception as fallback_error:
                 logger.error(f"Fallback also failed: {fallback_error}")
                 return "❌ AI service is currently overloaded. Please try again in a few moments."
@@ -253,46 +440,28 @@ class OpenAIAnalyzer:
             
     async def analyze_rules(self, prompt: str) -> str:
         """Analyze subreddit rules strategically"""
-        system_prompt = """You are a Reddit content strategist. Analyze subreddit rules and provide actionable insights for content creators. Format your response for Telegram using HTML tags (<b>, <i>, <u>, <code>). Be concise but strategic. NEVER include follow-up suggestions or offers to help further.
-
-Never use literal < or > characters for comparisons - spell out (e.g., "less than", "greater than"). NEVER use asterisks (*) for formatting - use HTML tags instead."""
-
         try:
-            response = await self.client.chat.completions.create(
+            return await self._complete(
+                RULES_SYSTEM_PROMPT, prompt,
                 model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": prompt}
-                ],
                 temperature=0.7,
                 max_tokens=2000
             )
             
-            return response.choices[0].message.content
-            
         except Exception as e:
             logger.error(f"OpenAI API error: {e}")
             return "AI rules analysis unavailable at the moment."
             
     async def analyze_flairs(self, prompt: str) -> str:
         """Analyze flair performance strategically"""
-        system_prompt = """You are a Reddit marketing expert. Analyze flair performance and provide strategic recommendations for content creators. Format your response for Telegram using HTML tags (<b>, <i>, <u>, <code>). Be strategic and actionable. NEVER include follow-up suggestions or offers to help further and NEVER use hashtags.
-
-Never use literal < or > characters for comparisons - spell out (e.g., "less than", "greater than"). NEVER use asterisks (*) for formatting - use HTML tags instead."""
-
         try:
-            response = await self.client.chat.completions.create(
+            return await self._complete(
+                FLAIRS_SYSTEM_PROMPT, prompt,
                 model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": prompt}
-                ],
                 temperature=0.7,
                 max_tokens=2000
             )
             
-            return response.choices[0].message.content
-            
         except Exception as e:
             logger.error(f"OpenAI API error: {e}")
             return "AI flair analysis unavailable at the moment."
\ No newline at end of file
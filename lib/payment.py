@@ -9,7 +9,8 @@ import logging
 from typing import Dict, Any, Optional
 from datetime import datetime, timedelta
 import asyncio
-import sqlite3
+from bisect import bisect_left
+from cachetools import LRUCache
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +22,10 @@ class PaymentProcessor:
         self.stripe_webhook_secret = stripe_webhook_secret
         self.db = database
         
+        # Ids of checkout events already credited; Stripe redelivers on
+        # timeouts and 5xx, and a retry must not add the coins twice
+        self._processed_events = LRUCache(maxsize=4096)
+        
         # Configure Stripe
         stripe.api_key = stripe_secret_key
         
@@ -62,20 +67,15 @@ class PaymentProcessor:
                 'description': '500 coins + 20 bonus coins - Best value!'
             }
         }
-    
-    async def create_checkout_session(self, user_id: int, package_key: str, 
-                                    success_url: str, cancel_url: str) -> Optional[str]:
-        try:
-            package = self.packages.get(package_key)
-            if not package:
-                return None
-            
+        
+        # Everything a checkout needs that depends only on the package, built once
+        self._prebuilt: Dict[str, Dict[str, Any]] = {}
+        for key, package in self.packages.items():
             total_coins = package['coins'] + package['bonus']
-            
-            # Create Stripe checkout session (this is synchronous, it's fine)
-            session = stripe.checkout.Session.create(
-                payment_method_types=['card'],
-                line_items=[{
+            self._prebuilt[key] = {
+                'price': package['price'],
+                'total_coins': total_coins,
+                'line_items': [{
                     'price_data': {
                         'currency': 'usd',
                         'product_data': {
@@ -90,21 +90,34 @@ class PaymentProcessor:
                     },
                     'quantity': 1,
                 }],
-                mode='payment',
-                success_url=success_url,
-                cancel_url=cancel_url,
-                client_reference_id=str(user_id),
-                metadata={
-                    'user_id': str(user_id),
-                    'package': package_key,
+                'base_metadata': {
+                    'package': key,
                     'coins': str(package['coins']),
                     'bonus': str(package['bonus']),
                     'total_coins': str(total_coins)
                 }
+            }
+    
+    async def create_checkout_session(self, user_id: int, package_key: str, 
+                                    success_url: str, cancel_url: str) -> Optional[str]:
+        try:
+            checkout = self._prebuilt.get(package_key)
+            if not checkout:
+                return None
+            
+            # Create Stripe checkout session (this is synchronous, it's fine)
+            session = stripe.checkout.Session.create(
+                payment_method_types=['card'],
+                line_items=checkout['line_items'],
+                mode='payment',
+                success_url=success_url,
+                cancel_url=cancel_url,
+                client_reference_id=str(user_id),
+                metadata={'user_id': str(user_id), **checkout['base_metadata']}
             )
             
             await self.db.add_payment_history(
-                user_id, session.id, package['price'], total_coins, 'pending'
+                user_id, session.id, checkout['price'], checkout['total_coins'], 'pending'
             )
             
             return session.url
@@ -120,6 +133,9 @@ class PaymentProcessor:
                 payload, sig_header, self.stripe_webhook_secret
             )
             
+            if event['id'] in self._processed_events:
+                return {'success': True, 'duplicate': True}
+            
             # Handle the checkout.session.completed event
             if event['type'] == 'checkout.session.completed':
                 session = event['data']['object']
@@ -129,37 +145,22 @@ class PaymentProcessor:
                 total_coins = int(session['metadata']['total_coins'])
                 package_key = session['metadata']['package']
                 
-                # Update payment status
-                with self.db._get_connection() as conn:
-                    cursor = conn.cursor()
-                    cursor.execute("""
-                        UPDATE payment_history 
-                        SET status = 'completed',
-                            completed_at = CURRENT_TIMESTAMP,
-                            stripe_payment_intent = ?
-                        WHERE stripe_session_id = ?
-                    """, (session.get('payment_intent'), session['id']))
-                    conn.commit()
-                
-                # Add coins to user with 30-day extension
-                success = await self.db.add_coins(
-                    user_id=user_id,
-                    amount=total_coins,
-                    transaction_type='purchase',
-                    description=f"Purchased {self.packages[package_key]['name']}",
-                    extend_expiry=True
+                # Mark the payment completed and add the coins (with the 30-day
+                # extension and total_coins_purchased bump) in one statement;
+                # a session completed by an earlier delivery credits nothing
+                amount_total = session.get('amount_total')
+                credited = await self.db.complete_purchase(
+                    session['id'],
+                    session.get('payment_intent'),
+                    user_id,
+                    total_coins,
+                    f"Purchased {self.packages[package_key]['name']}",
+                    amount_usd=amount_total / 100 if amount_total is not None else None
                 )
-                
-                if success:
-                    # Update total purchased
-                    with self.db._get_connection() as conn:
-                        cursor = conn.cursor()
-                        cursor.execute("""
-                            UPDATE users 
-                            SET total_coins_purchased = total_coins_purchased + ?
-                            WHERE user_id = ?
-                        """, (total_coins, user_id))
-                        conn.commit()
+                if credited is not False:
+                    self._processed_events[event['id']] = True
+                if credited is None:
+                    return {'success': True, 'duplicate': True}
                 
                 return {
                     'success': True,
@@ -173,14 +174,7 @@ class PaymentProcessor:
                 session_id = event['data']['object'].get('id')
                 
                 # Update payment status
-                with self.db._get_connection() as conn:
-                    cursor = conn.cursor()
-                    cursor.execute("""
-                        UPDATE payment_history 
-                        SET status = 'failed'
-                        WHERE stripe_session_id = ?
-                    """, (session_id,))
-                    conn.commit()
+                await self.db.update_payment_status(session_id, 'failed')
                 
                 return {'success': False, 'reason': 'payment_failed'}
             
@@ -230,6 +224,8 @@ class CoinManager:
         40: 8,
         50: 10
     }
+    # Tier limits in ascending order, sorted once for bisect
+    _AI_TIER_COUNTS, _AI_TIER_COSTS = zip(*sorted(AI_RECREATION_COSTS.items()))
     
     @staticmethod
     def get_command_cost(command: str) -> int:
@@ -239,10 +235,10 @@ class CoinManager:
     @staticmethod
     def get_ai_recreation_cost(post_count: int) -> int:
         """Get the cost for AI recreation based on post count"""
-        # Find the appropriate tier
-        for count, cost in sorted(CoinManager.AI_RECREATION_COSTS.items()):
-            if post_count <= count:
-                return cost
+        # Find the appropriate tier: the first one covering post_count
+        tier = bisect_left(CoinManager._AI_TIER_COUNTS, post_count)
+        if tier < len(CoinManager._AI_TIER_COSTS):
+            return CoinManager._AI_TIER_COSTS[tier]
         # If more than 50 posts, charge 10 + 2 for every additional 10 posts
         return 10 + ((post_count - 50) // 10) * 2
     
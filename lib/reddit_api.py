@@ -6,26 +6,45 @@ Handles all interactions with the Reddit Analyzer API
 import aiohttp
 import asyncio
 import logging
+import random
 from typing import Dict, Any, Optional, List
 
 logger = logging.getLogger(__name__)
 
 
 class RedditAPI:
+    MAX_CONCURRENT_ANALYSES = 10  # per analyze_many call
+    RETRY_BASE_DELAY = 1  # seconds, doubled per attempt
+    RETRY_MAX_DELAY = 30  # seconds, also caps a server's Retry-After
+
     def __init__(self, base_url: str):
         # Ensure URL has protocol
         if not base_url.startswith(('http://', 'https://')):
             base_url = f'https://{base_url}'
         self.base_url = base_url.rstrip('/')
         self._session = None
+        self._session_loop = None
         self._lock = asyncio.Lock()
         
     async def _ensure_session(self):
-        """Ensure aiohttp session exists"""
+        """Ensure an aiohttp session exists for the running event loop"""
+        loop = asyncio.get_running_loop()
+        if self._session_loop is not loop:
+            # Webhook handlers run every update on a fresh event loop (run_async),
+            # and a session can't be used from a loop other than its own. The old
+            # loop is already closed, so the session can't be awaited closed; with
+            # force_close it holds no sockets, and detach() marks it closed
+            if self._session:
+                self._session.detach()
+            self._session = None
+            self._session_loop = loop
+            self._lock = asyncio.Lock()
         if not self._session:
             async with self._lock:
                 if not self._session:
-                    # Create session with better timeout and connector settings
+                    # Create session with better timeout and connector settings.
+                    # No keep-alive: a pooled connection can't be reused by the
+                    # next update's loop, so it would only be left open
                     timeout = aiohttp.ClientTimeout(total=300, connect=30, sock_read=30)
                     connector = aiohttp.TCPConnector(
                         limit=100,  # Increased for concurrent requests
@@ -38,6 +57,18 @@ class RedditAPI:
                     )
         return self._session
             
+    @classmethod
+    def _retry_delay(cls, attempt: int, retry_after: Optional[str] = None) -> float:
+        """Full-jitter exponential backoff, so concurrent callers don't retry in
+        lockstep; never shorter than the server's Retry-After (in seconds)"""
+        delay = random.uniform(0, min(cls.RETRY_MAX_DELAY, cls.RETRY_BASE_DELAY * 2 ** attempt))
+        if retry_after:
+            try:
+                delay = max(delay, min(float(retry_after), cls.RETRY_MAX_DELAY))
+            except ValueError:
+                pass  # HTTP-date form; the jittered delay will do
+        return delay
+
     async def _make_request(self, method: str, endpoint: str, 
                           json_data: Optional[Dict] = None,
                           timeout: int = 180) -> Dict[str, Any]:
@@ -48,7 +79,6 @@ class RedditAPI:
         
         # Retry logic for resilience
         max_retries = 3
-        retry_delay = 1
         
         for attempt in range(max_retries):
             try:
@@ -70,8 +100,8 @@ class RedditAPI:
                         elif response.status >= 500:
                             # Retry for server errors
                             if attempt < max_retries - 1:
-                                await asyncio.sleep(retry_delay)
-                                retry_delay *= 2
+                                await asyncio.sleep(self._retry_delay(
+                                    attempt, response.headers.get('Retry-After')))
                                 continue
                         
                         return {"error": data.get("error", "Unknown API error")}
@@ -81,16 +111,14 @@ class RedditAPI:
             except asyncio.TimeoutError:
                 logger.error(f"Timeout error for {url} (attempt {attempt + 1}/{max_retries})")
                 if attempt < max_retries - 1:
-                    await asyncio.sleep(retry_delay)
-                    retry_delay *= 2
+                    await asyncio.sleep(self._retry_delay(attempt))
                     continue
                 return {"error": "Request timeout. The subreddit might be very large or the API is busy. Please try again."}
                 
             except aiohttp.ClientError as e:
                 logger.error(f"Client error for {url}: {e} (attempt {attempt + 1}/{max_retries})")
                 if attempt < max_retries - 1:
-                    await asyncio.sleep(retry_delay)
-                    retry_delay *= 2
+                    await asyncio.sleep(self._retry_delay(attempt))
                     continue
                 return {"error": f"Connection error: {str(e)}"}
                 
@@ -135,6 +163,17 @@ class RedditAPI:
             timeout=400
         )
 
+    async def analyze_many(self, subreddits: List[str], days: int = 7) -> List[Dict[str, Any]]:
+        """Analyze subreddits one request each, up to MAX_CONCURRENT_ANALYSES at a time
+        (results in input order)"""
+        semaphore = asyncio.Semaphore(self.MAX_CONCURRENT_ANALYSES)
+
+        async def guarded(subreddit: str) -> Dict[str, Any]:
+            async with semaphore:
+                return await self.analyze_subreddit(subreddit, days)
+
+        return await asyncio.gather(*(guarded(s) for s in subreddits))
+
     async def scrape_posts(self, subreddit: str, limit: int,
                           sort: str, time_filter: str) -> Dict[str, Any]:
         """Scrape posts from a subreddit"""
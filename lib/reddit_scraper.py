@@ -5,14 +5,50 @@ Handles all Reddit data collection and analysis
 
 import praw
 import os
+import asyncio
 import logging
-from datetime import datetime, timedelta
-from typing import Dict, List, Any, Optional
-from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from functools import partial, wraps
+from typing import Dict, List, Any, Optional, Tuple
+from collections import Counter, defaultdict
+from operator import attrgetter, itemgetter
+import heapq
 import statistics
+import time
+from cachetools import TTLCache
 
 logger = logging.getLogger(__name__)
 
+# PRAW blocks on HTTP and is not thread-safe, so its calls run one at a time
+# on a dedicated worker thread instead of on the event loop
+_praw_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='praw')
+
+# Author profile stats by username (see RedditScraper._author_stats); only
+# ever touched from the PRAW thread
+_author_cache = TTLCache(maxsize=2048, ttl=3600)
+
+
+def _off_loop(func):
+    """Turn a blocking PRAW method into a coroutine run on the PRAW thread"""
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_praw_executor, partial(func, *args, **kwargs))
+    return wrapper
+
+
+@dataclass(slots=True)
+class _Post:
+    """A submission's scoring fields (slotted: analyses hold hundreds of these)"""
+    title: str
+    score: int
+    comments: int
+    author: str
+    created: float
+    flair: str
+
 
 class RedditScraper:
     """Reddit scraper using PRAW"""
@@ -26,105 +62,114 @@ class RedditScraper:
         )
         logger.info("Reddit client initialized")
 
-    async def analyze_subreddit(self, subreddit_name: str, days: int = 7) -> Dict[str, Any]:
-        """Analyze a subreddit's performance"""
+    @staticmethod
+    def _post_from_submission(post) -> _Post:
+        """Extract the fields used for scoring from a PRAW submission"""
+        return _Post(
+            title=post.title,
+            score=post.score,
+            comments=post.num_comments,
+            author=str(post.author) if post.author else '[deleted]',
+            created=post.created_utc,
+            flair=post.link_flair_text or 'No Flair'
+        )
+
+    @staticmethod
+    def _build_analysis(subreddit_name: str, subscribers: int,
+                        posts: List[_Post], days: int) -> Dict[str, Any]:
+        """Compute subreddit metrics from collected posts"""
+        if not posts:
+            return {
+                'success': False,
+                'error': f'No posts found in the last {days} days'
+            }
+
+        # Calculate metrics
+        count = len(posts)
+        scores = [p.score for p in posts]
+
+        avg_score = statistics.fmean(scores)
+        median_score = statistics.median(scores)
+        avg_comments = statistics.fmean(p.comments for p in posts)
+        posts_per_day = count / days
+
+        # Calculate effectiveness score
+        engagement_score = min(100, (median_score / 100) * 100)
+        frequency_score = min(100, (posts_per_day / 10) * 100)
+        consistency_score = min(100, (sum(s >= median_score * 0.5 for s in scores) / count) * 100)
+
+        effectiveness_score = int((engagement_score + frequency_score + consistency_score) / 3)
+
+        # Get top post
+        top_post = max(posts, key=attrgetter('score'))
+
+        # Analyze posting times: per-hour score totals and post counts in one pass
+        hour_totals = defaultdict(lambda: [0, 0])
+        for p in posts:
+            bucket = hour_totals[int(p.created // 3600) % 24]  # UTC hour
+            bucket[0] += p.score
+            bucket[1] += 1
+
+        best_hours = heapq.nlargest(
+            3,
+            ({'hour': h, 'avg_score': total / n} for h, (total, n) in hour_totals.items()),
+            key=itemgetter('avg_score')
+        )
+
+        return {
+            'success': True,
+            'subreddit': subreddit_name,
+            'subscribers': subscribers,
+            'effectiveness_score': effectiveness_score,
+            'avg_score_per_post': round(avg_score, 1),
+            'median_score_per_post': round(median_score, 1),
+            'avg_comments_per_post': round(avg_comments, 1),
+            'avg_posts_per_day': round(posts_per_day, 1),
+            'posts_analyzed_for_scoring': len(posts),
+            'days_analyzed': days,
+            'top_post': {
+                'title': top_post.title,
+                'score': top_post.score,
+                'comments': top_post.comments,
+                'author': top_post.author,
+                'flair': top_post.flair
+            },
+            'posting_times': {
+                'best_hours': best_hours
+            },
+            'effectiveness_breakdown': {
+                'engagement_score': int(engagement_score),
+                'frequency_score': int(frequency_score),
+                'consistency_score': int(consistency_score)
+            },
+            'consistency_analysis': {
+                'good_posts_ratio': round((sum(s >= 50 for s in scores) / count) * 100, 1),
+                'great_posts_ratio': round((sum(s >= 100 for s in scores) / count) * 100, 1),
+                'distribution': 'varied'
+            }
+        }
+
+    def _analyze_one(self, subreddit_name: str, days: int,
+                     subscribers: Optional[int] = None) -> Dict[str, Any]:
+        """Analyze one subreddit on the PRAW thread (subscriber count fetched if not given)"""
         try:
             subreddit = self.reddit.subreddit(subreddit_name)
 
             # Get subreddit info
-            subscribers = subreddit.subscribers
+            if subscribers is None:
+                subscribers = subreddit.subscribers
 
             # Collect posts (reduced to 100 for speed on Vercel)
             posts = []
-            cutoff_time = datetime.now() - timedelta(days=days)
+            cutoff_ts = time.time() - days * 86400
 
             for post in subreddit.hot(limit=100):
-                post_time = datetime.fromtimestamp(post.created_utc)
-                if post_time < cutoff_time:
+                if post.created_utc < cutoff_ts:
                     continue
 
-                posts.append({
-                    'title': post.title,
-                    'score': post.score,
-                    'comments': post.num_comments,
-                    'author': str(post.author) if post.author else '[deleted]',
-                    'created': post.created_utc,
-                    'flair': post.link_flair_text or 'No Flair',
-                    'url': post.url
-                })
-
-            if not posts:
-                return {
-                    'success': False,
-                    'error': f'No posts found in the last {days} days'
-                }
+                posts.append(self._post_from_submission(post))
 
-            # Calculate metrics
-            scores = [p['score'] for p in posts]
-            comments = [p['comments'] for p in posts]
-
-            avg_score = statistics.mean(scores)
-            median_score = statistics.median(scores)
-            avg_comments = statistics.mean(comments)
-            posts_per_day = len(posts) / days
-
-            # Calculate effectiveness score
-            engagement_score = min(100, (median_score / 100) * 100)
-            frequency_score = min(100, (posts_per_day / 10) * 100)
-            consistency_score = min(100, (len([s for s in scores if s >= median_score * 0.5]) / len(scores)) * 100)
-
-            effectiveness_score = int((engagement_score + frequency_score + consistency_score) / 3)
-
-            # Get top post
-            top_post = max(posts, key=lambda x: x['score'])
-
-            # Analyze posting times
-            hours = [datetime.fromtimestamp(p['created']).hour for p in posts]
-            hour_scores = {}
-            for p in posts:
-                hour = datetime.fromtimestamp(p['created']).hour
-                if hour not in hour_scores:
-                    hour_scores[hour] = []
-                hour_scores[hour].append(p['score'])
-
-            best_hours = sorted(
-                [{'hour': h, 'avg_score': statistics.mean(scores)} for h, scores in hour_scores.items()],
-                key=lambda x: x['avg_score'],
-                reverse=True
-            )
-
-            return {
-                'success': True,
-                'subreddit': subreddit_name,
-                'subscribers': subscribers,
-                'effectiveness_score': effectiveness_score,
-                'avg_score_per_post': round(avg_score, 1),
-                'median_score_per_post': round(median_score, 1),
-                'avg_comments_per_post': round(avg_comments, 1),
-                'avg_posts_per_day': round(posts_per_day, 1),
-                'posts_analyzed_for_scoring': len(posts),
-                'days_analyzed': days,
-                'top_post': {
-                    'title': top_post['title'],
-                    'score': top_post['score'],
-                    'comments': top_post['comments'],
-                    'author': top_post['author'],
-                    'flair': top_post['flair']
-                },
-                'posting_times': {
-                    'best_hours': best_hours[:3]
-                },
-                'effectiveness_breakdown': {
-                    'engagement_score': int(engagement_score),
-                    'frequency_score': int(frequency_score),
-                    'consistency_score': int(consistency_score)
-                },
-                'consistency_analysis': {
-                    'good_posts_ratio': round((len([s for s in scores if s >= 50]) / len(scores)) * 100, 1),
-                    'great_posts_ratio': round((len([s for s in scores if s >= 100]) / len(scores)) * 100, 1),
-                    'distribution': 'varied'
-                }
-            }
+            return self._build_analysis(subreddit_name, subscribers, posts, days)
 
         except Exception as e:
             logger.error(f"Error analyzing subreddit {subreddit_name}: {e}")
@@ -133,8 +178,28 @@ class RedditScraper:
                 'error': str(e)
             }
 
-    async def search_subreddits(self, query: str, limit: int = 100) -> Dict[str, Any]:
-        """Search for subreddits"""
+    @_off_loop
+    def analyze_subreddit(self, subreddit_name: str, days: int = 7) -> Dict[str, Any]:
+        """Analyze a subreddit's performance"""
+        return self._analyze_one(subreddit_name, days)
+
+    @_off_loop
+    def analyze_subreddits_batch(self, subreddit_names: List[str], days: int = 7,
+                                       subscribers: Optional[Dict[str, int]] = None) -> List[Dict[str, Any]]:
+        """Analyze several subreddits in one trip to the PRAW thread.
+
+        Each subreddit gets its own listing, the same sample analyze_subreddit
+        uses, so results don't depend on which other subreddits are in the batch.
+        Known subscriber counts (e.g. from a search) skip the per-subreddit lookup.
+        """
+        subscribers = subscribers or {}
+        return [self._analyze_one(name, days, subscribers.get(name))
+                for name in subreddit_names]
+
+    @_off_loop
+    def search_subreddits(self, query: str, limit: int = 100,
+                          top: Optional[int] = None) -> Dict[str, Any]:
+        """Search for subreddits (only the `top` largest, if given)"""
         try:
             subreddits = []
 
@@ -147,7 +212,11 @@ class RedditScraper:
                 })
 
             # Sort by subscribers
-            subreddits.sort(key=lambda x: x['subscribers'], reverse=True)
+            by_subscribers = lambda x: x['subscribers'] or 0
+            if top is None:
+                subreddits.sort(key=by_subscribers, reverse=True)
+            else:
+                subreddits = heapq.nlargest(top, subreddits, key=by_subscribers)
 
             return {
                 'success': True,
@@ -162,7 +231,8 @@ class RedditScraper:
                 'error': str(e)
             }
 
-    async def get_rules(self, subreddit_name: str) -> Dict[str, Any]:
+    @_off_loop
+    def get_rules(self, subreddit_name: str) -> Dict[str, Any]:
         """Get subreddit rules"""
         try:
             subreddit = self.reddit.subreddit(subreddit_name)
@@ -189,7 +259,19 @@ class RedditScraper:
                 'error': str(e)
             }
 
-    async def analyze_requirements(self, subreddit_name: str) -> Dict[str, Any]:
+    @staticmethod
+    def _author_stats(author) -> Tuple[int, int, float]:
+        """(link karma, comment karma, created_utc) for a Redditor; each profile
+        costs a lazy HTTP fetch, so results are cached per username"""
+        stats = _author_cache.get(author.name)
+        if stats is None:
+            stats = _author_cache[author.name] = (
+                author.link_karma, author.comment_karma, author.created_utc
+            )
+        return stats
+
+    @_off_loop
+    def analyze_requirements(self, subreddit_name: str) -> Dict[str, Any]:
         """Analyze karma and account age requirements"""
         try:
             subreddit = self.reddit.subreddit(subreddit_name)
@@ -197,12 +279,14 @@ class RedditScraper:
             # Analyze recent posts to estimate requirements
             successful_authors = []
 
+            now = datetime.now()
             for post in subreddit.new(limit=50):
                 if post.author:
+                    post_karma, comment_karma, created_utc = self._author_stats(post.author)
                     successful_authors.append({
-                        'post_karma': post.author.link_karma,
-                        'comment_karma': post.author.comment_karma,
-                        'account_age': (datetime.now() - datetime.fromtimestamp(post.author.created_utc)).days
+                        'post_karma': post_karma,
+                        'comment_karma': comment_karma,
+                        'account_age': (now - datetime.fromtimestamp(created_utc)).days
                     })
 
             if not successful_authors:
@@ -211,20 +295,20 @@ class RedditScraper:
                     'error': 'Could not analyze requirements'
                 }
 
-            # Calculate minimums (10th percentile)
-            post_karmas = sorted([a['post_karma'] for a in successful_authors])
-            comment_karmas = sorted([a['comment_karma'] for a in successful_authors])
-            ages = sorted([a['account_age'] for a in successful_authors])
-
+            # Calculate minimums (10th percentile): only the lowest tenth is
+            # needed, so select it instead of sorting every list
             percentile_10 = int(len(successful_authors) * 0.1)
 
+            def lowest_tenth(key: str):
+                return heapq.nsmallest(percentile_10 + 1, (a[key] for a in successful_authors))[-1]
+
             return {
                 'success': True,
                 'subreddit': subreddit_name,
                 'karma_requirements': {
-                    'post_karma_min': post_karmas[percentile_10] if post_karmas else 0,
-                    'comment_karma_min': comment_karmas[percentile_10] if comment_karmas else 0,
-                    'account_age_days': ages[percentile_10] if ages else 0,
+                    'post_karma_min': lowest_tenth('post_karma'),
+                    'comment_karma_min': lowest_tenth('comment_karma'),
+                    'account_age_days': lowest_tenth('account_age'),
                     'confidence': 'estimated',
                     'requires_verification': False
                 }
@@ -237,33 +321,29 @@ class RedditScraper:
                 'error': str(e)
             }
 
-    async def analyze_flairs(self, subreddit_name: str) -> Dict[str, Any]:
+    @_off_loop
+    def analyze_flairs(self, subreddit_name: str) -> Dict[str, Any]:
         """Analyze flair performance"""
         try:
             subreddit = self.reddit.subreddit(subreddit_name)
 
-            flair_data = {}
+            # Running [score total, comment total, post count] per flair
+            flair_data = defaultdict(lambda: [0, 0, 0])
 
             for post in subreddit.hot(limit=200):
-                flair = post.link_flair_text or 'No Flair'
-
-                if flair not in flair_data:
-                    flair_data[flair] = {
-                        'scores': [],
-                        'comments': []
-                    }
-
-                flair_data[flair]['scores'].append(post.score)
-                flair_data[flair]['comments'].append(post.num_comments)
+                totals = flair_data[post.link_flair_text or 'No Flair']
+                totals[0] += post.score
+                totals[1] += post.num_comments
+                totals[2] += 1
 
             # Calculate averages
             flair_analysis = []
-            for flair, data in flair_data.items():
+            for flair, (score_total, comment_total, count) in flair_data.items():
                 flair_analysis.append({
                     'flair': flair,
-                    'post_count': len(data['scores']),
-                    'avg_score': round(statistics.mean(data['scores']), 1),
-                    'avg_comments': round(statistics.mean(data['comments']), 1)
+                    'post_count': count,
+                    'avg_score': round(score_total / count, 1),
+                    'avg_comments': round(comment_total / count, 1)
                 })
 
             # Sort by avg score
@@ -282,7 +362,8 @@ class RedditScraper:
                 'error': str(e)
             }
 
-    async def scrape_posts(self, subreddit_name: str, limit: int, sort: str, time_filter: str) -> Dict[str, Any]:
+    @_off_loop
+    def scrape_posts(self, subreddit_name: str, limit: int, sort: str, time_filter: str) -> Dict[str, Any]:
         """Scrape posts from subreddit"""
         try:
             subreddit = self.reddit.subreddit(subreddit_name)
@@ -3,33 +3,76 @@ Utilities module for Reddit Analyzer Bot
 Helper functions and utilities
 """
 
-import html
+from bisect import bisect_right
+from functools import lru_cache
 from typing import Union
 
 
+# Same replacements as html.escape(quote=True), applied in one pass
+_HTML_ESCAPES = str.maketrans({
+    '&': '&amp;',
+    '<': '&lt;',
+    '>': '&gt;',
+    '"': '&quot;',
+    "'": '&#x27;',
+})
+_HTML_SPECIAL_CHARS = ('&', '<', '>', '"', "'")
+# Only strings up to this length go through the escape cache; long titles and
+# descriptions rarely repeat and would just crowd out names that do
+ESCAPE_CACHE_MAX_LENGTH = 64
+
+
+# Message rendering formats the same subscriber counts and escapes the same
+# names over and over, so both keep a bounded cache of results
+@lru_cache(maxsize=4096)
+def format_int(num: int) -> str:
+    """Format an int with thousands separator"""
+    return f"{num:,}"
+
+
+@lru_cache(maxsize=2048)
+def _escape_str(text: str) -> str:
+    return text.translate(_HTML_ESCAPES)
+
+
 def format_number(num: Union[int, float]) -> str:
     """Format number with thousands separator"""
-    if isinstance(num, (int, float)):
+    if isinstance(num, int):
+        return format_int(num)
+    try:
         return f"{num:,}"
-    return str(num)
+    except (ValueError, TypeError):
+        return str(num)
 
 
 def escape_html(text: str) -> str:
     """Escape HTML special characters for Telegram"""
     if not text:
         return ""
-    return html.escape(str(text))
+    text = str(text)
+    # Most names and titles have nothing to escape; a few substring scans are
+    # cheaper than building a copy, and keep those strings out of the cache
+    if not any(char in text for char in _HTML_SPECIAL_CHARS):
+        return text
+    if len(text) <= ESCAPE_CACHE_MAX_LENGTH:
+        return _escape_str(text)
+    return text.translate(_HTML_ESCAPES)
+
 
+_DEFAULT_SUFFIX = "..."
+_DEFAULT_SUFFIX_LEN = len(_DEFAULT_SUFFIX)
 
-def truncate_text(text: str, max_length: int = 100, suffix: str = "...") -> str:
+
+def truncate_text(text: str, max_length: int = 100, suffix: str = _DEFAULT_SUFFIX) -> str:
     """Truncate text to specified length"""
     if len(text) <= max_length:
         return text
+    if suffix is _DEFAULT_SUFFIX:
+        return text[:max_length - _DEFAULT_SUFFIX_LEN] + _DEFAULT_SUFFIX
     return text[:max_length - len(suffix)] + suffix
 
 
-def format_time_12h(hour: int) -> str:
-    """Convert 24-hour time to 12-hour format"""
+def _hour_12h(hour: int) -> str:
     if hour == 0:
         return "12 AM"
     elif hour < 12:
@@ -40,6 +83,22 @@ def format_time_12h(hour: int) -> str:
         return f"{hour - 12} PM"
 
 
+_HOURS_12H = tuple(_hour_12h(hour) for hour in range(24))
+
+
+def format_time_12h(hour: int) -> str:
+    """Convert 24-hour time to 12-hour format"""
+    if 0 <= hour < 24:
+        return _HOURS_12H[hour]
+    return _hour_12h(hour)
+
+
+# Easiest first, indexed by how many thresholds a requirement meets
+_DIFFICULTY_TIERS = (("Easy", "🟢"), ("Medium", "🟡"), ("Hard", "🟠"), ("Very Hard", "🔴"))
+_KARMA_THRESHOLDS = (10, 100, 1000)
+_ACCOUNT_AGE_THRESHOLDS = (30, 90, 365)  # days
+
+
 def calculate_difficulty(post_karma: int, comment_karma: int, 
                         account_age: int, requires_verification: bool,
                         is_optional: bool = False) -> tuple[str, str]:
@@ -47,14 +106,13 @@ def calculate_difficulty(post_karma: int, comment_karma: int,
     # Don't count optional verification as "very hard"
     has_hard_verification = requires_verification and not is_optional
     
-    if post_karma >= 1000 or comment_karma >= 1000 or account_age >= 365 or has_hard_verification:
-        return "Very Hard", "🔴"
-    elif post_karma >= 100 or comment_karma >= 100 or account_age >= 90:
-        return "Hard", "🟠"
-    elif post_karma >= 10 or comment_karma >= 10 or account_age >= 30:
-        return "Medium", "🟡"
-    else:
-        return "Easy", "🟢"
+    if has_hard_verification:
+        return _DIFFICULTY_TIERS[-1]
+    # Each value lands in the tier of the highest threshold it meets
+    tier = max(bisect_right(_KARMA_THRESHOLDS, post_karma),
+               bisect_right(_KARMA_THRESHOLDS, comment_karma),
+               bisect_right(_ACCOUNT_AGE_THRESHOLDS, account_age))
+    return _DIFFICULTY_TIERS[tier]
 
 
 def format_percentage(value: float, decimals: int = 1) -> str:
@@ -64,6 +122,4 @@ def format_percentage(value: float, decimals: int = 1) -> str:
 
 def sanitize_subreddit_name(name: str) -> str:
     """Sanitize subreddit name (remove r/ prefix if present)"""
-    if name.startswith("r/"):
-        return name[2:]
-    return name
\ No newline at end of file
+    return name.removeprefix("r/")
\ No newline at end of file
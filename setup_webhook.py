@@ -4,31 +4,66 @@ Run this script to configure your bot's webhook URL
 """
 
 import os
+import json
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
 
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
 # Load environment variables
 load_dotenv()
 
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
+TELEGRAM_API = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}"
 VERCEL_URL = 'https://redditanalyzer-kappa.vercel.app'
+WEBHOOK_URL = f"{VERCEL_URL}/webhook"
+REQUEST_TIMEOUT = (3.05, 10)  # (connect, read) seconds
+
+# One session for every call, so requests to the same host share a kept-alive connection
+SESSION = requests.Session()
+# Transient 5xx responses are retried with backoff; the last response is
+# returned rather than raised so callers still report the status code
+RETRY = Retry(total=3, backoff_factor=0.3, status_forcelist=(500, 502, 503, 504),
+              raise_on_status=False)
+SESSION.mount('https://', HTTPAdapter(max_retries=RETRY, pool_connections=4, pool_maxsize=8))
+
+WEBHOOK_INFO_TEMPLATE = (
+    "\n📊 Current Webhook Info:\n"
+    "URL: {url}\n"
+    "Pending updates: {pending_update_count}\n"
+    "Last error: {last_error_message}\n"
+    "Last error date: {last_error_date}\n"
+    "Max connections: {max_connections}"
+)
+# Telegram omits fields that aren't set
+WEBHOOK_INFO_DEFAULTS = {
+    'url': 'Not set',
+    'pending_update_count': 0,
+    'last_error_message': 'None',
+    'last_error_date': 'N/A',
+    'max_connections': 'N/A',
+}
 
 def set_webhook():
     """Set the webhook URL for the Telegram bot"""
-    webhook_url = f"{VERCEL_URL}/webhook"
-
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/setWebhook"
+    url = f"{TELEGRAM_API}/setWebhook"
 
     payload = {
-        'url': webhook_url,
+        'url': WEBHOOK_URL,
         'drop_pending_updates': True  # Clear any pending updates
     }
 
-    print(f"Setting webhook to: {webhook_url}")
-    response = requests.post(url, json=payload)
+    print(f"Setting webhook to: {WEBHOOK_URL}")
+    response = SESSION.post(url, json=payload, timeout=REQUEST_TIMEOUT)
 
     if response.status_code == 200:
-        result = response.json()
+        result = json_loads(response.content)
         if result.get('ok'):
             print("✅ Webhook set successfully!")
             print(f"Response: {result}")
@@ -41,20 +76,15 @@ def set_webhook():
 
 def get_webhook_info():
     """Get current webhook information"""
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/getWebhookInfo"
+    url = f"{TELEGRAM_API}/getWebhookInfo"
 
-    response = requests.get(url)
+    response = SESSION.get(url, timeout=REQUEST_TIMEOUT)
 
     if response.status_code == 200:
-        result = response.json()
+        result = json_loads(response.content)
         if result.get('ok'):
             info = result.get('result', {})
-            print("\n📊 Current Webhook Info:")
-            print(f"URL: {info.get('url', 'Not set')}")
-            print(f"Pending updates: {info.get('pending_update_count', 0)}")
-            print(f"Last error: {info.get('last_error_message', 'None')}")
-            print(f"Last error date: {info.get('last_error_date', 'N/A')}")
-            print(f"Max connections: {info.get('max_connections', 'N/A')}")
+            print(WEBHOOK_INFO_TEMPLATE.format_map({**WEBHOOK_INFO_DEFAULTS, **info}))
             return info
         else:
             print("❌ Failed to get webhook info")
@@ -65,16 +95,16 @@ def get_webhook_info():
 
 def delete_webhook():
     """Delete the webhook (switch to polling mode)"""
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/deleteWebhook"
+    url = f"{TELEGRAM_API}/deleteWebhook"
 
     payload = {
         'drop_pending_updates': True
     }
 
-    response = requests.post(url, json=payload)
+    response = SESSION.post(url, json=payload, timeout=REQUEST_TIMEOUT)
 
     if response.status_code == 200:
-        result = response.json()
+        result = json_loads(response.content)
         if result.get('ok'):
             print("✅ Webhook deleted successfully!")
         else:
@@ -96,13 +126,18 @@ if __name__ == "__main__":
     print("\n1. Checking current webhook status...")
     current_info = get_webhook_info()
 
-    # Set the new webhook
-    print("\n2. Setting new webhook...")
-    set_webhook()
+    if (current_info and current_info.get('url') == WEBHOOK_URL
+            and not current_info.get('last_error_message')):
+        # Nothing to change, and the status above already confirms it
+        print("\n✅ Webhook already configured, skipping setup")
+    else:
+        # Set the new webhook
+        print("\n2. Setting new webhook...")
+        set_webhook()
 
-    # Verify the webhook was set
-    print("\n3. Verifying webhook configuration...")
-    get_webhook_info()
+        # Verify the webhook was set
+        print("\n3. Verifying webhook configuration...")
+        get_webhook_info()
 
     print("\n" + "=" * 50)
     print("Setup complete!")
@@ -4,50 +4,75 @@ Sends a test message to check webhook response
 """
 
 import os
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
 
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
 load_dotenv()
 
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
+TELEGRAM_API = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}"
 VERCEL_URL = 'https://redditanalyzer-kappa.vercel.app'
+REQUEST_TIMEOUT = (3.05, 10)  # (connect, read) seconds
+
+# One session for every call, so requests to the same host share a kept-alive connection
+SESSION = requests.Session()
+# Transient 5xx responses are retried with backoff; the last response is
+# returned rather than raised so callers still report the status code
+RETRY = Retry(total=3, backoff_factor=0.3, status_forcelist=(500, 502, 503, 504),
+              raise_on_status=False)
+SESSION.mount('https://', HTTPAdapter(max_retries=RETRY, pool_connections=4, pool_maxsize=8))
 
 def check_webhook_status():
     """Check current webhook configuration"""
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/getWebhookInfo"
+    url = f"{TELEGRAM_API}/getWebhookInfo"
 
-    response = requests.get(url)
+    response = SESSION.get(url, timeout=REQUEST_TIMEOUT)
     if response.status_code == 200:
-        data = response.json()
+        data = json_loads(response.content)
         if data.get('ok'):
             info = data.get('result', {})
-            print("📊 Webhook Status:")
-            print(f"   URL: {info.get('url', 'Not set')}")
-            print(f"   Pending updates: {info.get('pending_update_count', 0)}")
+            lines = [
+                "📊 Webhook Status:",
+                f"   URL: {info.get('url', 'Not set')}",
+                f"   Pending updates: {info.get('pending_update_count', 0)}",
+            ]
 
             last_error = info.get('last_error_message')
             if last_error:
-                print(f"   ⚠️  Last error: {last_error}")
-                print(f"   Error date: {info.get('last_error_date', 'Unknown')}")
-                return False
+                lines.append(f"   ⚠️  Last error: {last_error}")
+                lines.append(f"   Error date: {info.get('last_error_date', 'Unknown')}")
             else:
-                print(f"   ✅ No errors")
-                return True
+                lines.append(f"   ✅ No errors")
+            print("\n".join(lines))
+            return not last_error
     return False
 
 def get_bot_info():
     """Get bot information"""
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/getMe"
+    url = f"{TELEGRAM_API}/getMe"
 
-    response = requests.get(url)
+    response = SESSION.get(url, timeout=REQUEST_TIMEOUT)
     if response.status_code == 200:
-        data = response.json()
+        data = json_loads(response.content)
         if data.get('ok'):
             bot = data.get('result', {})
-            print("\n🤖 Bot Information:")
-            print(f"   Username: @{bot.get('username', 'Unknown')}")
-            print(f"   Name: {bot.get('first_name', 'Unknown')}")
-            print(f"   ID: {bot.get('id', 'Unknown')}")
+            print("\n".join([
+                "\n🤖 Bot Information:",
+                f"   Username: @{bot.get('username', 'Unknown')}",
+                f"   Name: {bot.get('first_name', 'Unknown')}",
+                f"   ID: {bot.get('id', 'Unknown')}",
+            ]))
             return bot
     return None
 
@@ -62,45 +87,55 @@ def test_vercel_endpoints():
     }
 
     all_good = True
-    for name, endpoint in endpoints.items():
-        try:
-            response = requests.get(f"{VERCEL_URL}{endpoint}", timeout=10)
-            if response.status_code == 200:
-                print(f"   ✅ {name}: OK")
-                if endpoint == '/database-health':
-                    data = response.json()
-                    if data.get('database') == 'connected':
-                        print(f"      Database: Connected")
-                        stats = data.get('stats', {})
-                        if stats:
-                            print(f"      Total users: {stats.get('total_users', 0)}")
-            else:
-                print(f"   ❌ {name}: HTTP {response.status_code}")
+    # The probes are independent, so run them side by side; total wait is the
+    # slowest endpoint instead of the sum of all three
+    with ThreadPoolExecutor(max_workers=len(endpoints)) as executor:
+        futures = {
+            executor.submit(SESSION.get, f"{VERCEL_URL}{endpoint}", timeout=REQUEST_TIMEOUT): name
+            for name, endpoint in endpoints.items()
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                response = future.result()
+                if response.status_code == 200:
+                    lines = [f"   ✅ {name}: OK"]
+                    if name == 'Database':
+                        data = json_loads(response.content)
+                        if data.get('database') == 'connected':
+                            lines.append(f"      Database: Connected")
+                            stats = data.get('stats', {})
+                            if stats:
+                                lines.append(f"      Total users: {stats.get('total_users', 0)}")
+                    print("\n".join(lines))
+                else:
+                    print(f"   ❌ {name}: HTTP {response.status_code}")
+                    all_good = False
+            except Exception as e:
+                print(f"   ❌ {name}: Error - {e}")
                 all_good = False
-        except Exception as e:
-            print(f"   ❌ {name}: Error - {e}")
-            all_good = False
 
     return all_good
 
 def get_updates():
     """Get recent updates (messages sent to bot)"""
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/getUpdates"
+    url = f"{TELEGRAM_API}/getUpdates"
 
-    response = requests.get(url)
+    response = SESSION.get(url, timeout=REQUEST_TIMEOUT)
     if response.status_code == 200:
-        data = response.json()
+        data = json_loads(response.content)
         if data.get('ok'):
             updates = data.get('result', [])
             print(f"\n📬 Recent Updates: {len(updates)} messages")
 
             if updates:
-                print("\n   Last 3 messages:")
+                lines = ["\n   Last 3 messages:"]
                 for update in updates[-3:]:
                     msg = update.get('message', {})
                     user = msg.get('from', {})
                     text = msg.get('text', 'No text')
-                    print(f"   - From @{user.get('username', 'Unknown')}: {text}")
+                    lines.append(f"   - From @{user.get('username', 'Unknown')}: {text}")
+                print("\n".join(lines))
             else:
                 print("   No messages yet. Send /start to your bot!")
 
@@ -132,32 +167,39 @@ def main():
     updates = get_updates()
 
     # Summary
-    print("\n" + "="*60)
-    print("  Summary")
-    print("="*60)
+    lines = [
+        "\n" + "="*60,
+        "  Summary",
+        "="*60,
+    ]
 
     if webhook_ok and vercel_ok:
-        print("\n✅ Everything looks good!")
-        print("\nNext steps:")
-        print("1. Open Telegram")
-        print(f"2. Search for @{bot_info.get('username')}")
-        print("3. Send: /start")
-        print("4. You should get a welcome message!")
+        lines += [
+            "\n✅ Everything looks good!",
+            "\nNext steps:",
+            "1. Open Telegram",
+            f"2. Search for @{bot_info.get('username')}",
+            "3. Send: /start",
+            "4. You should get a welcome message!",
+        ]
 
         if not updates:
-            print("\n💡 No messages received yet. Try sending /start to your bot now!")
+            lines.append("\n💡 No messages received yet. Try sending /start to your bot now!")
     else:
-        print("\n⚠️ Some issues detected:")
+        lines.append("\n⚠️ Some issues detected:")
         if not webhook_ok:
-            print("   - Webhook has errors")
+            lines.append("   - Webhook has errors")
         if not vercel_ok:
-            print("   - Vercel endpoints not responding properly")
-        print("\n💡 Check the errors above and:")
-        print("   1. Verify DATABASE_URL is set in Vercel")
-        print("   2. Verify TELEGRAM_BOT_TOKEN is set in Vercel")
-        print("   3. Make sure you redeployed after setting env vars")
-
-    print("\n" + "="*60 + "\n")
+            lines.append("   - Vercel endpoints not responding properly")
+        lines += [
+            "\n💡 Check the errors above and:",
+            "   1. Verify DATABASE_URL is set in Vercel",
+            "   2. Verify TELEGRAM_BOT_TOKEN is set in Vercel",
+            "   3. Make sure you redeployed after setting env vars",
+        ]
+
+    lines.append("\n" + "="*60 + "\n")
+    print("\n".join(lines))
 
 if __name__ == "__main__":
     main()